@@ -0,0 +1,144 @@
+#
+# lazy Tk file dialogs and message boxes for the command line tools
+#
+# Tk is only imported and initialized when a file dialog is really needed
+# (no --input given), so the tools start fast and also run on machines
+# without display and under a batch scheduler
+#
+# the message functions have the signature of tkMessageBox, they print to
+# the console unless a file dialog was used before (interactive use)
+#
+# pause() is the "Press any key" at the end of a run, needed when a tool
+# is started by double click (the console window closes at the end),
+# it only waits in interactive use or when requested (--pause), and
+# never without a terminal
+#
+# ----- LICENSE -----
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#    For more detail see the GNU General Public License.
+#    <http://www.gnu.org/licenses/>.
+#
+#    THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#    IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#    FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#    AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#    LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#    OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+#    THE SOFTWARE.
+#
+# ----- REQUIREMENTS -----
+#
+#    This program was developed under Python Version 2.7
+#    with the following additional libraries:
+#    - tkinter (only for the file dialogs)
+#
+
+from __future__ import print_function
+import sys
+import os
+
+_root = None   # hidden Tk root window, created by the first dialog
+_gui  = False  # True after the first file dialog
+
+
+def _tk():
+    global _root
+    if _root is None:
+        try: import Tkinter as tk # Python2
+        except ImportError: import tkinter as tk # Python3
+        root = tk.Tk(); root.withdraw() #hiding tkinter window
+        root.update()
+        # the following tries to disable showing hidden files/folders under linux
+        try: root.tk.call('tk_getOpenFile', '-foobarz')
+        except: pass
+        try: root.tk.call('namespace', 'import', '::tk::dialog::file::')
+        except: pass
+        try: root.tk.call('set', '::tk::dialog::file::showHiddenBtn', '1')
+        except: pass
+        try: root.tk.call('set', '::tk::dialog::file::showHiddenVar', '0')
+        except: pass
+        root.update()
+        _root = root
+    return _root
+
+
+def _filedialog():
+    try: import tkFileDialog as filedialog # Python2
+    except ImportError: from tkinter import filedialog # Python3
+    return filedialog
+
+
+def update():
+    if _root is not None: _root.update()
+
+
+def askopenfilename(**options):
+    # returns "" if no file was chosen or no dialog is possible (no display, no tkinter)
+    global _gui
+    try: root = _tk(); filedialog = _filedialog()
+    except Exception as e:
+        print ('ERROR: no file dialog possible ('+str(e).strip()+'), use the commandline options')
+        return ""
+    _gui = True
+    filename = filedialog.askopenfilename(**options)
+    root.update()
+    return filename if filename else ""
+
+
+def asksaveasfile(**options):
+    # returns None if no file was chosen or no dialog is possible
+    global _gui
+    try: root = _tk(); filedialog = _filedialog()
+    except Exception as e:
+        print ('ERROR: no file dialog possible ('+str(e).strip()+'), use the commandline options')
+        return None
+    _gui = True
+    result = filedialog.asksaveasfile(**options)
+    root.update()
+    return result
+
+
+def _message(kind, prefix, title, message):
+    if _gui:
+        try:
+            try: import tkMessageBox as messagebox # Python2
+            except ImportError: from tkinter import messagebox # Python3
+            getattr(messagebox, kind)(title, message); return
+        except Exception: pass
+    print (prefix+title+': '+message)
+
+
+def showerror(title, message):
+    _message('showerror', 'ERROR: ', title, message)
+
+
+def showwarning(title, message):
+    _message('showwarning', 'Warning: ', title, message)
+
+
+def showinfo(title, message):
+    _message('showinfo', '', title, message)
+
+
+def pause(requested=False):
+    if not (_gui or requested): return
+    try:
+        if not sys.stdin.isatty(): return
+    except (AttributeError, ValueError): return
+    if sys.platform=="win32": os.system("pause") # windows
+    else:
+        #os.system('read -s -n 1 -p "Press any key to continue...\n"')
+        import termios
+        print("Press any key to continue...")
+        fd = sys.stdin.fileno()
+        oldterm = termios.tcgetattr(fd)
+        newattr = termios.tcgetattr(fd)
+        newattr[3] = newattr[3] & ~termios.ICANON & ~termios.ECHO
+        termios.tcsetattr(fd, termios.TCSANOW, newattr)
+        try: result = sys.stdin.read(1)
+        except IOError: pass
+        finally: termios.tcsetattr(fd, termios.TCSAFLUSH, oldterm)
@@ -0,0 +1,280 @@
+#
+# native readers and writers for the file formats used in this project
+#
+# read_field returns the data as numpy array in the memory layout of a MHA
+# file, that is (dim1,dim2,dim3,channels) with the reverse of DimSize
+# (slowest axis first), plus spacing and offset of the 3 array axes
+# write_field writes such an array, the format is given by the extension:
+#    *.mha          : any MET type and number of channels
+#    *.fld          : AVS field files as used by PerGeos, the same conversion
+#                     as fld2mha / mha2fld (micrometer/s <-> cm/s, reversed
+#                     vector components, centered extent)
+#    *.nii *.nii.gz : via nibabel, RAS affine <-> ITK's LPS, the same
+#                     geometry ITK reads and writes (vectors as 5D intent vector)
+#    *.vti          : VTK image data, read by VTIReader.py (first point data
+#                     array), written as zlib compressed appended raw data
+# the MHA files are written with the TransformMatrix used everywhere
+# in this project (-1 0 0 0 -1 0 0 0 1) unless another direction is given,
+# the other formats always assume it
+# compressed and level (zlib 1=fastest ... 9=smallest) apply to MHA, VTI
+# and *.nii.gz (gzip), FLD files are never compressed
+# the phases (read, decompress, reorder, scale, compress, write) are
+# marked as spans of Profiling.py (see --profile of the tools)
+#
+# ----- LICENSE -----
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#    For more detail see the GNU General Public License.
+#    <http://www.gnu.org/licenses/>.
+#
+#    THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#    IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#    FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#    AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#    LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#    OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+#    THE SOFTWARE.
+#
+# ----- REQUIREMENTS -----
+#
+#    This program was developed under Python Version 2.7
+#    with the following additional libraries:
+#    - numpy
+#    - nibabel (only for NIFTI files)
+#
+
+from __future__ import print_function
+import os
+import zlib
+import gzip
+import numpy as np
+from GeometryMask import MHA_TYPES, read_mha_header
+from VTIReader import VTIFile, VTK_TYPES
+from Profiling import span
+
+FLD_SCALE = 10000.0 # FLD files are in micrometer/s, MHA files in cm/s
+VTI_BLOCK = 1024*1024 # uncompressed size of the zlib blocks of VTI files
+
+
+def file_format(filename):
+    # returns the format handled natively ('mha','fld','nifti','vti') or None
+    name = filename.lower()
+    if name.endswith('.mha'): return 'mha'
+    if name.endswith('.fld'): return 'fld'
+    if name.endswith('.nii') or name.endswith('.nii.gz'): return 'nifti'
+    if name.endswith('.vti'): return 'vti'
+    return None
+
+
+def read_mha(filename):
+    with span('header'): header = read_mha_header(filename)
+    if header.get('ObjectType', 'Image') != 'Image': raise ValueError('ObjectType must be "Image"')
+    if header.get('NDims') != '3': raise ValueError('Parameter "NDims"<>3 not implemented')
+    if header.get('ElementDataFile') != 'LOCAL': raise ValueError('Parameter "ElementDataFile" must be "LOCAL"')
+    try: dtype = np.dtype(MHA_TYPES[header['ElementType']])
+    except KeyError: raise ValueError('ElementType "'+header.get('ElementType','')+'" not implemented')
+    dtype = dtype.newbyteorder('>' if header.get('BinaryDataByteOrderMSB', 'False') == 'True' else '<')
+    dims = [int(n) for n in header['DimSize'].split()]
+    channels = int(header.get('ElementNumberOfChannels', 1))
+    shape = (dims[2], dims[1], dims[0], channels)
+    with span('read') as s:
+        with open(filename, "rb") as f:
+            f.seek(header['HeaderSize'])
+            rawdata = f.read()
+        s.nbytes = len(rawdata)
+    if header.get('CompressedData', 'False') == 'True':
+        with span('decompress') as s: rawdata = zlib.decompress(rawdata); s.nbytes = len(rawdata)
+    count = shape[0]*shape[1]*shape[2]*channels
+    if len(rawdata) < count*dtype.itemsize: raise ValueError('Data length less than expected')
+    data = np.frombuffer(rawdata, dtype=dtype, count=count).reshape(shape)
+    spacing = tuple(float(s) for s in header['ElementSpacing'].split()[::-1])
+    offset  = tuple(float(s) for s in header.get('Offset', '0 0 0').split()[::-1])
+    return data, spacing, offset
+
+
+def _mha_header(shape, dtype, spacing, offset, data_size=None, direction=None):
+    # shape (dim1,dim2,dim3,channels), data_size only for compressed data
+    types = dict((np.dtype(t), name) for name, t in MHA_TYPES.items())
+    try: element_type = types[np.dtype(dtype).newbyteorder('=')]
+    except KeyError: raise ValueError('data type '+str(dtype)+' not implemented')
+    header  = 'ObjectType = Image\n'
+    header += 'NDims=3\n'
+    header += 'BinaryData = True\n'
+    header += 'BinaryDataByteOrderMSB = False\n'
+    if data_size is not None:
+        header += 'CompressedData = True\n'
+        header += 'CompressedDataSize = '+str(data_size)+'\n'
+    else:
+        header += 'CompressedData = False\n'
+    if direction is None: header += 'TransformMatrix = -1 0 0 0 -1 0 0 0 1\n'
+    else: header += 'TransformMatrix = '+' '.join('%g' % d for d in direction)+'\n'
+    header += 'Offset = '+str(offset[2])+' '+str(offset[1])+' '+str(offset[0])+'\n'
+    header += 'CenterOfRotation = 0 0 0\n'
+    header += 'AnatomicalOrientation = LPI\n'
+    header += 'ElementSpacing ='+str(spacing[2])+' '+str(spacing[1])+' '+str(spacing[0])+'\n'
+    header += 'DimSize = '+str(int(shape[2]))+' '+str(int(shape[1]))+' '+str(int(shape[0]))+'\n'
+    header += 'ElementNumberOfChannels = '+str(int(shape[3]))+'\n'
+    header += 'ElementType = '+element_type+'\n'
+    header += 'ElementDataFile = LOCAL\n'
+    return header
+
+
+def write_mha(filename, data, spacing, offset, compressed=True, level=6, direction=None):
+    with span('reorder', data.nbytes):
+        data = np.ascontiguousarray(data, dtype=np.dtype(data.dtype).newbyteorder('<'))
+        rawdata = data.tobytes()
+    data_size = None
+    if compressed:
+        with span('compress', len(rawdata)): rawdata = zlib.compress(rawdata, level); data_size = len(rawdata)
+    with span('write', len(rawdata)):
+        with open(filename, "wb") as f:
+            f.write(_mha_header(data.shape, data.dtype, spacing, offset, data_size, direction).encode('ascii'))
+            f.write(rawdata)
+
+
+def read_fld(filename):
+    header = {}
+    with span('read') as s: # header and data
+        with open(filename, "rb") as f:
+            while True:
+                line = f.readline()
+                if not line: raise ValueError('end of FLD header not found')
+                if line.startswith(b'\x0c\x0c'): break
+                line = line.decode('latin-1')
+                if line.startswith('#') or not '=' in line: continue
+                (param_name, value) = line.split('=',1)
+                header[param_name.strip()] = value.strip()
+            data_start = f.tell()-len(line)+2 # the data follows the two 0C's
+            for param in ['ndim','dim1','dim2','dim3','veclen','data','field','min_ext','max_ext']:
+                if not param in header: raise ValueError('Parameter "'+param+'" not found in FLD header')
+            if header['ndim'] != '3': raise ValueError('Parameter "ndim"<>3 not implemented')
+            if header['data'] != 'float': raise ValueError('Data types other than float not implemented')
+            if header['field'] != 'uniform': raise ValueError('Field types other than uniform not implemented')
+            dim1, dim2, dim3 = int(header['dim1']), int(header['dim2']), int(header['dim3'])
+            veclen = int(header['veclen'])
+            f.seek(data_start)
+            data = np.fromfile(f, dtype='>f4', count=dim1*dim2*dim3*veclen)
+        s.nbytes = data.nbytes
+    if data.size < dim1*dim2*dim3*veclen: raise ValueError('dimension problem in FLD data')
+    min_ext = [float(v) for v in header['min_ext'].split()]
+    max_ext = [float(v) for v in header['max_ext'].split()]
+    resolution = [(max_ext[i]-min_ext[i])/(n-1) for i, n in enumerate([dim1, dim2, dim3])]
+    with span('reorder', data.nbytes):
+        data = data.reshape(dim3,dim2,dim1,veclen).transpose(2,1,0,3)[:,:,:,::-1].astype(np.float32)
+    with span('scale', data.nbytes): data = data/FLD_SCALE # conversion from micrometer/s to cm/s
+    offset = (-(dim1//2)*resolution[0], (dim2//2)*resolution[1], (dim3//2)*resolution[2])
+    return data, tuple(resolution), offset
+
+
+def write_fld(filename, data, spacing, offset=None):
+    dim1, dim2, dim3, veclen = data.shape
+    max_ext = [(n-1)*spacing[i]/2. for i, n in enumerate([dim1, dim2, dim3])]
+    with open(filename, "wb") as f:
+        header  = '# AVS field file\n'
+        header += '# written for PerGeos\n'
+        header += '#\n'
+        header += 'ndim=3\n'
+        header += 'dim1='+str(int(dim1))+'\n'
+        header += 'dim2='+str(int(dim2))+'\n'
+        header += 'dim3='+str(int(dim3))+'\n'
+        header += 'nspace=3\n'
+        header += 'veclen='+str(int(veclen))+'\n'
+        header += 'data=float\n'
+        header += 'field=uniform\n'
+        header += 'min_ext='+str(-max_ext[0])+' '+str(-max_ext[1])+' '+str(-max_ext[2])+'\n'
+        header += 'max_ext='+str(max_ext[0])+' '+str(max_ext[1])+' '+str(max_ext[2])+'\n'
+        f.write(header.encode('ascii')+b'\x0c\x0c')
+        with span('scale', data.nbytes): data = data*FLD_SCALE # conversion from cm/s to micrometer/s
+        with span('reorder', data.nbytes): data = np.ascontiguousarray(data[:,:,:,::-1].transpose(2,1,0,3), dtype='>f4')
+        with span('write', data.nbytes): data.tofile(f)
+
+
+def read_nifti(filename):
+    import nibabel as nib
+    with span('read') as s: # and gzip decompress
+        image = nib.load(filename)
+        data = np.asanyarray(image.dataobj); s.nbytes = data.nbytes
+    if data.ndim == 5 and data.shape[3] == 1: data = data[:,:,:,0,:] # intent vector
+    if data.ndim == 3: data = data[:,:,:,np.newaxis]
+    if data.ndim != 4: raise ValueError('only 3D NIFTI images implemented')
+    affine = image.affine
+    spacing = [float(s) for s in image.header.get_zooms()[0:3]]
+    offset = [-affine[0,3], -affine[1,3], affine[2,3]] # RAS -> LPS
+    return data.transpose(2,1,0,3), tuple(spacing[::-1]), tuple(offset[::-1])
+
+
+def write_nifti(filename, data, spacing, offset, compressed=True, level=6):
+    import nibabel as nib
+    data = data.transpose(2,1,0,3)
+    affine = np.diag([spacing[2], spacing[1], spacing[0], 1.])
+    affine[0:3,3] = [-offset[2], -offset[1], offset[0]] # LPS -> RAS
+    if data.shape[3] == 1: data = data[:,:,:,0]
+    else: data = data[:,:,:,np.newaxis,:]
+    image = nib.Nifti1Image(np.ascontiguousarray(data), affine)
+    if data.ndim == 5: image.header.set_intent('vector')
+    if not filename.lower().endswith('.gz'):
+        with span('write', data.nbytes): nib.save(image, filename)
+        return
+    # the level is passed to this file only, batch conversions run in parallel threads
+    with span('write', data.nbytes), gzip.GzipFile(filename, 'wb', level if compressed else 0) as f:
+        image.to_file_map(image.make_file_map({'image': f})) # and gzip compress
+
+
+def read_vti(filename, name=None):
+    vti = VTIFile(filename)
+    if len(vti.arrays) == 0: raise ValueError('no point data array found')
+    data = vti.read(vti.arrays[0] if name is None else name)
+    offset = (-vti.origin[2], vti.origin[1], vti.origin[0]) # the same as vti2mha
+    return data, tuple(vti.spacing[::-1]), offset
+
+
+def write_vti(filename, data, spacing, offset, compressed=True, level=6, name=None):
+    data = np.ascontiguousarray(data)
+    types = dict((np.dtype(t), vtkname) for vtkname, t in VTK_TYPES.items())
+    try: vtktype = types[data.dtype.newbyteorder('=')]
+    except KeyError: raise ValueError('data type '+str(data.dtype)+' not implemented')
+    if name is None: name = 'velocity' if data.shape[3] == 3 else 'scalars'
+    with span('reorder', data.nbytes): rawdata = data.astype(data.dtype.newbyteorder('<'), copy=False).tobytes()
+    if compressed:
+        with span('compress', len(rawdata)):
+            blocks = [zlib.compress(rawdata[i:i+VTI_BLOCK], level) for i in range(0, max(1, len(rawdata)), VTI_BLOCK)]
+        last = len(rawdata)-(len(blocks)-1)*VTI_BLOCK
+        sizes = [len(blocks), VTI_BLOCK, last]+[len(block) for block in blocks]
+        appended = np.array(sizes, dtype='<u8').tobytes()+b''.join(blocks)
+    else:
+        appended = np.array([len(rawdata)], dtype='<u8').tobytes()+rawdata
+    extent = '0 '+str(data.shape[2]-1)+' 0 '+str(data.shape[1]-1)+' 0 '+str(data.shape[0]-1)
+    header  = '<?xml version="1.0"?>\n'
+    header += '<VTKFile type="ImageData" version="1.0" byte_order="LittleEndian" header_type="UInt64"'
+    header += ' compressor="vtkZLibDataCompressor">\n' if compressed else '>\n'
+    header += '  <ImageData WholeExtent="'+extent+'" Origin="'+str(offset[2])+' '+str(offset[1])+' '+str(-offset[0])
+    header += '" Spacing="'+str(spacing[2])+' '+str(spacing[1])+' '+str(spacing[0])+'">\n'
+    header += '    <Piece Extent="'+extent+'">\n'
+    header += '      <PointData>\n'
+    header += '        <DataArray type="'+vtktype+'" Name="'+name+'" NumberOfComponents="'+str(data.shape[3])
+    header += '" format="appended" offset="0"/>\n'
+    header += '      </PointData>\n'
+    header += '    </Piece>\n'
+    header += '  </ImageData>\n'
+    header += '  <AppendedData encoding="raw">\n   _'
+    with span('write', len(appended)), open(filename, "wb") as f:
+        f.write(header.encode('ascii'))
+        f.write(appended)
+        f.write(b'\n  </AppendedData>\n</VTKFile>\n')
+
+
+READERS = {'mha':read_mha, 'fld':read_fld, 'nifti':read_nifti, 'vti':read_vti}
+
+def read_field(filename):
+    return READERS[file_format(filename)](filename)
+
+def write_field(filename, data, spacing, offset, compressed=True, level=6, direction=None):
+    fmt = file_format(filename)
+    if fmt == 'mha': write_mha(filename, data, spacing, offset, compressed, level, direction)
+    elif fmt == 'fld': write_fld(filename, data, spacing, offset)
+    elif fmt == 'nifti': write_nifti(filename, data, spacing, offset, compressed, level)
+    elif fmt == 'vti': write_vti(filename, data, spacing, offset, compressed, level)
+    else: raise ValueError('unknown file format "'+os.path.basename(filename)+'"')
@@ -0,0 +1,389 @@
+#
+# compact geometry masks and label volumes
+#
+# PackedMask stores a binary mask (e.g. a segmented porous medium or the
+# Digital_Phantom tube) with 1 bit per voxel using numpy.packbits.
+# The bits are packed along the last axis, that is the array has the
+# shape (dim1, dim2, ceil(dim3/8)), so that slabs along the first axis
+# (MHA files are stored that way) as well as chunks of 8 planes along the
+# last axis (NIFTI files are stored that way) can be unpacked/packed
+# in one vectorized operation without ever holding the full volume.
+#
+# prune_mask removes pore clusters that do not percolate along the flow
+# axis and crops the volume to the remaining pore space
+#
+# read_mask / read_labels and write_mask convert from and to
+# uint8 NIFTI (*.nii, *.nii.gz) and MHA (*.mha) files,
+# streaming the data slab by slab
+#
+# the axis ordering is the same as everywhere in this project:
+#    NIFTI: as returned by nibabel
+#    MHA  : reverse of DimSize, the same as the pure python MHA readers
+#
+# ----- LICENSE -----
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#    For more detail see the GNU General Public License.
+#    <http://www.gnu.org/licenses/>.
+#
+#    THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#    IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#    FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#    AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#    LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#    OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+#    THE SOFTWARE.
+#
+# ----- REQUIREMENTS -----
+#
+#    This program was developed under Python Version 2.7
+#    with the following additional libraries:
+#    - numpy
+#    - nibabel (only for NIFTI files)
+#    - scipy (only for prune_mask)
+#
+
+from __future__ import print_function
+import os
+import gzip
+import zlib
+import numpy as np
+
+SLAB_BYTES = 64*1024*1024 # approx. size of the uncompressed data handled at once
+
+MHA_TYPES = {'MET_UCHAR':'u1', 'MET_CHAR':'i1', 'MET_USHORT':'u2', 'MET_SHORT':'i2',
+             'MET_UINT':'u4', 'MET_INT':'i4', 'MET_FLOAT':'f4', 'MET_DOUBLE':'f8'}
+
+
+class PackedMask(object):
+    def __init__(self, shape):
+        self.shape  = tuple(int(n) for n in shape)
+        self.packed = np.zeros(shape=(self.shape[0],self.shape[1],(self.shape[2]+7)//8), dtype=np.uint8)
+
+    @classmethod
+    def from_array(cls, data, slab_size=None):
+        # data is anything nonzero-able with 3 dimensions (also broadcasted views)
+        mask = cls(data.shape)
+        if slab_size is None: slab_size = mask.slab_size()
+        for start in range(0, mask.shape[0], slab_size):
+            mask.set_slab(start, data[start:start+slab_size])
+        return mask
+
+    @property
+    def nbytes(self):
+        return self.packed.nbytes
+
+    def slab_size(self, itemsize=1):
+        return max(1, SLAB_BYTES//(self.shape[1]*self.shape[2]*itemsize))
+
+    def slab(self, start, stop):
+        # unpack the bool values of start..stop-1 along the first axis
+        return np.unpackbits(self.packed[start:stop], axis=2)[:,:,0:self.shape[2]].astype(bool)
+
+    def set_slab(self, start, values):
+        values = np.asarray(values) != 0
+        self.packed[start:start+values.shape[0]] = np.packbits(values, axis=2)
+
+    def chunk(self, start, stop):
+        # unpack planes start..stop-1 along the last axis
+        stop = min(stop, self.shape[2])
+        bits = np.unpackbits(self.packed[:,:,start//8:(stop+7)//8], axis=2)
+        return bits[:,:,start%8:start%8+stop-start].astype(bool)
+
+    def planes(self, axis, start, stop):
+        # unpack planes start..stop-1 along any axis
+        if axis == 0: return self.slab(start, stop)
+        if axis == 2: return self.chunk(start, stop)
+        return np.unpackbits(self.packed[:,start:stop], axis=2)[:,:,0:self.shape[2]].astype(bool)
+
+    def set_chunk(self, start, values):
+        if start%8 != 0: raise ValueError('chunk start must be a multiple of 8')
+        values = np.asarray(values) != 0
+        self.packed[:,:,start//8:(start+values.shape[2]+7)//8] = np.packbits(values, axis=2)
+
+    def count_nonzero(self):
+        # padding bits are always zero, so counting the packed bits is exact
+        bitcount = np.unpackbits(np.arange(256, dtype=np.uint8)[:,np.newaxis], axis=1).sum(axis=1)
+        return int(np.sum(bitcount[self.packed], dtype=np.int64))
+
+    def to_array(self, dtype=np.uint8):
+        data = np.zeros(shape=self.shape, dtype=dtype)
+        slab_size = self.slab_size()
+        for start in range(0, self.shape[0], slab_size):
+            data[start:start+slab_size] = self.slab(start, start+slab_size)
+        return data
+
+
+class PalabosGeometry(object):
+    # view of a mask or label volume in the order of the permeability.cpp geometry:
+    # the flow axis becomes x (slowest), z is the fastest axis
+    #    flow axis 0: (x,y,z) = (0,1,2)
+    #    flow axis 1: (x,y,z) = (1,0,2)
+    #    flow axis 2: (x,y,z) = (2,1,0), the NIFTI storage order
+    # a PackedMask (nonzero=pore) is tagged as
+    #    0 = fluid
+    #    1 = bounce-back, solid cells reached by a D3Q19 link from a fluid cell
+    #    2 = no-dynamics, all other solid cells (no collision work at all)
+    # with no_dynamics=False all solid cells are tagged as bounce-back
+    AXES = {0:(0,1,2), 1:(1,0,2), 2:(2,1,0)}
+    FLUID, BOUNCE_BACK, NO_DYNAMICS = 0, 1, 2
+    # D3Q19 neighbourhood: all offsets with one or two nonzero components
+    LINKS = [(i,j,k) for i in (-1,0,1) for j in (-1,0,1) for k in (-1,0,1) if 0 < abs(i)+abs(j)+abs(k) < 3]
+
+    def __init__(self, volume, flow_axis=2, no_dynamics=True):
+        self.volume = volume
+        self.axes   = self.AXES[flow_axis]
+        self.shape  = tuple(volume.shape[i] for i in self.axes)
+        self.no_dynamics = no_dynamics
+
+    def fluid(self, start, stop):
+        # bool fluid planes start..stop-1 in geometry order, empty outside the volume
+        data = np.zeros(shape=(stop-start,)+self.shape[1:3], dtype=bool)
+        first = max(start, 0); last = min(stop, self.shape[0])
+        if first < last:
+            data[first-start:last-start] = np.transpose(self.volume.planes(self.axes[0], first, last), self.axes)
+        return data
+
+    def slab(self, start, stop):
+        if not isinstance(self.volume, PackedMask):
+            index = [slice(None)]*3; index[self.axes[0]] = slice(start, stop)
+            return np.transpose(self.volume[tuple(index)], self.axes)
+        stop = min(stop, self.shape[0])
+        if not self.no_dynamics:
+            return np.where(self.fluid(start, stop), self.FLUID, self.BOUNCE_BACK).astype(np.uint8)
+        # morphological dilation of the fluid with the D3Q19 links, one plane halo along x
+        # and zero padding along y,z (cells outside the domain are never fluid)
+        fluid = np.pad(self.fluid(start-1, stop+1), ((0,0),(1,1),(1,1)), mode='constant')
+        n, ny, nz = stop-start, self.shape[1], self.shape[2]
+        dilated = np.zeros(shape=(n,ny,nz), dtype=bool)
+        for i, j, k in self.LINKS:
+            dilated |= fluid[1+i:1+i+n, 1+j:1+j+ny, 1+k:1+k+nz]
+        core = fluid[1:1+n, 1:1+ny, 1:1+nz]
+        tags = np.full((n,ny,nz), self.NO_DYNAMICS, dtype=np.uint8)
+        tags[dilated] = self.BOUNCE_BACK
+        tags[core] = self.FLUID
+        return tags
+
+    def count_tags(self):
+        # number of cells per tag, evaluated slab by slab
+        counts = np.zeros(256, dtype=np.int64)
+        slab_size = max(1, SLAB_BYTES//(self.shape[1]*self.shape[2]*4))
+        for start in range(0, self.shape[0], slab_size):
+            counts += np.bincount(self.slab(start, start+slab_size).ravel(), minlength=256)
+        return counts
+
+def prune_mask(mask, flow_axis=2, margin=1):
+    # percolation analysis of a PackedMask (nonzero=pore):
+    # keeps only the pore clusters connected from the first to the last plane
+    # along the flow axis (D3Q19 connectivity, faces and edges), and crops
+    # the transverse axes to the bounding box of the remaining pores plus a
+    # solid margin for the bounce-back walls
+    # returns the cropped PackedMask, the crop start index of each axis and statistics
+    from scipy import ndimage
+    fluid = mask.to_array(bool)
+    labels, nclusters = ndimage.label(fluid, structure=ndimage.generate_binary_structure(3,2))
+    sizes = np.bincount(labels.ravel(), minlength=nclusters+1)
+    inlet  = np.unique(np.take(labels, 0, axis=flow_axis))
+    outlet = np.unique(np.take(labels, mask.shape[flow_axis]-1, axis=flow_axis))
+    spanning = np.intersect1d(inlet, outlet)
+    spanning = spanning[spanning != 0]
+    if len(spanning) == 0: raise ValueError('no pore cluster connects inlet and outlet')
+    keep = np.zeros(nclusters+1, dtype=bool); keep[spanning] = True
+    fluid = keep[labels]
+    del labels
+    crop = []
+    for axis in range(3):
+        if axis == flow_axis: crop.append(slice(0, mask.shape[axis])); continue
+        other = tuple(a for a in range(3) if a != axis)
+        used = np.nonzero(np.any(fluid, axis=other))[0]
+        crop.append(slice(max(used[0]-margin, 0), min(used[-1]+1+margin, mask.shape[axis])))
+    pruned = PackedMask.from_array(fluid[tuple(crop)])
+    cells = float(np.prod(mask.shape))
+    stats = {'clusters'          : int(nclusters),
+             'spanning_clusters' : int(len(spanning)),
+             'porosity'          : sizes[1:].sum()/cells,
+             'connected_porosity': sizes[spanning].sum()/cells,
+             'removed_pores'     : int(sizes[1:].sum()-sizes[spanning].sum()),
+             'shape'             : pruned.shape,
+             'cell_fraction'     : np.prod(pruned.shape)/cells}
+    return pruned, tuple(int(c.start) for c in crop), stats
+
+def _slab(volume, start, stop):
+    if isinstance(volume, np.ndarray): return np.asarray(volume[start:stop], dtype=np.uint8)
+    return np.ascontiguousarray(volume.slab(start, stop), dtype=np.uint8)
+
+def _chunk(volume, start, stop):
+    if isinstance(volume, np.ndarray): return np.asarray(volume[:,:,start:stop], dtype=np.uint8)
+    return volume.chunk(start, stop).astype(np.uint8)
+
+def _is_nifti(filename):
+    return filename.endswith('.nii') or filename.endswith('.nii.gz')
+
+
+def read_mha_header(filename):
+    # returns the header dictionary, "HeaderSize" is the position where the data starts
+    header = {}
+    with open(filename, "rb") as f:
+        while True:
+            line = f.readline()
+            if not line: raise ValueError('Parameter "ElementDataFile" not found in MHA header')
+            (param_name, current_line) = line.decode('latin-1').split('=',1) #split at "=" and strip of spaces
+            header[param_name.strip()] = current_line.strip()
+            if param_name.strip() == 'ElementDataFile': break
+        header['HeaderSize'] = f.tell()
+    return header
+
+def _mha_chunks(filename):
+    # yields slabs along the first axis, decompressing on the fly
+    header = read_mha_header(filename)
+    if header.get('NDims') != '3': raise ValueError('Parameter "NDims"<>3 not implemented')
+    if header.get('ElementNumberOfChannels', '1') != '1': raise ValueError('only scalar MHA images implemented')
+    if header.get('ElementDataFile') != 'LOCAL': raise ValueError('Parameter "ElementDataFile" must be "LOCAL"')
+    try: dtype = np.dtype(MHA_TYPES[header['ElementType']])
+    except KeyError: raise ValueError('ElementType "'+header.get('ElementType','')+'" not implemented')
+    dtype = dtype.newbyteorder('>' if header.get('BinaryDataByteOrderMSB', 'False') == 'True' else '<')
+    dims = [int(n) for n in header['DimSize'].split()]
+    shape = (dims[2], dims[1], dims[0])
+    spacing = tuple(float(s) for s in header['ElementSpacing'].split()[::-1])
+    yield shape, spacing
+    slab_size  = max(1, SLAB_BYTES//(shape[1]*shape[2]*dtype.itemsize))
+    slab_bytes = shape[1]*shape[2]*dtype.itemsize
+    decompressor = None
+    if header.get('CompressedData', 'False') == 'True': decompressor = zlib.decompressobj()
+    with open(filename, "rb") as f:
+        f.seek(header['HeaderSize'])
+        buffer = bytearray()
+        for start in range(0, shape[0], slab_size):
+            n = min(slab_size, shape[0]-start)
+            while len(buffer) < n*slab_bytes:
+                raw = f.read(SLAB_BYTES)
+                if not raw: raise ValueError('Data length less than expected')
+                if decompressor is not None: raw = decompressor.decompress(raw)
+                buffer += raw
+            data = np.frombuffer(bytes(buffer[0:n*slab_bytes]), dtype=dtype).reshape(n, shape[1], shape[2])
+            del buffer[0:n*slab_bytes]
+            yield 0, start, data
+
+def _nifti_chunks(filename):
+    # yields chunks of planes along the last axis (contiguous in NIFTI files)
+    import nibabel as nib
+    opener = gzip.open if filename.endswith('.gz') else open
+    with opener(filename, "rb") as f:
+        header = nib.Nifti1Header.from_fileobj(f)
+        shape = tuple(int(n) for n in header.get_data_shape()[0:3])
+        if len(header.get_data_shape()) > 3 and np.prod(header.get_data_shape()[3:]) != 1:
+            raise ValueError('only 3D NIFTI images implemented')
+        spacing = tuple(float(s) for s in header.get_zooms()[0:3])
+        yield shape, spacing
+        dtype = header.get_data_dtype()
+        slope, inter = header.get_slope_inter()
+        if slope is None: slope = 1.
+        if inter is None: inter = 0.
+        plane_bytes = shape[0]*shape[1]*dtype.itemsize
+        chunk_size = max(8, (SLAB_BYTES//plane_bytes)//8*8) # multiple of 8 planes
+        f.read(int(header.get_data_offset())-f.tell()) # gzip files can only be read sequentially
+        for start in range(0, shape[2], chunk_size):
+            n = min(chunk_size, shape[2]-start)
+            raw = f.read(n*plane_bytes)
+            if len(raw) < n*plane_bytes: raise ValueError('Data length less than expected')
+            data = np.frombuffer(raw, dtype=dtype).reshape(n, shape[1], shape[0]).transpose(2,1,0)
+            if slope != 1. or inter != 0.: data = data*slope+inter
+            yield 2, start, data
+
+def _chunks(filename):
+    if _is_nifti(filename): return _nifti_chunks(filename)
+    if filename.endswith('.mha'): return _mha_chunks(filename)
+    raise ValueError('unknown file format "'+os.path.basename(filename)+'"')
+
+def read_mask(filename):
+    # returns a PackedMask (nonzero voxels) and the spacing of the 3 axes
+    chunks = _chunks(filename)
+    shape, spacing = next(chunks)
+    mask = PackedMask(shape)
+    for axis, start, data in chunks:
+        if axis == 0: mask.set_slab(start, data)
+        else: mask.set_chunk(start, data)
+    return mask, spacing
+
+def read_labels(filename):
+    # returns an uint8 label volume and the spacing of the 3 axes
+    chunks = _chunks(filename)
+    shape, spacing = next(chunks)
+    labels = np.zeros(shape=shape, dtype=np.uint8)
+    for axis, start, data in chunks:
+        if axis == 0: labels[start:start+data.shape[0]] = data
+        else: labels[:,:,start:start+data.shape[2]] = data
+    return labels, spacing
+
+
+def write_raw(filename, volume):
+    # writes the uint8 values without any header (first axis slowest)
+    shape = volume.shape
+    slab_size = max(1, SLAB_BYTES//(shape[1]*shape[2]))
+    with open(filename, "wb") as f:
+        for start in range(0, shape[0], slab_size):
+            f.write(_slab(volume, start, start+slab_size).tobytes())
+
+def write_mask(filename, volume, spacing, compressed=True):
+    # writes a PackedMask (0/1), an uint8 label volume or a PalabosGeometry, spacing in micrometer
+    shape = volume.shape
+    if np.isscalar(spacing): spacing = (spacing, spacing, spacing)
+    if _is_nifti(filename):
+        import nibabel as nib
+        aff = np.eye(4) # centered, the same as in Digital_Phantom
+        for i in range(3): aff[i,i] = spacing[i]; aff[i,3] = -(shape[i]//2)*aff[i,i]
+        header = nib.Nifti1Header()
+        header.set_data_shape(shape)
+        header.set_data_dtype(np.uint8)
+        header.set_xyzt_units(3, 8)
+        header.set_sform(aff, code=0)
+        header.set_qform(aff, code=1)
+        header.set_slope_inter(1,0)
+        opener = gzip.open if filename.endswith('.gz') else open
+        with opener(filename, "wb") as f:
+            header.write_to(f)
+            chunk_size = max(8, (SLAB_BYTES//(shape[0]*shape[1]))//8*8)
+            for start in range(0, shape[2], chunk_size):
+                f.write(np.ascontiguousarray(_chunk(volume, start, start+chunk_size).transpose(2,1,0)).tobytes())
+        return
+    if not filename.endswith('.mha'): raise ValueError('unknown file format "'+os.path.basename(filename)+'"')
+    offset1=-(shape[0]//2)*spacing[0]
+    offset2=(shape[1]//2)*spacing[1] # not negative as consequence of the TransformMatrix
+    offset3=(shape[2]//2)*spacing[2] # not negative as consequence of the TransformMatrix
+    header  = 'ObjectType = Image\n'
+    header += 'NDims=3\n'
+    header += 'BinaryData = True\n'
+    header += 'BinaryDataByteOrderMSB = False\n'
+    if compressed:
+        header += 'CompressedData = True\n'
+        # fixed width, overwritten when all slabs are written
+        header += 'CompressedDataSize = %020d\n' % 0
+    else:
+        header += 'CompressedData = False\n'
+    header += 'TransformMatrix = -1 0 0 0 -1 0 0 0 1\n' # negative values for compatibility with nibabel/ITK
+    header += 'Offset = '+str(offset3)+' '+str(offset2)+' '+str(offset1)+'\n'
+    header += 'CenterOfRotation = 0 0 0\n'
+    header += 'AnatomicalOrientation = LPI\n'
+    header += 'ElementSpacing = '+str(spacing[2])+' '+str(spacing[1])+' '+str(spacing[0])+'\n'
+    header += 'DimSize = '+str(int(shape[2]))+' '+str(int(shape[1]))+' '+str(int(shape[0]))+'\n'
+    header += 'ElementNumberOfChannels = 1\n'
+    header += 'ElementType = MET_UCHAR\n'
+    header += 'ElementDataFile = LOCAL\n'
+    # the slabs are streamed to the file, only one is in memory at a time
+    slab_size = max(1, SLAB_BYTES//(shape[1]*shape[2]))
+    compressor = zlib.compressobj() if compressed else None
+    data_size = 0
+    with open(filename, "wb") as f:
+        f.write(header.encode('latin-1'))
+        for start in range(0, shape[0], slab_size):
+            data = _slab(volume, start, start+slab_size).tobytes()
+            if compressed: data = compressor.compress(data)
+            f.write(data); data_size += len(data)
+        if compressed:
+            data = compressor.flush()
+            f.write(data); data_size += len(data)
+            f.seek(header.index('CompressedDataSize = ')+len('CompressedDataSize = '))
+            f.write(('%020d' % data_size).encode('latin-1'))
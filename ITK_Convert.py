@@ -1,6 +1,22 @@
 #
 # uses ITK to convert whatever format ITK can read and write
 #
+# conversions between the formats this project reads and writes natively
+# (MHA, FLD, NIFTI and VTI, see FieldIO.py) do not use ITK at all,
+# ITK is only imported when one of the files has another format
+# or when --itk is given
+#
+# batch mode: --batch with a manifest file (one "input output" pair per
+# line, the output may be omitted) or a glob pattern converts all files in
+# one process by a bounded pool of threads, outputs without name are named
+# <outdir>/<input name><suffix><format>, the time of every file is reported
+# and failed files do not abort the batch
+# ITK is imported (and its modules loaded) only once for the whole batch
+#
+# --compression=off|on|<level> selects uncompressed output or the zlib level
+# (1 fastest ... 9 smallest, on = 6), --itkthreads the number of threads
+# ITK uses, the throughput (uncompressed MB per second) of every file is reported
+#
 # supported file formats are described here:
 #     https://itk.org/Wiki/ITK/FAQ#What_3D_file_formats_can_ITK_import_and_export.3F
 #     https://itk.org/Wiki/ITK/File_Formats
@@ -43,7 +59,9 @@
 #
 #    This program was developed under Python Version 2.7
 #    with the following additional libraries: 
-#    - itk 
+#    - numpy
+#    - nibabel (only for NIFTI files)
+#    - itk (only for formats not handled by FieldIO.py)
 #
 
 
@@ -51,45 +69,32 @@ from __future__ import print_function
 import sys
 import os
 from getopt import getopt
-import new # required for ITK work with pyinstaller
-import itk
-
-
-TK_installed=True
-try: 
-    from tkFileDialog import askopenfilename # Python 2
-    from tkFileDialog import asksaveasfile   # Python 2
-    from tkMessageBox import showwarning     # Python 2
-    from tkMessageBox import showerror       # Python 2
-    from tkMessageBox import showinfo        # Python 2
-except: 
-    try: from tkinter.filedialog import askopenfilename; # Python3
-    except: TK_installed=False
-    try: from tkinter.filedialog import asksaveasfile;   # Python3
-    except: TK_installed=False
-    try: from tkinter.messagebox import showwarning;     # Python3
-    except: TK_installed=False    
-    try: from tkinter.messagebox import showerror;       # Python3
-    except: TK_installed=False       
-    try: from tkinter.messagebox import showinfo;        # Python3
-    except: TK_installed=False   
-try: import Tkinter as tk; # Python2
-except: 
-    try: import tkinter as tk; # Python3
-    except: TK_installed=False 
-if not TK_installed:
-    print ('ERROR: tkinter not installed')
-    print ('       on Linux try "yum install tkinter"')
-    print ('       on MacOS install ActiveTcl from:')
-    print ('       http://www.activestate.com/activetcl/downloads')
-    sys.stdout.write('\a\a\a'); sys.stdout.flush() # beep 3x
-    sys.exit(2)
+import glob
+import time
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
+from FieldIO import file_format
+import vectorfield
+
+
+import Profiling
+from Dialogs import askopenfilename, asksaveasfile, showwarning, showerror, showinfo, update # Tk only loaded when a dialog is needed
 
 def usage():
     print ('')
     print ('Usage: '+Program_name+' [options] --input=<inputfile> --output=<outputfile>')
+    print ('       '+Program_name+' [options] --batch=<manifest or "pattern*"> [--format=<ext>]')
     print ('')
     print ('   Available options are:')
+    print ('       --itk         : always convert with ITK')
+    print ('       --batch=<file or pattern> : manifest ("input output" per line) or glob of input files')
+    print ('       --format=<ext>   : batch output extension e.g. .nii.gz (for inputs without output name)')
+    print ('       --outdir=<dir>   : batch output directory (default directory of each input)')
+    print ('       --suffix=<text>  : appended to the batch output names (default none)')
+    print ('       --threads=<n> : number of files converted in parallel (default number of CPUs)')
+    print ('       --compression=<off|on|1-9> : output compression, zlib level (default on = 6)')
+    print ('       --itkthreads=<n> : number of threads used by ITK (default ITK\'s choice)')
+    print ('       --profile=<f> : phase timings as JSON trace (<f>.prof: cProfile dump)')
     print ('       --version     : version information')
     print ('       -h --help     : this page')    
     print ('')       
@@ -104,22 +109,10 @@ python_version=str(sys.version_info[0])+'.'+str(sys.version_info[1])+'.'+str(sys
 # sys.platform = [linux2, win32, cygwin, darwin, os2, os2emx, riscos, atheos, freebsd7, freebsd8]
 if sys.platform=="win32": os.system("title "+Program_name)
     
-#TK initialization       
-TKwindows = tk.Tk(); TKwindows.withdraw() #hiding tkinter window
-TKwindows.update()
-# the following tries to disable showing hidden files/folders under linux
-try: TKwindows.tk.call('tk_getOpenFile', '-foobarz')
-except: pass
-try: TKwindows.tk.call('namespace', 'import', '::tk::dialog::file::')
-except: pass
-try: TKwindows.tk.call('set', '::tk::dialog::file::showHiddenBtn', '1')
-except: pass
-try: TKwindows.tk.call('set', '::tk::dialog::file::showHiddenVar', '0')
-except: pass
-TKwindows.update()
-
 # parse commandline parameters (if present)
-try: opts, args =  getopt( sys.argv[1:],'h',['help','version','input=', 'output='])
+try: opts, args =  getopt( sys.argv[1:],'h',['help','version','profile=','input=', 'output=', 'itk',
+                                                  'batch=', 'format=', 'outdir=', 'suffix=', 'threads=',
+                                                  'compression=', 'itkthreads='])
 except:
     error=str(sys.argv[1:]).replace("[","").replace("]","")
     if "-" in str(error) and not "--" in str(error): 
@@ -133,38 +126,171 @@ argDict = dict(opts)
 if '-h' in argDict: usage(); exit(0)   
 if '--help' in argDict: usage(); exit(0)  
 if '--version' in argDict: print (Program_name+' '+Program_version); exit(0)
+Profiling.start(argDict.get('--profile')) # see Profiling.py
 if '--input' in argDict: INfile=argDict['--input'];
 else: INfile=""
 if '--output' in argDict: OUTfile=argDict['--output'];
 else: OUTfile=""
+BATCHlist = argDict.get('--batch', "")
+OUTformat = argDict.get('--format', "")
+if OUTformat != "" and not OUTformat.startswith('.'): OUTformat = '.'+OUTformat
+try: threads = int(argDict.get('--threads', cpu_count()))
+except ValueError: threads = 0
+if threads < 1: print ('ERROR: Commandline --threads must be a positive integer'); exit(2)
+compression = argDict.get('--compression', 'on').lower()
+compressed = compression != 'off'
+if compression in ['on','off']: level = 6
+else:
+    try: level = int(compression)
+    except ValueError: level = 0
+    if level < 1 or level > 9: print ('ERROR: Commandline --compression must be off, on or 1 ... 9'); exit(2)
+try: itkthreads = int(argDict.get('--itkthreads', 0))
+except ValueError: itkthreads = -1
+if itkthreads < 0: print ('ERROR: Commandline --itkthreads must be a positive integer'); exit(2)
 
 
-if INfile == "":
+if INfile == "" and BATCHlist == "":
     #intercatively choose input file
     INfile = askopenfilename(title="Open file", filetypes=[("All files",('*.*'))])
     if INfile == "": showwarning("Open file", "No input file specified ... operation aborted"); sys.exit(2)
     INfile = os.path.abspath(INfile)
     INfile=str(INfile)     
     
-#read file
-if not os.path.isfile(INfile): showerror("Read file", "File not found"); sys.exit(2)
-try: image = itk.imread(INfile); image.Update()
-except: showerror("Read file", "Unable to read input file ... operation aborted"); sys.exit(2)
+if BATCHlist == "" and not os.path.isfile(INfile): showerror("Read file", "File not found"); sys.exit(2)
 
-if OUTfile == "":
+if OUTfile == "" and BATCHlist == "":
     #intercatively choose output file
     OUTfile = asksaveasfile(title="Save as file", mode='w', filetypes=[("All files",('*.*'))])
     if OUTfile == None: showwarning("Save file", "No output file specified ... operation aborted"); sys.exit(2)
     OUTfile.close()
     OUTfile=str(OUTfile.name)
 
-#write file
-try: 
-    writer = itk.ImageFileWriter[type(image)].New(image)
-    writer.SetFileName(OUTfile)
-    writer.UseCompressionOn ()
-    writer.Update()
-except: showerror("Write file", "Unable to write output file ... operation aborted"); sys.exit(2)
+def import_itk():
+    # importing ITK takes several seconds, so it is only done when needed
+    try: import new # required for ITK work with pyinstaller
+    except ImportError: pass
+    import itk
+    if hasattr(itk, 'force_load'): itk.force_load() # no lazy loading from several threads
+    if itkthreads > 0:
+        if hasattr(itk, 'MultiThreaderBase'): itk.MultiThreaderBase.SetGlobalDefaultNumberOfThreads(itkthreads) # ITK 5
+        else: itk.MultiThreader.SetGlobalDefaultNumberOfThreads(itkthreads) # ITK 4
+    return itk
+
+class ReadError(Exception): pass
+class WriteError(Exception): pass
+
+def native(INfile, OUTfile):
+    # True if both formats are handled by FieldIO (NIFTI only with nibabel)
+    if '--itk' in argDict: return False
+    formats = [file_format(INfile), file_format(OUTfile)]
+    if None in formats: return False
+    if 'nifti' in formats:
+        try: import nibabel
+        except ImportError: return False
+    return True
+
+def convert(INfile, OUTfile):
+    # returns the uncompressed size of the image in bytes,
+    # raises ReadError or WriteError with the message for the user
+    error = None
+    if native(INfile, OUTfile):
+        # images the native readers do not handle (e.g. 2D or 4D) are converted by ITK
+        try: field = vectorfield.read(INfile)
+        except Exception as e: error = ReadError('Unable to read input file ('+str(e)+')')
+        else:
+            try: vectorfield.write(field, OUTfile, compressed, level)
+            except Exception as e: raise WriteError('Unable to write output file ('+str(e)+')')
+            return field.nbytes
+    try: itk = import_itk()
+    except ImportError:
+        if error is not None: raise error
+        raise
+    try: image = itk.imread(INfile); image.Update()
+    except: raise ReadError('Unable to read input file')
+    try:
+        writer = itk.ImageFileWriter[type(image)].New(image)
+        writer.SetFileName(OUTfile)
+        if compressed:
+            writer.UseCompressionOn ()
+            if hasattr(writer, 'SetCompressionLevel'): writer.SetCompressionLevel(level) # ITK >= 5.1
+        else: writer.UseCompressionOff ()
+        writer.Update()
+    except: raise WriteError('Unable to write output file')
+    try: return itk.GetArrayViewFromImage(image).nbytes
+    except: return 0 # e.g. pixel types without numpy view
+
+def throughput(nbytes, seconds):
+    if seconds <= 0 or nbytes == 0: return '      - MB/s'
+    return '%7.1f MB/s' % (nbytes/1024./1024./seconds)
+
+def output_name(INfile):
+    # naming rule for batch outputs: <outdir>/<input name><suffix><format>
+    if OUTformat == "": return None
+    name = os.path.basename(INfile)
+    for ext in ['.nii.gz', os.path.splitext(name)[1]]:
+        if ext != "" and name.lower().endswith(ext): name = name[:-len(ext)]; break
+    dirname = argDict.get('--outdir', os.path.dirname(INfile))
+    return os.path.join(dirname, name+argDict.get('--suffix', "")+OUTformat)
+
+def batch_jobs(batch):
+    # (input, output) pairs of a manifest file or a glob pattern,
+    # relative names of a manifest are relative to its directory
+    if os.path.isfile(batch) and not any(c in batch for c in '*?['):
+        jobs = []
+        dirname = os.path.dirname(os.path.abspath(batch))
+        with open(batch) as f:
+            for line in f:
+                line = line.strip()
+                if line == "" or line.startswith('#'): continue
+                names = line.split('\t') if '\t' in line else line.split()
+                names = [os.path.join(dirname, name.strip()) for name in names]
+                jobs.append((names[0], names[1] if len(names) > 1 else output_name(names[0])))
+        return jobs
+    return [(name, output_name(name)) for name in sorted(glob.glob(batch))]
+
+def convert_job(job):
+    # runs in a worker thread, never raises
+    start = time.time()
+    nbytes = 0
+    try: nbytes = convert(job[0], job[1]); error = None
+    except (ReadError, WriteError) as e: error = str(e)
+    except Exception as e: error = 'Unexpected error ('+str(e)+')'
+    return job, time.time()-start, nbytes, error
+
+if BATCHlist != "":
+    jobs = batch_jobs(BATCHlist)
+    if len(jobs) == 0: print ('ERROR: No input files found for "'+BATCHlist+'"'); sys.exit(2)
+    if None in [job[1] for job in jobs]: print ('ERROR: Inputs without output name need --format'); sys.exit(2)
+    if '--outdir' in argDict and not os.path.isdir(argDict['--outdir']):
+        print ('ERROR: Output directory "'+argDict['--outdir']+'" not found'); sys.exit(2)
+    if not all(native(job[0], job[1]) for job in jobs):
+        try: import_itk() # one ITK session for the whole batch
+        except ImportError: print ('ERROR: ITK is not installed'); sys.exit(2)
+    print ('Converting '+str(len(jobs))+' files with '+str(min(threads, len(jobs)))+' threads')
+    start = time.time()
+    failed = []
+    total = 0
+    pool = ThreadPool(min(threads, len(jobs)))
+    for (INfile, OUTfile), seconds, nbytes, error in pool.imap_unordered(convert_job, jobs):
+        if error is None: print ('%8.3fs %s  %s -> %s' % (seconds, throughput(nbytes, seconds), INfile, OUTfile))
+        else: print ('  FAILED  %s: %s' % (INfile, error)); failed.append(INfile)
+        total += nbytes
+    pool.close(); pool.join()
+    seconds = time.time()-start
+    print ('%d files converted, %d failed, %.2fs total, %s' %
+           (len(jobs)-len(failed), len(failed), seconds, throughput(total, seconds).strip()))
+    if len(failed) > 0:
+        showwarning("Done", str(len(failed))+" of "+str(len(jobs))+" files failed:\n"+"\n".join(failed)); sys.exit(1)
+    showinfo("Done", "File convert successful"); sys.exit(0)
+
+#convert file
+start = time.time()
+try: nbytes = convert(INfile, OUTfile)
+except ReadError as e: showerror("Read file", str(e)+" ... operation aborted"); sys.exit(2)
+except WriteError as e: showerror("Write file", str(e)+" ... operation aborted"); sys.exit(2)
+except ImportError: showerror("ERROR", "ITK is not installed ... operation aborted"); sys.exit(2)
+seconds = time.time()-start
+print ('Converted %.1f MB in %.3fs, %s' % (nbytes/1024./1024., seconds, throughput(nbytes, seconds).strip()))
 
 showinfo("Done", "File convert successful")
 
@@ -0,0 +1,145 @@
+#
+# prepares the geometry for permeability.cpp from a binarized segmentation
+#
+# input is a NIFTI (*.nii, *.nii.gz) or MHA (*.mha) segmentation where
+# nonzero voxels are pore space (e.g. the Pantom_*.nii.gz of Digital_Phantom)
+#
+# output is a binary geometry with one uint8 tag per cell:
+#     0 = fluid
+#     1 = bounce-back (solid cells next to the fluid)
+#     2 = no-dynamics (solid interior, costs no collision work)
+# the bounce-back layer is found by a vectorized morphological dilation of
+# the fluid with the D3Q19 lattice links (18-neighbourhood), so that every
+# other solid cell becomes no-dynamics
+# written either as raw bytes (*.raw) or as uncompressed MHA (*.mha),
+# both are read directly (without ASCII parsing) by permeability.cpp
+#
+# the flow direction of permeability.cpp is x, the axis of the segmentation
+# to be used as x is selected with --flow (default 2, the tube axis of Digital_Phantom)
+#
+# before tagging, pore clusters that do not connect inlet and outlet are
+# turned into solid (they carry no flow but would still have to converge)
+# and the domain is cropped to the bounding box of the connected pore space
+# (e.g. the padding around the Digital_Phantom tube), this needs scipy
+# and can be switched off with --noprune
+#
+# ----- LICENSE -----
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#    For more detail see the GNU General Public License.
+#    <http://www.gnu.org/licenses/>.
+#
+#    THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#    IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#    FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#    AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#    LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#    OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+#    THE SOFTWARE.
+#
+# ----- REQUIREMENTS -----
+#
+#    This program was developed under Python Version 2.7
+#    with the following additional libraries:
+#    - numpy
+#    - nibabel (only for NIFTI files)
+#    - scipy (not needed with --noprune)
+#
+
+from __future__ import print_function
+import sys
+import os
+from getopt import getopt
+import numpy as np
+import Profiling
+from GeometryMask import read_mask, write_mask, write_raw, prune_mask, PalabosGeometry
+
+def checkfile(file): # generic check if file exists
+    if not os.path.isfile(file):
+        print ('ERROR:  File not found:\n        '+file); exit(1)
+
+def usage():
+    print ('')
+    print ('Usage: '+Program_name+' [options] --input=<inputfile>')
+    print ('')
+    print ('   Available options are:')
+    print ('       --output=<file> : output geometry *.raw or *.mha (default <input>_geometry.raw)')
+    print ('       --flow=<0|1|2>  : axis of the segmentation used as flow direction x (default 2)')
+    print ('       --bounceback    : tag all solid cells as bounce-back (no no-dynamics region)')
+    print ('       --noprune       : keep isolated pores and the full domain size')
+    print ('       --profile=<f>   : phase timings as JSON trace (<f>.prof: cProfile dump)')
+    print ('       --version       : version information')
+    print ('       -h --help       : this page')
+    print ('')
+
+#general initialization stuff
+Program_name = os.path.basename(sys.argv[0]);
+if Program_name.find('.')>0: Program_name = Program_name[:Program_name.find('.')]
+Program_version = "v0.1" # program version
+
+# parse commandline parameters
+try: opts, args =  getopt( sys.argv[1:],'h',['help','version','profile=','input=','output=','flow=','bounceback','noprune'])
+except:
+    error=str(sys.argv[1:]).replace("[","").replace("]","")
+    if "-" in str(error) and not "--" in str(error):
+          print ('ERROR: Commandline '+str(error)+',   maybe you mean "--"')
+    else: print ('ERROR: Commandline '+str(error))
+    usage(); exit(2)
+if len(args)>0:
+    print ('ERROR: Commandline option "'+args[0]+'" not recognized')
+    usage(); exit(2)
+argDict = dict(opts)
+if '-h' in argDict: usage(); exit(0)
+if '--help' in argDict: usage(); exit(0)
+if '--version' in argDict: print (Program_name+' '+Program_version); exit(0)
+Profiling.start(argDict.get('--profile')) # see Profiling.py
+if '--input' in argDict: INfile=argDict['--input']; checkfile(INfile)
+else: print ('ERROR: No input file specified'); usage(); exit(2)
+INfile = os.path.abspath(INfile)
+basename = os.path.basename(INfile)
+for ext in ['.nii.gz', '.nii', '.mha']:
+    if basename.endswith(ext): basename = basename[:-len(ext)]
+dirname  = os.path.dirname(INfile)
+if '--output' in argDict: OUTfile=os.path.abspath(argDict['--output'])
+else: OUTfile=os.path.join(dirname,basename+'_geometry.raw')
+if not (OUTfile.endswith('.raw') or OUTfile.endswith('.mha')):
+    print ('ERROR: Output file must be *.raw or *.mha'); exit(2)
+try: flow_axis = int(argDict.get('--flow', 2))
+except ValueError: flow_axis = -1
+if flow_axis not in [0,1,2]: print ('ERROR: Commandline --flow must be 0, 1 or 2'); exit(2)
+
+#read segmentation (1 bit per voxel)
+try: mask, spacing = read_mask(INfile)
+except Exception as e: print ('ERROR: problem reading input file: '+str(e)); sys.exit(2)
+print ('Input dimension =', mask.shape[0], mask.shape[1], mask.shape[2])
+if not '--noprune' in argDict:
+    try: mask, crop, stats = prune_mask(mask, flow_axis)
+    except ImportError: print ('ERROR: scipy is required for pruning, use --noprune'); sys.exit(2)
+    except ValueError as e: print ('ERROR: '+str(e)); sys.exit(2)
+    print ('Porosity = %.4f, connected porosity = %.4f' % (stats['porosity'], stats['connected_porosity']))
+    print ('Pore clusters = %d, connecting inlet and outlet = %d, removed pore voxels = %d' %
+           (stats['clusters'], stats['spanning_clusters'], stats['removed_pores']))
+    print ('Cropped to %d %d %d starting at %d %d %d (%.1f%% of the cells)' %
+           (stats['shape']+crop+(stats['cell_fraction']*100,)))
+geometry = PalabosGeometry(mask, flow_axis, no_dynamics='--bounceback' not in argDict)
+spacing  = [spacing[i] for i in geometry.axes]
+nx, ny, nz = geometry.shape
+print ('Geometry dimension nx ny nz =', nx, ny, nz)
+counts = geometry.count_tags()
+print ('Cells fluid / bounce-back / no-dynamics = %d / %d / %d' % (counts[0], counts[1], counts[2]))
+print ('Resolution =', spacing[0], spacing[1], spacing[2])
+if spacing[0] != spacing[1] or spacing[0] != spacing[2]:
+    print ('Warning: anisotropic voxels, permeability.cpp assumes isotropic resolution')
+
+#write geometry
+try:
+    if OUTfile.endswith('.mha'): write_mask(OUTfile, geometry, spacing, compressed=False)
+    else: write_raw(OUTfile, geometry)
+except Exception as e: print ('ERROR: problem while writing results: '+str(e)); sys.exit(1)
+print ('Successfully written output file "'+OUTfile+'"')
+print ('')
+print ('Run the simulation e.g. with (resolution assumed in micrometer):')
+print ('    permeability '+os.path.basename(OUTfile)+' tmp '+str(nx)+' '+str(ny)+' '+str(nz)+' '+'%g' % (spacing[0]*1.0e-6)+' <deltaP>')
@@ -0,0 +1,233 @@
+#
+# coarse-to-fine warm start for permeability.cpp
+#
+# step 1: --coarsen
+#    downsamples a geometry of permeability.cpp (*.raw or *.mha, tags 0=fluid,
+#    1=bounce-back, 2=no-dynamics) by an integer factor, a coarse cell is fluid
+#    if at least half of its fine cells are fluid, and tags it again
+# step 2: run permeability.cpp on the coarse geometry with --density,
+#    resolution*factor and deltaP*factor^2 (the same physical pressure)
+# step 3: --upsample
+#    interpolates (nearest neighbour) the converged coarse velocity and density
+#    onto the fine geometry, converted to the lattice units of the fine lattice,
+#    and writes the initial state file for permeability.cpp --init=<file>
+# step 4: run permeability.cpp on the fine geometry with --init=<file>,
+#    starting close to the converged solution instead of at rest
+#
+# ----- LICENSE -----
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#    For more detail see the GNU General Public License.
+#    <http://www.gnu.org/licenses/>.
+#
+#    THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#    IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#    FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#    AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#    LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#    OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+#    THE SOFTWARE.
+#
+# ----- REQUIREMENTS -----
+#
+#    This program was developed under Python Version 2.7
+#    with the following additional libraries:
+#    - numpy
+#
+
+from __future__ import print_function
+import sys
+import os
+import zlib
+from getopt import getopt
+import numpy as np
+import Profiling
+from GeometryMask import read_labels, read_mha_header, write_mask, write_raw, PackedMask, PalabosGeometry, SLAB_BYTES
+
+# the same constants as in permeability.cpp
+NU_LATTICE = 1./6.          # lattice viscosity for omega = 1
+KINEMATIC_VISCOSITY = 1e-6  # water in [m^2/s]
+
+def checkfile(file): # generic check if file exists
+    if not os.path.isfile(file):
+        print ('ERROR:  File not found:\n        '+file); exit(1)
+
+def usage():
+    print ('')
+    print ('Usage: '+Program_name+' --coarsen [options] --input=<fine geometry>')
+    print ('       '+Program_name+' --upsample [options] --input=<coarse *_velocity.mha> --geometry=<fine geometry>')
+    print ('')
+    print ('   Available options are:')
+    print ('       --output=<file> : coarse geometry *.raw or *.mha (default <input>_coarse.raw)')
+    print ('                         or initial state *.mha (default <input>_init.mha)')
+    print ('       --factor=<n>    : downsampling factor (default 2)')
+    print ('       --dims=nx,ny,nz : dimensions of *.raw geometries')
+    print ('       --profile=<f>   : phase timings as JSON trace (<f>.prof: cProfile dump)')
+    print ('       --version       : version information')
+    print ('       -h --help       : this page')
+    print ('')
+
+def read_geometry(filename, dims):
+    # returns the tags in the order of permeability.cpp (x,y,z) and the resolution in micrometer (or None)
+    if filename.endswith('.mha'):
+        tags, spacing = read_labels(filename) # reverse of DimSize = (nx,ny,nz)
+        return tags, spacing[0]
+    if dims is None: raise ValueError('--dims=nx,ny,nz required for *.raw geometries')
+    return np.fromfile(filename, dtype=np.uint8).reshape(dims), None
+
+def coarsen(tags, factor):
+    # a coarse cell is fluid if at least half of its fine cells are fluid, cells
+    # beyond the fine domain (if the dimensions are no multiple of factor) count as solid
+    shape  = tuple((n+factor-1)//factor for n in tags.shape)
+    fluid  = PackedMask(shape)
+    slab_size = max(1, SLAB_BYTES//(tags.shape[1]*tags.shape[2]*factor))
+    for start in range(0, shape[0], slab_size):
+        stop  = min(start+slab_size, shape[0])
+        count = np.zeros(shape=(stop-start,shape[1],shape[2]), dtype=np.int32)
+        fine  = tags[start*factor:stop*factor] == 0
+        for i in range(factor):
+            for j in range(factor):
+                for k in range(factor):
+                    part = fine[i::factor, j::factor, k::factor]
+                    count[0:part.shape[0], 0:part.shape[1], 0:part.shape[2]] += part
+        fluid.set_slab(start, 2*count >= factor**3)
+    return PalabosGeometry(fluid, flow_axis=0) # already in the order of permeability.cpp
+
+def read_float_mha(filename):
+    # returns the data of a float MHA file written by permeability.cpp or vti2mha
+    # (DimSize = nx ny nz, x fastest) as (nx,ny,nz,channels) and the header
+    header = read_mha_header(filename)
+    dims = [int(n) for n in header['DimSize'].split()]
+    channels = int(header.get('ElementNumberOfChannels', '1'))
+    with open(filename, "rb") as f:
+        f.seek(header['HeaderSize'])
+        data = f.read()
+    if header.get('CompressedData', 'False') == 'True': data = zlib.decompress(data)
+    data = np.frombuffer(data, dtype='<f4')[0:dims[0]*dims[1]*dims[2]*channels]
+    return data.reshape(dims[2], dims[1], dims[0], channels).transpose(2,1,0,3), header
+
+def write_state_header(f, shape, spacing):
+    # header of the --init file of permeability.cpp, which is read like its
+    # binary geometry input (DimSize = nz ny nx, x slowest)
+    header  = 'ObjectType = Image\n'
+    header += 'NDims=3\n'
+    header += 'BinaryData = True\n'
+    header += 'BinaryDataByteOrderMSB = False\n'
+    header += 'CompressedData = False\n'
+    header += 'TransformMatrix = -1 0 0 0 -1 0 0 0 1\n'
+    header += 'Offset = 0 0 0\n'
+    header += 'CenterOfRotation = 0 0 0\n'
+    header += 'AnatomicalOrientation = LPI\n'
+    header += 'ElementSpacing = '+str(spacing)+' '+str(spacing)+' '+str(spacing)+'\n'
+    header += 'DimSize = '+str(int(shape[2]))+' '+str(int(shape[1]))+' '+str(int(shape[0]))+'\n'
+    header += 'ElementNumberOfChannels = 4\n'
+    header += 'ElementType = MET_FLOAT\n'
+    header += 'ElementDataFile = LOCAL\n'
+    f.write(header.encode('latin-1'))
+
+def upsample(filename, velocity, density, tags, factor, spacing):
+    # velocity in cm/s and density of the coarse lattice -> rho,ux,uy,uz of the fine lattice,
+    # in lattice units the velocity scales with the resolution and the density deviation
+    # (pressure) with the square of the resolution, for the same physical pressure
+    resolution = spacing*1e-6 # fine resolution in meter
+    velocity_scale = 1e-2 * NU_LATTICE*resolution/KINEMATIC_VISCOSITY # cm/s -> lattice units
+    shape = tags.shape
+    slab_size = max(1, SLAB_BYTES//(shape[1]*shape[2]*16))
+    with open(filename, "wb") as f:
+        write_state_header(f, shape, spacing)
+        for start in range(0, shape[0], slab_size):
+            stop = min(start+slab_size, shape[0])
+            coarse = np.arange(start, stop)//factor
+            y = np.arange(shape[1])//factor; z = np.arange(shape[2])//factor
+            state = np.empty(shape=(stop-start,shape[1],shape[2],4), dtype='<f4')
+            state[...,0]  = 1. + (density[coarse][:,y][:,:,z] - 1.)/factor**2
+            state[...,1:] = velocity[coarse][:,y][:,:,z] * velocity_scale
+            state[...,1:] *= (tags[start:stop] == 0)[...,np.newaxis]
+            f.write(state.tobytes())
+
+#general initialization stuff
+Program_name = os.path.basename(sys.argv[0]);
+if Program_name.find('.')>0: Program_name = Program_name[:Program_name.find('.')]
+Program_version = "v0.1" # program version
+
+# parse commandline parameters
+try: opts, args =  getopt( sys.argv[1:],'h',['help','version','profile=','coarsen','upsample','input=','output=','geometry=','factor=','dims='])
+except:
+    error=str(sys.argv[1:]).replace("[","").replace("]","")
+    if "-" in str(error) and not "--" in str(error):
+          print ('ERROR: Commandline '+str(error)+',   maybe you mean "--"')
+    else: print ('ERROR: Commandline '+str(error))
+    usage(); exit(2)
+if len(args)>0:
+    print ('ERROR: Commandline option "'+args[0]+'" not recognized')
+    usage(); exit(2)
+argDict = dict(opts)
+if '-h' in argDict: usage(); exit(0)
+if '--help' in argDict: usage(); exit(0)
+if '--version' in argDict: print (Program_name+' '+Program_version); exit(0)
+Profiling.start(argDict.get('--profile')) # see Profiling.py
+if ('--coarsen' in argDict) == ('--upsample' in argDict):
+    print ('ERROR: Specify either --coarsen or --upsample'); usage(); exit(2)
+if '--input' in argDict: INfile=os.path.abspath(argDict['--input']); checkfile(INfile)
+else: print ('ERROR: No input file specified'); usage(); exit(2)
+try: factor = int(argDict.get('--factor', 2))
+except ValueError: factor = 0
+if factor < 2: print ('ERROR: Commandline --factor must be an integer >= 2'); exit(2)
+dims = None
+if '--dims' in argDict:
+    try: dims = tuple(int(n) for n in argDict['--dims'].split(','))
+    except ValueError: dims = ()
+    if len(dims) != 3: print ('ERROR: Commandline --dims must be nx,ny,nz'); exit(2)
+basename = os.path.splitext(os.path.basename(INfile))[0]
+dirname  = os.path.dirname(INfile)
+
+if '--coarsen' in argDict:
+    if '--output' in argDict: OUTfile=os.path.abspath(argDict['--output'])
+    else: OUTfile=os.path.join(dirname,basename+'_coarse.raw')
+    if not (OUTfile.endswith('.raw') or OUTfile.endswith('.mha')):
+        print ('ERROR: Output file must be *.raw or *.mha'); exit(2)
+    try: tags, spacing = read_geometry(INfile, dims)
+    except Exception as e: print ('ERROR: problem reading input file: '+str(e)); sys.exit(2)
+    geometry = coarsen(tags, factor)
+    nx, ny, nz = geometry.shape
+    counts = geometry.count_tags()
+    print ('Coarse geometry dimension nx ny nz =', nx, ny, nz)
+    print ('Cells fluid / bounce-back / no-dynamics = %d / %d / %d' % (counts[0], counts[1], counts[2]))
+    try:
+        if OUTfile.endswith('.mha'): write_mask(OUTfile, geometry, (spacing or 1.)*factor, compressed=False)
+        else: write_raw(OUTfile, geometry)
+    except Exception as e: print ('ERROR: problem while writing results: '+str(e)); sys.exit(1)
+    print ('Successfully written output file "'+OUTfile+'"')
+    print ('')
+    print ('Run the coarse simulation with '+str(factor)+'x the resolution and '+str(factor**2)+'x deltaP of the fine one, e.g.:')
+    resolution = '%g' % (spacing*factor*1.0e-6) if spacing else '<resolution*'+str(factor)+'>'
+    print ('    permeability '+os.path.basename(OUTfile)+' tmp_coarse '+str(nx)+' '+str(ny)+' '+str(nz)+' '+resolution+' <deltaP*'+str(factor**2)+'> --density')
+else:
+    if '--geometry' in argDict: GEOfile=os.path.abspath(argDict['--geometry']); checkfile(GEOfile)
+    else: print ('ERROR: No fine geometry specified'); usage(); exit(2)
+    DENSfile = INfile.replace('_velocity.mha', '_density.mha')
+    if DENSfile == INfile or not os.path.isfile(DENSfile):
+        print ('ERROR: Density file not found, run the coarse simulation with --density:\n        '+DENSfile); exit(1)
+    if '--output' in argDict: OUTfile=os.path.abspath(argDict['--output'])
+    else: OUTfile=os.path.join(dirname,basename+'_init.mha')
+    if not OUTfile.endswith('.mha'): print ('ERROR: Output file must be *.mha'); exit(2)
+    try:
+        tags, _ = read_geometry(GEOfile, dims)
+        velocity, header = read_float_mha(INfile)
+        density, _ = read_float_mha(DENSfile)
+    except Exception as e: print ('ERROR: problem reading input file: '+str(e)); sys.exit(2)
+    if velocity.shape[3] != 3: print ('ERROR: Velocity file must have 3 channels'); sys.exit(2)
+    expected = tuple((n+factor-1)//factor for n in tags.shape)
+    if velocity.shape[0:3] != expected or density.shape[0:3] != expected:
+        print ('ERROR: Coarse dimension', velocity.shape[0:3], 'does not match the fine geometry', expected); sys.exit(2)
+    spacing = float(header['ElementSpacing'].split()[0])/factor # fine resolution in micrometer
+    try: upsample(OUTfile, velocity, density[...,0], tags, factor, spacing)
+    except Exception as e: print ('ERROR: problem while writing results: '+str(e)); sys.exit(1)
+    nx, ny, nz = tags.shape
+    print ('Successfully written output file "'+OUTfile+'"')
+    print ('')
+    print ('Run the fine simulation with the same deltaP as before, e.g.:')
+    print ('    permeability '+os.path.basename(GEOfile)+' tmp '+str(nx)+' '+str(ny)+' '+str(nz)+' '+'%g' % (spacing*1.0e-6)+' <deltaP> --init='+os.path.basename(OUTfile))
@@ -0,0 +1,146 @@
+#
+# lightweight per-phase instrumentation for the command line tools
+#
+# the readers and writers mark their phases with named spans:
+#    with span('decompress') as s:
+#        data = zlib.decompress(rawdata); s.nbytes = len(data)
+# (read, decompress, reorder, scale, compress, write, ...), spans may be nested
+# and be used from several threads
+# spans cost nothing but the object creation unless profiling was started
+# with start(filename) (the --profile=<file> option of the tools), then every
+# finished span prints its wall time, bytes, throughput and the memory
+# high-water mark of the process, and at the end of the program
+#    <file>.json           : the spans as trace (chrome://tracing / Perfetto
+#                            JSON format, totals per span name in "otherData")
+#    <file>.prof or .pstats: a cProfile dump of the whole run instead
+#                            (python -m pstats <file>.prof)
+# is written
+#
+# ----- LICENSE -----
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#    For more detail see the GNU General Public License.
+#    <http://www.gnu.org/licenses/>.
+#
+#    THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#    IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#    FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#    AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#    LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#    OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+#    THE SOFTWARE.
+#
+# ----- REQUIREMENTS -----
+#
+#    This program was developed under Python Version 2.7
+#    (no additional libraries)
+#
+
+from __future__ import print_function
+import sys
+import os
+import time
+import json
+import atexit
+import threading
+
+_spans    = None  # finished spans, None if profiling was not started
+_filename = None  # output file of the trace or the cProfile dump
+_profiler = None  # cProfile.Profile with a *.prof / *.pstats output file
+_start    = time.time()
+_local    = threading.local() # nesting depth per thread
+
+
+def peak_memory():
+    # resident memory high-water mark of this process in MB, None if unknown
+    # (VmHWM on Linux, ru_maxrss would include the parent's memory at fork)
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'): return int(line.split()[1])/1024.
+    except (IOError, OSError, ValueError): pass
+    try: import resource
+    except ImportError: return None # windows
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss/1024./1024. if sys.platform == 'darwin' else rss/1024.
+
+
+class span(object):
+    # a named phase, nbytes (bytes processed) can be given or set inside the with block
+    __slots__ = ('name', 'nbytes', 'start', 'depth')
+
+    def __init__(self, name, nbytes=0):
+        self.name = name
+        self.nbytes = nbytes
+
+    def __enter__(self):
+        if _spans is not None:
+            self.depth = getattr(_local, 'depth', 0)
+            _local.depth = self.depth+1
+            self.start = time.time()
+        return self
+
+    def __exit__(self, *exc_info):
+        if _spans is None or not hasattr(self, 'start'): return False
+        seconds = time.time()-self.start
+        _local.depth = self.depth
+        peak = peak_memory()
+        mb = self.nbytes/1024./1024.
+        _spans.append({'name': self.name, 'start': self.start-_start, 'seconds': seconds, 'bytes': int(self.nbytes),
+                       'MB/s': mb/seconds if seconds > 0 else None, 'peak_mb': peak, 'depth': self.depth,
+                       'thread': threading.current_thread().name, 'error': exc_info[0] is not None})
+        line = '  '*self.depth+'%-12s %8.3fs' % (self.name, seconds)
+        if self.nbytes: line += ' %9.1f MB %8.1f MB/s' % (mb, mb/seconds if seconds > 0 else 0.)
+        if peak is not None: line += '  peak %.1f MB' % peak
+        print (line)
+        return False
+
+
+def start(filename=None):
+    # starts profiling (the --profile=<file> option), nothing if filename is None
+    global _spans, _filename, _profiler, _start
+    if filename is None or _spans is not None: return
+    _spans = []; _filename = filename; _start = time.time()
+    if os.path.splitext(filename)[1].lower() in ['.prof', '.pstats']:
+        import cProfile
+        _profiler = cProfile.Profile()
+        _profiler.enable()
+    atexit.register(finish)
+
+
+def totals():
+    # seconds, bytes and calls per span name (nested spans are also in their parent)
+    result = {}
+    for s in _spans or []:
+        total = result.setdefault(s['name'], {'seconds': 0., 'bytes': 0, 'calls': 0})
+        total['seconds'] += s['seconds']; total['bytes'] += s['bytes']; total['calls'] += 1
+    return result
+
+
+def finish():
+    # writes the trace or the cProfile dump, called at exit of the program
+    global _spans, _profiler
+    if _spans is None: return
+    seconds = time.time()-_start
+    peak = peak_memory()
+    try:
+        if _profiler is not None:
+            _profiler.disable()
+            _profiler.dump_stats(_filename)
+        else:
+            threads = dict((name, i) for i, name in enumerate(sorted(set(s['thread'] for s in _spans))))
+            events = [{'name': s['name'], 'ph': 'X', 'pid': os.getpid(), 'tid': threads[s['thread']],
+                       'ts': int(s['start']*1e6), 'dur': int(s['seconds']*1e6),
+                       'args': dict((key, s[key]) for key in ['bytes', 'MB/s', 'peak_mb', 'depth', 'error'])}
+                      for s in _spans]
+            trace = {'traceEvents': events, 'displayTimeUnit': 'ms',
+                     'otherData': {'program': os.path.basename(sys.argv[0]), 'argv': sys.argv[1:],
+                                   'python': sys.version.split()[0], 'seconds': seconds,
+                                   'peak_mb': peak, 'totals': totals()}}
+            with open(_filename, 'w') as f: json.dump(trace, f, indent=1, sort_keys=True)
+    except (IOError, OSError) as e: print ('ERROR: unable to write profile '+_filename+' ('+str(e)+')')
+    else: print ('Profile (%.3fs, peak %s MB) written to %s' % (seconds, '?' if peak is None else '%.1f' % peak, _filename))
+    _spans = None; _profiler = None
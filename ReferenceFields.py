@@ -0,0 +1,127 @@
+#
+# reference vector fields for comparisons
+#
+# a reference field is any object providing:
+#    shape            : (dim1,dim2,dim3,3) same memory layout as a MHA read
+#                       with the pure python reader (slowest axis first)
+#    slab(start,stop) : float32 vectors for the indices start..stop-1
+#                       along the first (slowest) axis
+#    mean_magnitude() : average velocity magnitude over the whole volume
+#                       (incl. zeros)
+#
+# ArrayField wraps an array already in memory (e.g. a MHA file)
+#
+# HagenPoiseuilleField is the analytic solution of the cylindrical tube
+# created by Digital_Phantom.py, computed on demand for any requested
+# slab or voxel set, so nothing needs to be materialized on disk or in memory
+# https://en.wikipedia.org/wiki/Hagen%E2%80%93Poiseuille_equation
+#
+# ----- LICENSE -----
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#    For more detail see the GNU General Public License.
+#    <http://www.gnu.org/licenses/>.
+#
+#    THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#    IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#    FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#    AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#    LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#    OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+#    THE SOFTWARE.
+#
+# ----- REQUIREMENTS -----
+#
+#    This program was developed under Python Version 2.7
+#    with the following additional libraries:
+#    - numpy
+#
+
+from __future__ import print_function
+import numpy as np
+
+
+class ArrayField(object):
+    def __init__(self, data):
+        self.data  = data
+        self.shape = data.shape
+
+    def slab(self, start, stop):
+        return self.data[start:stop]
+
+    def voxels(self, i, j, k):
+        return self.data[i,j,k]
+
+    def mean_magnitude(self, slab_size=16):
+        total = 0.
+        for start in range(0, self.shape[0], slab_size):
+            total += np.sum(np.sqrt(np.sum(np.square(self.slab(start, start+slab_size)), axis=3)), dtype=np.float64)
+        return total/(self.shape[0]*self.shape[1]*self.shape[2])
+
+
+class HagenPoiseuilleField(object):
+    # length, diameter, resolution in [m], pressure in [Pa], viscosity in [Pa*s]
+    # unit_scale converts m/s to the output unit (100 for cm/s as in MHA files)
+    def __init__(self, length, diameter, resolution, pressure, viscosity=0.001, unit_scale=100.):
+        self.length     = length
+        self.diameter   = diameter
+        self.resolution = resolution
+        self.pressure   = pressure
+        self.viscosity  = viscosity
+        self.unit_scale = unit_scale
+        # same discretization as in Digital_Phantom
+        tube_points_transv = int(diameter/resolution)
+        tube_points_long   = int(length/resolution)
+        eps = int(tube_points_transv*0.2)
+        if eps<4: eps=4
+        if (tube_points_transv+eps)%2 == 0: eps += 1 # make it odd
+        self.dims  = (tube_points_transv+eps, tube_points_transv+eps, tube_points_long)
+        self.shape = self.dims+(3,)
+        self.spacing = resolution*1.0e6 # in micrometer as in the MHA header
+        self._profile = None
+
+    def name(self):
+        name  = 'Veloci_L'+str(int(self.length*1e3))+'mm_D'+str(self.diameter*1e3)+'mm_R'
+        name += str(int(round(self.resolution*1e6)))+'um_P'+str(int(self.pressure))+'Pa'
+        return name
+
+    def radius(self, x, y):
+        # distance from the cylinder center in [m]
+        return np.sqrt(np.square(x-self.dims[0]//2) + np.square(y-self.dims[1]//2))*self.resolution
+
+    def mask_profile(self):
+        x, y = np.ogrid[0:self.dims[0], 0:self.dims[1]]
+        return self.radius(x, y) <= float(self.diameter/2.0)
+
+    def profile(self):
+        # velocity along the tube in [m/s] over the crossection, zero outside
+        # velocity = 1/(4*viscosity) * pressure/tube_length *(tube_radius^2 - r^2)
+        x, y = np.ogrid[0:self.dims[0], 0:self.dims[1]]
+        r = self.radius(x, y)
+        velocity = 1/(4*self.viscosity) * self.pressure/self.length *((self.diameter/2.)**2 - r**2)
+        velocity *= r <= float(self.diameter/2.0)
+        return velocity.astype(np.float32)
+
+    def scaled_profile(self):
+        # crossection in output units, cached (only dim1*dim2 values)
+        if self._profile is None: self._profile = self.profile()*np.float32(self.unit_scale)
+        return self._profile
+
+    def slab(self, start, stop):
+        start = max(start, 0); stop = min(stop, self.dims[0])
+        data = np.zeros(shape=(stop-start,self.dims[1],self.dims[2],3), dtype=np.float32)
+        data[:,:,:,0] = self.scaled_profile()[start:stop,:,np.newaxis] # flow is along the tube (last axis)
+        return data
+
+    def voxels(self, i, j, k):
+        i = np.asarray(i); j = np.asarray(j)
+        data = np.zeros(shape=np.broadcast(i,j,np.asarray(k)).shape+(3,), dtype=np.float32)
+        data[...,0] = self.scaled_profile()[i,j]
+        return data
+
+    def mean_magnitude(self):
+        # the tube is invariant along its axis, so the crossection average is the volume average
+        return np.average(self.profile().astype(np.float64)*self.unit_scale)
@@ -0,0 +1,240 @@
+#
+# native reader for VTK XML image data (*.vti) without the VTK library
+#
+# VTIFile parses the XML header only and keeps the position of every
+# point data array, an array is decoded into numpy when it is requested
+# by name, so arrays that are not needed are never decoded
+#
+# supported are all encodings written by VTK and Palabos:
+#    format="ascii"                   : whitespace separated values
+#    format="binary" (inline)         : base64 encoded
+#    format="appended" (AppendedData) : raw or base64 encoded
+# each uncompressed or compressed with vtkZLibDataCompressor (block headers),
+# UInt32 or UInt64 header_type, little or big endian, one or several pieces
+# other compressors raise NotImplementedError (vti2mha falls back to VTK)
+#
+# the arrays are returned with the shape (dimz,dimy,dimx,ncomponents),
+# that is the memory layout of the file (x fastest)
+#
+# ----- LICENSE -----
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#    For more detail see the GNU General Public License.
+#    <http://www.gnu.org/licenses/>.
+#
+#    THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#    IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#    FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#    AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#    LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#    OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+#    THE SOFTWARE.
+#
+# ----- REQUIREMENTS -----
+#
+#    This program was developed under Python Version 2.7
+#    with the following additional libraries:
+#    - numpy
+#
+
+from __future__ import print_function
+import base64
+import zlib
+import xml.etree.ElementTree as ET
+import numpy as np
+from Profiling import span
+
+VTK_TYPES = {'Int8':'i1', 'UInt8':'u1', 'Int16':'i2', 'UInt16':'u2', 'Int32':'i4', 'UInt32':'u4',
+             'Int64':'i8', 'UInt64':'u8', 'Float32':'f4', 'Float64':'f8'}
+SCAN_BYTES = 1024*1024 # size of the blocks read while searching the appended data
+
+
+def _extent(text):
+    return [int(v) for v in text.split()]
+
+
+def _b64decode(text):
+    if not isinstance(text, bytes): text = text.encode('ascii')
+    return base64.b64decode(b''.join(text.split()))
+
+
+class VTIFile(object):
+    def __init__(self, filename):
+        self.filename = filename
+        header, self.appended_offset, self.appended_encoding = self._read_header()
+        root = ET.fromstring(header)
+        if root.get('type') != 'ImageData': raise ValueError('not a VTK ImageData file')
+        compressor = root.get('compressor', '')
+        if compressor not in ['', 'vtkZLibDataCompressor']:
+            raise NotImplementedError('compressor '+compressor+' not supported')
+        self.compressed  = compressor != ''
+        self.byteorder   = '>' if root.get('byte_order') == 'BigEndian' else '<'
+        self.header_type = self.byteorder+('u8' if root.get('header_type') == 'UInt64' else 'u4')
+        image = root.find('ImageData')
+        whole = _extent(image.get('WholeExtent'))
+        self.extent  = whole
+        self.shape   = (whole[5]-whole[4]+1, whole[3]-whole[2]+1, whole[1]-whole[0]+1) # z,y,x
+        self.origin  = tuple(float(v) for v in image.get('Origin', '0 0 0').split())
+        self.spacing = tuple(float(v) for v in image.get('Spacing', '1 1 1').split())
+        self.cell_arrays = []
+        self._arrays = {} # name -> list of (piece extent, DataArray element)
+        self.arrays  = [] # point data array names in file order
+        self._ncomponents = {}
+        for piece in image.findall('Piece'):
+            extent = _extent(piece.get('Extent'))
+            celldata = piece.find('CellData')
+            if celldata is not None:
+                for element in celldata.findall('DataArray'):
+                    if element.get('Name') not in self.cell_arrays: self.cell_arrays.append(element.get('Name'))
+            pointdata = piece.find('PointData')
+            if pointdata is None: continue
+            for element in pointdata.findall('DataArray'):
+                name = element.get('Name')
+                if name not in self._arrays:
+                    self._arrays[name] = []
+                    self.arrays.append(name)
+                    self._ncomponents[name] = int(element.get('NumberOfComponents', 1))
+                self._arrays[name].append((extent, element))
+        # start of every appended array, a base64 array ends where the next one starts
+        self._offsets = sorted(int(element.get('offset', 0)) for pieces in self._arrays.values()
+                               for extent, element in pieces if element.get('format') == 'appended')
+
+    def _read_header(self):
+        # the appended data is raw binary and not valid XML, so only the part
+        # before it is parsed, it is found without reading the whole file
+        with open(self.filename, 'rb') as f:
+            header = b''
+            while True:
+                block = f.read(SCAN_BYTES)
+                if not block: return header, None, None
+                start = max(0, len(header)-len(b'<AppendedData'))
+                header += block
+                position = header.find(b'<AppendedData', start)
+                if position >= 0: break
+            while header.find(b'_', position) < 0:
+                block = f.read(SCAN_BYTES)
+                if not block: raise ValueError('AppendedData without data')
+                header += block
+            tag = header[position:header.find(b'>', position)+1]
+            element = ET.fromstring(tag.rstrip(b'/>').rstrip(b'>')+b'/>')
+            offset = header.find(b'_', position)+1
+            return header[:position]+b'</VTKFile>', offset, element.get('encoding', 'raw')
+
+    def ncomponents(self, name):
+        return self._ncomponents[name]
+
+    def __contains__(self, name):
+        return name in self._arrays
+
+    def __getitem__(self, name):
+        return self.read(name)
+
+    def read(self, name):
+        # the decompression is a nested span of read
+        with span('read') as s:
+            data = self._read(name); s.nbytes = data.nbytes
+        return data
+
+    def _read(self, name):
+        if name not in self._arrays: raise KeyError('no point data array "'+name+'"')
+        ncomp = self._ncomponents[name]
+        pieces = self._arrays[name]
+        whole = self.extent
+        if len(pieces) == 1 and pieces[0][0] == whole:
+            return self._read_piece(pieces[0][1], self.shape, ncomp)
+        data = None
+        for extent, element in pieces:
+            shape = (extent[5]-extent[4]+1, extent[3]-extent[2]+1, extent[1]-extent[0]+1)
+            values = self._read_piece(element, shape, ncomp)
+            if data is None: data = np.zeros(self.shape+(ncomp,), dtype=values.dtype)
+            data[extent[4]-whole[4]:extent[5]-whole[4]+1,
+                 extent[2]-whole[2]:extent[3]-whole[2]+1,
+                 extent[0]-whole[0]:extent[1]-whole[0]+1] = values
+        return data
+
+    def _read_piece(self, element, shape, ncomp):
+        vtktype = element.get('type')
+        if vtktype not in VTK_TYPES: raise NotImplementedError('data type '+str(vtktype)+' not supported')
+        dtype = np.dtype(self.byteorder+VTK_TYPES[vtktype])
+        count = shape[0]*shape[1]*shape[2]*ncomp
+        encoding = element.get('format')
+        if encoding == 'ascii':
+            data = np.array((element.text or '').split(), dtype=dtype)
+        elif encoding == 'binary':
+            data = self._decode_base64(element.text or '', dtype)
+        elif encoding == 'appended':
+            if self.appended_offset is None: raise ValueError('format="appended" without AppendedData')
+            data = self._read_appended(int(element.get('offset', 0)), dtype)
+        else:
+            raise NotImplementedError('format '+str(encoding)+' not supported')
+        if data.size < count: raise ValueError('array "'+element.get('Name')+'" is truncated')
+        return data[:count].astype(dtype.newbyteorder('='), copy=False).reshape(shape+(ncomp,))
+
+    def _header_size(self, nitems):
+        return nitems*np.dtype(self.header_type).itemsize
+
+    def _decompress(self, header, blocks):
+        # header: number of blocks, block size, size of the last block, compressed sizes
+        nblocks = int(header[0])
+        sizes = [int(n) for n in header[3:3+nblocks]]
+        data = []
+        position = 0
+        with span('decompress') as s:
+            for size in sizes:
+                data.append(zlib.decompress(blocks[position:position+size]))
+                position += size
+            data = b''.join(data); s.nbytes = len(data)
+        return data
+
+    def _decode_base64(self, text, dtype):
+        text = b''.join((text.encode('ascii') if not isinstance(text, bytes) else text).split())
+        if not self.compressed:
+            # VTK and Palabos encode the header separately (padded with '='),
+            # a header and data encoded as one stream is accepted too
+            nchars = 4*((self._header_size(1)+2)//3)
+            size = int(np.frombuffer(_b64decode(text[:nchars])[:self._header_size(1)], dtype=self.header_type)[0])
+            if text[nchars-1:nchars] == b'=': raw = _b64decode(text[nchars:])
+            else: raw = _b64decode(text)[self._header_size(1):]
+            return np.frombuffer(raw[:size], dtype=dtype)
+        # compressed: the header is encoded separately from the blocks
+        first = np.frombuffer(_b64decode(text[:4*((self._header_size(3)+2)//3)])[:self._header_size(3)],
+                              dtype=self.header_type)
+        nitems = 3+int(first[0])
+        nchars = 4*((self._header_size(nitems)+2)//3)
+        header = np.frombuffer(_b64decode(text[:nchars])[:self._header_size(nitems)], dtype=self.header_type)
+        return np.frombuffer(self._decompress(header, _b64decode(text[nchars:])), dtype=dtype)
+
+    def _read_appended(self, offset, dtype):
+        with open(self.filename, 'rb') as f:
+            f.seek(self.appended_offset+offset)
+            if self.appended_encoding == 'base64':
+                following = [n for n in self._offsets if n > offset]
+                if following:
+                    text = f.read(following[0]-offset)
+                else: # the last array ends with the closing tag
+                    text = b''
+                    while True:
+                        block = f.read(SCAN_BYTES)
+                        end = block.find(b'<')
+                        if end >= 0 or not block:
+                            text += block[:end] if end >= 0 else block
+                            break
+                        text += block
+                return self._decode_base64(text, dtype)
+            if not self.compressed:
+                size = int(np.frombuffer(f.read(self._header_size(1)), dtype=self.header_type)[0])
+                return np.frombuffer(f.read(size), dtype=dtype)
+            first = np.frombuffer(f.read(self._header_size(3)), dtype=self.header_type)
+            sizes = np.frombuffer(f.read(self._header_size(int(first[0]))), dtype=self.header_type)
+            header = np.concatenate([first, sizes])
+            return np.frombuffer(self._decompress(header, f.read(int(sizes.sum()))), dtype=dtype)
+
+
+def read_vti(filename, names=None):
+    # returns a dictionary name -> array (only the requested names) and the VTIFile
+    vti = VTIFile(filename)
+    if names is None: names = vti.arrays
+    return dict((name, vti.read(name)) for name in names), vti
@@ -0,0 +1,321 @@
+#
+# benchmark suite for the converters and the comparison on synthetic fields
+#
+# for every size (N^3 voxels) a smooth synthetic velocity field is generated
+# and written as the inputs of the tools (FLD, MHA, VTI, ComSol txt), then
+# every tool is run as its own process the way it is used (--input=...):
+#    fld2mha, mha2fld, txt2mha, vti2mha, MHAcompare, Digital_Phantom
+# and timed end to end, the peak RSS (resident memory high-water mark of the
+# process) and the time of the phases (read, decompress, reorder, scale,
+# compress, write, compare ...) come from the trace of its --profile option
+# (see Profiling.py), nested phases are also counted in the enclosing phase
+#
+# before that VTIReader is checked against base64 VTI files written the
+# way VTK and Palabos write them (header and data encoded separately)
+#
+# the results are written as JSON together with the commit and the machine,
+# so runs of different commits on the same machine can be compared:
+#    python benchmarks/benchmark.py --sizes=64,128 --output=before.json
+#    python benchmarks/benchmark.py --sizes=64,128 --compare=before.json
+#
+# the ComSol text input is only generated up to --txtmax (default 128),
+# larger text files take minutes to write and gigabytes of disk
+# 512^3 needs about 8 GB of memory and 10 GB of disk in the work directory
+#
+# ----- LICENSE -----
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#    For more detail see the GNU General Public License.
+#    <http://www.gnu.org/licenses/>.
+#
+#    THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#    IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#    FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#    AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#    LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#    OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+#    THE SOFTWARE.
+#
+# ----- REQUIREMENTS -----
+#
+#    This program was developed under Python Version 2.7
+#    with the following additional libraries:
+#    - numpy
+#    - nibabel (Digital_Phantom)
+#
+
+from __future__ import print_function
+import sys
+import os
+import time
+import json
+import zlib
+import base64
+import shutil
+import platform
+import tempfile
+import subprocess
+from getopt import getopt
+from multiprocessing import cpu_count
+import numpy as np
+
+TOOLS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, TOOLS_DIR)
+import vectorfield
+
+TOOLS = ['fld2mha', 'mha2fld', 'txt2mha', 'vti2mha', 'MHAcompare', 'Digital_Phantom']
+RESOLUTION = 100. # micrometer
+
+
+def usage():
+    print ('')
+    print ('Usage: '+Program_name+' [options]')
+    print ('')
+    print ('   Available options are:')
+    print ('       --sizes=<n,n,...> : edge lengths of the fields (default 64,128,256,512)')
+    print ('       --tools=<t,t,...> : tools to run (default all: '+','.join(TOOLS)+')')
+    print ('       --txtmax=<n>      : largest size with ComSol txt input (default 128)')
+    print ('       --repeat=<n>      : runs per tool and size, the fastest counts (default 1)')
+    print ('       --python=<exe>    : interpreter of the tools (default this one, the tools need --profile)')
+    print ('       --output=<file>   : JSON results (default benchmark_<commit>.json)')
+    print ('       --compare=<file>  : JSON results of an earlier run to compare with')
+    print ('       --workdir=<dir>   : directory for the generated files (default temporary)')
+    print ('       --keep            : keep the generated files')
+    print ('       --version         : version information')
+    print ('       -h --help         : this page')
+    print ('')
+
+def synthetic_field(n):
+    # smooth swirling flow along the last axis, zero outside a tube,
+    # float32 (n,n,n,3) in cm/s like a permeability.cpp result
+    x, y, z = np.ogrid[0:n, 0:n, 0:n]
+    x = (x-n/2.)/(n/2.); y = (y-n/2.)/(n/2.); z = z/float(n)
+    r2 = np.square(x)+np.square(y)
+    data = np.zeros((n,n,n,3), dtype=np.float32)
+    inside = (r2 < 0.8).astype(np.float32)
+    data[:,:,:,0] = (1.-r2)*(1.+0.1*np.sin(2*np.pi*z))*inside # along the tube
+    data[:,:,:,1] = 0.2*x*np.cos(2*np.pi*z)*inside
+    data[:,:,:,2] = -0.2*y*np.cos(2*np.pi*z)*inside
+    return data
+
+def write_comsol(filename, field):
+    # ComSol regular grid export in m and m/s, x fastest (inverse of read_comsol)
+    n = field.shape[0]
+    spacing = RESOLUTION*1.0e-6
+    with open(filename, "wb") as f:
+        header  = '% Model:              benchmark.mph\n'
+        header += '% Dimension:          3\n'
+        header += '% Nodes:              '+str(n*n*n)+'\n'
+        header += '% Expressions:        3\n'
+        header += '% Description:        Velocity field\n'
+        header += '% Length unit:        m\n'
+        header += '% x                       y                        z                        u (m/s)                  v (m/s)                  w (m/s)\n'
+        f.write(header.encode('ascii'))
+        coords = np.arange(n)*spacing
+        for k in range(n): # one plane at a time
+            vectors = field[:,:,k,::-1].transpose(1,0,2).reshape(-1,3)/100. # cm/s -> m/s, x fastest
+            xs = np.tile(coords, n); ys = np.repeat(coords, n); zs = np.full(n*n, coords[k])
+            np.savetxt(f, np.column_stack([xs, ys, zs, vectors]), fmt='%.9g')
+
+def generate(workdir, n, txtmax):
+    # one input per tool, with different names as the tools write next to their input
+    field = vectorfield.VectorField(synthetic_field(n), (RESOLUTION,)*3)
+    other = field.copy(field.data*np.float32(1.01)+np.float32(0.001)) # reference for MHAcompare
+    inputs = {}
+    for key, filename, f in [('fld', 'field_fld.fld', field), ('mha', 'field_mha.mha', field),
+                             ('mha2', 'other_mha.mha', other), ('vti', 'field_vti.vti', field)]:
+        inputs[key] = os.path.join(workdir, filename)
+        vectorfield.write(f, inputs[key])
+    if n <= txtmax:
+        inputs['txt'] = os.path.join(workdir, 'field_txt.txt')
+        write_comsol(inputs['txt'], field.data)
+    return inputs
+
+def write_vtk_base64(filename, data, fmt, compressed):
+    # VTI written the way vtkXMLWriter and Palabos write base64 data: UInt32
+    # header, the header and the data encoded as separate base64 streams
+    # data (z,y,x,components) like VTIReader returns it, x fastest in the file
+    nz, ny, nx = data.shape[:3]
+    raw = np.ascontiguousarray(data, dtype='<f4').tobytes()
+    if compressed:
+        blocks = [zlib.compress(raw[i:i+32768]) for i in range(0, len(raw), 32768)]
+        header = [len(blocks), 32768, len(raw)-(len(blocks)-1)*32768]+[len(b) for b in blocks]
+        raw = b''.join(blocks)
+    else: header = [len(raw)]
+    encoded = base64.b64encode(np.array(header, dtype='<u4').tobytes())+base64.b64encode(raw)
+    extent = '0 '+str(nx-1)+' 0 '+str(ny-1)+' 0 '+str(nz-1)
+    text  = '<?xml version="1.0"?>\n'
+    text += '<VTKFile type="ImageData" version="0.1" byte_order="LittleEndian"'
+    text += ' compressor="vtkZLibDataCompressor">\n' if compressed else '>\n'
+    text += '  <ImageData WholeExtent="'+extent+'" Origin="0 0 0" Spacing="1 1 1">\n'
+    text += '    <Piece Extent="'+extent+'">\n      <PointData Vectors="velocity">\n'
+    text += '        <DataArray type="Float32" Name="velocity" NumberOfComponents="3" format="'+fmt+'"'
+    if fmt == 'binary': text += '>\n          '+encoded.decode('ascii')+'\n        </DataArray>\n'
+    else: text += ' offset="0"/>\n'
+    text += '      </PointData>\n    </Piece>\n  </ImageData>\n'
+    if fmt == 'appended': text += '  <AppendedData encoding="base64">\n   _'+encoded.decode('ascii')+'\n  </AppendedData>\n'
+    text += '</VTKFile>\n'
+    with open(filename, 'wb') as f: f.write(text.encode('ascii'))
+
+def check_vti_base64(workdir):
+    # VTIReader must decode base64 as written by VTK/Palabos, not only by FieldIO
+    from VTIReader import VTIFile
+    data = synthetic_field(9) # 9^3*3*4 bytes, not a multiple of 3
+    for fmt in ['binary', 'appended']:
+        for compressed in [False, True]:
+            filename = os.path.join(workdir, 'vtk_base64.vti')
+            write_vtk_base64(filename, data, fmt, compressed)
+            try: correct = np.array_equal(VTIFile(filename).read('velocity'), data)
+            except ValueError: correct = False
+            if not correct: return 'format="'+fmt+'"'+(' compressed' if compressed else '')
+            os.remove(filename)
+    return None
+
+def phantom_parameters(n):
+    # Digital_Phantom inputs (length mm, diameter mm, resolution um, pressure Pa) for about n^3 voxels
+    return [n*RESOLUTION*1.0e-3, round(n*RESOLUTION*1.0e-3/1.25, 3), RESOLUTION, 20000]
+
+def command(tool, inputs, n):
+    # commandline and stdin of a tool, None if the input is not available
+    script = os.path.join(TOOLS_DIR, tool+'.py')
+    if tool == 'fld2mha': return [script, '--input='+inputs['fld']], None
+    if tool == 'mha2fld': return [script, '--input='+inputs['mha']], None
+    if tool == 'vti2mha': return [script, '--input='+inputs['vti']], None
+    if tool == 'MHAcompare': return [script, '--input1='+inputs['mha'], '--input2='+inputs['mha2']], None
+    if tool == 'txt2mha':
+        if not 'txt' in inputs: return None, None
+        return [script, '--input='+inputs['txt']], None
+    if tool == 'Digital_Phantom':
+        return [script], ''.join(str(v)+'\n' for v in phantom_parameters(n))
+    return None, None
+
+def run(python, args, stdin_text, workdir):
+    # returns seconds, peak RSS in MB, the seconds per phase (the spans of --profile,
+    # see Profiling.py), return code and error output
+    env = dict(os.environ)
+    env['PYTHONPATH'] = TOOLS_DIR+(os.pathsep+env['PYTHONPATH'] if env.get('PYTHONPATH') else '')
+    tracefile = os.path.join(workdir, 'trace.json')
+    if os.path.exists(tracefile): os.remove(tracefile)
+    stderr = tempfile.TemporaryFile()
+    with open(os.devnull, 'wb') as devnull:
+        start = time.time()
+        process = subprocess.Popen([python]+args+['--profile='+tracefile], cwd=workdir, env=env,
+                                   stdout=devnull, stderr=stderr, stdin=subprocess.PIPE)
+        if stdin_text: process.stdin.write(stdin_text.encode('ascii'))
+        process.stdin.close()
+        process.wait()
+        seconds = time.time()-start
+    rss = None; phases = {}
+    if os.path.exists(tracefile):
+        with open(tracefile) as f: trace = json.load(f)['otherData']
+        rss = trace['peak_mb']
+        phases = dict((name, round(total['seconds'], 4)) for name, total in trace['totals'].items())
+        os.remove(tracefile)
+    stderr.seek(0)
+    error = stderr.read().decode('latin-1').strip()
+    stderr.close()
+    return seconds, rss, phases, process.returncode, error.splitlines()[-1] if error else ''
+
+def git_commit():
+    try:
+        output = subprocess.Popen(['git', 'rev-parse', '--short', 'HEAD'], cwd=TOOLS_DIR,
+                                  stdout=subprocess.PIPE, stderr=subprocess.PIPE).communicate()[0]
+        return output.decode('ascii').strip() or 'unknown'
+    except OSError: return 'unknown'
+
+def machine():
+    return {'platform': platform.platform(), 'processor': platform.processor() or platform.machine(),
+            'cpus': cpu_count(), 'python': platform.python_version(), 'numpy': np.__version__}
+
+def compare_results(results, previous):
+    # ratio of the end to end times, > 1 is slower than before
+    old = dict(((r['tool'], r['size']), r) for r in previous['results'])
+    print ('')
+    print ('Compared with commit '+previous.get('commit', '?')+' ('+previous.get('date', '?')+')')
+    if previous.get('machine') != results['machine']: print ('Warning: results of a different machine or python')
+    for r in results['results']:
+        o = old.get((r['tool'], r['size']))
+        if o is None or o.get('seconds') is None or r.get('seconds') is None: continue
+        ratio = r['seconds']/o['seconds'] if o['seconds'] > 0 else float('nan')
+        print ('%-16s %4d^3  %8.3fs -> %8.3fs  x%.2f%s' % (r['tool'], r['size'], o['seconds'], r['seconds'], ratio,
+                                                         '  SLOWER' if ratio > 1.1 else ''))
+
+#general initialization stuff
+Program_name = os.path.basename(sys.argv[0]);
+if Program_name.find('.')>0: Program_name = Program_name[:Program_name.find('.')]
+Program_version = "v0.1" # program version
+
+# parse commandline parameters (if present)
+try: opts, args =  getopt( sys.argv[1:],'h',['help','version','sizes=','tools=','txtmax=','repeat=',
+                                                  'python=','output=','compare=','workdir=','keep'])
+except:
+    error=str(sys.argv[1:]).replace("[","").replace("]","")
+    if "-" in str(error) and not "--" in str(error):
+          print ('ERROR: Commandline '+str(error)+',   maybe you mean "--"')
+    else: print ('ERROR: Commandline '+str(error))
+    usage(); exit(2)
+if len(args)>0:
+    print ('ERROR: Commandline option "'+args[0]+'" not recognized')
+    usage(); exit(2)
+argDict = dict(opts)
+if '-h' in argDict: usage(); exit(0)
+if '--help' in argDict: usage(); exit(0)
+if '--version' in argDict: print (Program_name+' '+Program_version); exit(0)
+try:
+    sizes = [int(n) for n in argDict.get('--sizes', '64,128,256,512').split(',')]
+    txtmax = int(argDict.get('--txtmax', 128))
+    repeat = int(argDict.get('--repeat', 1))
+except ValueError: print ('ERROR: Commandline --sizes, --txtmax and --repeat must be integers'); exit(2)
+if min(sizes) < 8 or repeat < 1: print ('ERROR: Commandline sizes must be >= 8 and --repeat >= 1'); exit(2)
+tools = argDict.get('--tools', ','.join(TOOLS)).split(',')
+for tool in tools:
+    if not tool in TOOLS: print ('ERROR: Unknown tool "'+tool+'", available are: '+', '.join(TOOLS)); exit(2)
+previous = None
+if '--compare' in argDict:
+    try:
+        with open(argDict['--compare']) as f: previous = json.load(f)
+    except (IOError, ValueError): print ('ERROR: Unable to read '+argDict['--compare']); exit(2)
+python = argDict.get('--python', sys.executable)
+commit = git_commit()
+OUTfile = argDict.get('--output', 'benchmark_'+commit+'.json')
+
+workdir = tempfile.mkdtemp(prefix='benchmark_check_')
+failed = check_vti_base64(workdir)
+shutil.rmtree(workdir, ignore_errors=True)
+if failed: print ('ERROR: VTIReader decodes a VTK style base64 VTI ('+failed+') wrong'); exit(1)
+
+results = {'commit': commit, 'python': python, 'date': time.strftime('%Y-%m-%d %H:%M:%S'), 'machine': machine(), 'results': []}
+for n in sizes:
+    if '--workdir' in argDict:
+        workdir = os.path.join(argDict['--workdir'], str(n))
+        if not os.path.isdir(workdir): os.makedirs(workdir)
+    else: workdir = tempfile.mkdtemp(prefix='benchmark_'+str(n)+'_')
+    print ('Generating '+str(n)+'^3 inputs in '+workdir)
+    start = time.time()
+    inputs = generate(workdir, n, txtmax)
+    print ('         %.3fs' % (time.time()-start))
+    for tool in tools:
+        args, stdin_text = command(tool, inputs, n)
+        if args is None: print ('%-16s %4d^3  skipped (no input)' % (tool, n)); continue
+        best = None
+        for i in range(repeat):
+            run_result = run(python, args, stdin_text, workdir)
+            if best is None or (run_result[3] == 0 and run_result[0] < best[0]): best = run_result
+        seconds, rss, phases, returncode, error = best
+        result = {'tool': tool, 'size': n, 'seconds': round(seconds, 4) if returncode == 0 else None,
+                  'peak_rss_mb': round(rss, 1) if rss is not None else None, 'returncode': returncode,
+                  'phases': phases, 'input_bytes': os.path.getsize(args[1].split('=',1)[1]) if len(args) > 1 else None}
+        if returncode != 0: result['error'] = error
+        results['results'].append(result)
+        if returncode == 0:
+            print ('%-16s %4d^3  %8.3fs  %8s MB  %s' % (tool, n, seconds, '-' if rss is None else '%.1f' % rss,
+                   '  '.join(name+' %.3fs' % t for name, t in sorted(phases.items()))))
+        else: print ('%-16s %4d^3  FAILED (%d) %s' % (tool, n, returncode, error))
+    if not '--keep' in argDict: shutil.rmtree(workdir, ignore_errors=True)
+
+with open(OUTfile, 'w') as f: json.dump(results, f, indent=1, sort_keys=True)
+print ('Results written to '+OUTfile)
+if previous is not None: compare_results(results, previous)
@@ -0,0 +1,179 @@
+#
+# accuracy of the single precision build of permeability.cpp
+#
+# runs the Hagen-Poiseuille tube of Digital_Phantom (default L=5mm, D=1.5mm,
+# R=100um, P=20000Pa) through Palabos_Geometry and through a double and a
+# float build of permeability.cpp (compiled with -DSINGLE_PRECISION), then
+# reports for both builds the permeability (from summary.json) against the
+# effective permeability of Digital_Phantom, the relative difference of
+# float to double and the voxelwise magnitude and angle deviations of the
+# two velocity fields (vectorfield.compare, the same as MHAcompare):
+#    python benchmarks/precision.py --double=permeability --float=permeability_float
+#
+# the results are written as JSON, so the measured deviation of a commit
+# can be documented and compared with later runs
+#
+# ----- LICENSE -----
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#    For more detail see the GNU General Public License.
+#    <http://www.gnu.org/licenses/>.
+#
+#    THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#    IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#    FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#    AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#    LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#    OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+#    THE SOFTWARE.
+#
+# ----- REQUIREMENTS -----
+#
+#    This program was developed under Python Version 2.7
+#    with the following additional libraries:
+#    - numpy
+#    - nibabel (Digital_Phantom, Palabos_Geometry)
+#    and the double and float builds of permeability.cpp
+#
+
+from __future__ import print_function
+import sys
+import os
+import re
+import glob
+import json
+import time
+import shutil
+import tempfile
+import subprocess
+from getopt import getopt
+
+TOOLS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, TOOLS_DIR)
+import vectorfield
+
+
+def usage():
+    print ('')
+    print ('Usage: '+Program_name+' [options] --double=<executable> --float=<executable>')
+    print ('')
+    print ('   Available options are:')
+    print ('       --double=<exe>    : permeability.cpp build with double precision')
+    print ('       --float=<exe>     : permeability.cpp build with -DSINGLE_PRECISION')
+    print ('       --phantom=<L,D,R,P> : length [mm], diameter [mm], resolution [um], pressure [Pa] (default 5,1.5,100,20000)')
+    print ('       --deltaP=<dP>     : lattice pressure difference of the simulations (default 0.00005)')
+    print ('       --mpi=<command>   : prefix of the simulations, e.g. "mpirun -np 4" (default none)')
+    print ('       --output=<file>   : JSON results (default precision_<commit>.json)')
+    print ('       --workdir=<dir>   : directory for the generated files (default temporary)')
+    print ('       --keep            : keep the generated files')
+    print ('       --version         : version information')
+    print ('       -h --help         : this page')
+    print ('')
+
+def run(args, workdir, stdin_text=None):
+    # returns the output of a command, exits with its error output if it fails
+    process = subprocess.Popen(args, cwd=workdir, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                               stderr=subprocess.STDOUT)
+    output = process.communicate(stdin_text.encode('ascii') if stdin_text else None)[0].decode('latin-1')
+    if process.returncode != 0:
+        print ('ERROR: '+' '.join(args)+' failed:\n'+output[-2000:]); sys.exit(1)
+    return output
+
+def output_file(outdir, pattern):
+    # permeability.cpp prefixes its outputs with "<outdir>\" which is a
+    # directory on Windows and part of the file name elsewhere
+    names = glob.glob(os.path.join(outdir, pattern)) or glob.glob(outdir+'\\'+pattern)
+    if len(names) == 0: print ('ERROR: No '+pattern+' written to '+outdir); sys.exit(1)
+    return sorted(names)[-1]
+
+def simulate(executable, geometry, dims, resolution, workdir, name):
+    # runs one build and returns its permeability in um^2 and its velocity field
+    outdir = os.path.join(workdir, name)
+    if not os.path.isdir(outdir): os.makedirs(outdir)
+    start = time.time()
+    run(mpi+[executable, geometry, outdir]+[str(n) for n in dims]+
+        ['%g' % (resolution*1.0e-6), str(deltaP), '--novti', '--notagvtk', '--nostl', '--gif=0'], workdir)
+    with open(output_file(outdir, 'summary.json')) as f: summary = json.load(f)
+    print ('%-7s %8.1fs  precision %s, %d iterations, permeability %.4f um^2' %
+           (name, time.time()-start, summary['precision'], summary['runs'][0]['iterations'],
+            summary['runs'][0]['permeability_um2']))
+    return summary['runs'][0]['permeability_um2'], vectorfield.read(output_file(outdir, 'vtk*_velocity.mha'))
+
+#general initialization stuff
+Program_name = os.path.basename(sys.argv[0]);
+if Program_name.find('.')>0: Program_name = Program_name[:Program_name.find('.')]
+Program_version = "v0.1" # program version
+
+# parse commandline parameters (if present)
+try: opts, args =  getopt( sys.argv[1:],'h',['help','version','double=','float=','phantom=','deltaP=',
+                                                  'mpi=','output=','workdir=','keep'])
+except:
+    error=str(sys.argv[1:]).replace("[","").replace("]","")
+    if "-" in str(error) and not "--" in str(error):
+          print ('ERROR: Commandline '+str(error)+',   maybe you mean "--"')
+    else: print ('ERROR: Commandline '+str(error))
+    usage(); exit(2)
+if len(args)>0:
+    print ('ERROR: Commandline option "'+args[0]+'" not recognized')
+    usage(); exit(2)
+argDict = dict(opts)
+if '-h' in argDict: usage(); exit(0)
+if '--help' in argDict: usage(); exit(0)
+if '--version' in argDict: print (Program_name+' '+Program_version); exit(0)
+if not '--double' in argDict or not '--float' in argDict:
+    print ('ERROR: Specify the --double and the --float build of permeability.cpp'); usage(); exit(2)
+executables = [(name, os.path.abspath(argDict['--'+name]) if os.path.exists(argDict['--'+name]) else argDict['--'+name])
+               for name in ['double', 'float']]
+try:
+    length, diameter, resolution, pressure = [float(x) for x in argDict.get('--phantom', '5,1.5,100,20000').split(',')]
+    deltaP = float(argDict.get('--deltaP', 0.00005))
+except ValueError: print ('ERROR: Commandline --phantom must be L,D,R,P and --deltaP a number'); exit(2)
+mpi = argDict.get('--mpi', '').split()
+try:
+    commit = subprocess.Popen(['git', 'rev-parse', '--short', 'HEAD'], cwd=TOOLS_DIR,
+                              stdout=subprocess.PIPE, stderr=subprocess.PIPE).communicate()[0].decode('ascii').strip()
+except OSError: commit = ''
+OUTfile = argDict.get('--output', 'precision_'+(commit or 'unknown')+'.json')
+if '--workdir' in argDict:
+    workdir = os.path.abspath(argDict['--workdir'])
+    if not os.path.isdir(workdir): os.makedirs(workdir)
+else: workdir = tempfile.mkdtemp(prefix='precision_')
+
+# phantom and its analytic permeability, then the geometry for permeability.cpp
+print ('Digital_Phantom L=%gmm D=%gmm R=%gum P=%gPa in %s' % (length, diameter, resolution, pressure, workdir))
+output = run([sys.executable, os.path.join(TOOLS_DIR, 'Digital_Phantom.py')], workdir,
+             ''.join('%g\n' % v for v in [length, diameter, resolution, pressure]))
+phantom_permeability = float(re.search(r'Effect\. permeability \(all\)\s*:\s*([0-9.eE+-]+)', output).group(1))
+phantom = re.search(r'output file "(Pantom_[^"]*)"', output).group(1)
+output = run([sys.executable, os.path.join(TOOLS_DIR, 'Palabos_Geometry.py'), '--input='+phantom, '--noprune',
+              '--output=geometry.mha'], workdir)
+dims = [int(n) for n in re.search(r'nx ny nz = (\d+) (\d+) (\d+)', output).groups()]
+
+results = {}
+for name, executable in executables:
+    results[name] = simulate(executable, os.path.join(workdir, 'geometry.mha'), dims, resolution, workdir, name)
+_, _, magnitude_deviation, angular_deviation = vectorfield.compare(results['float'][1], results['double'][1])
+double_permeability, float_permeability = results['double'][0], results['float'][0]
+summary = {'commit': commit, 'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+           'phantom': {'length_mm': length, 'diameter_mm': diameter, 'resolution_um': resolution,
+                       'pressure_pa': pressure, 'dims': dims, 'permeability_um2': phantom_permeability},
+           'deltaP': deltaP,
+           'double_permeability_um2': double_permeability, 'float_permeability_um2': float_permeability,
+           'float_vs_double_percent': (float_permeability-double_permeability)/double_permeability*100.,
+           'double_vs_phantom_percent': (double_permeability-phantom_permeability)/phantom_permeability*100.,
+           'average_magnitude_deviation_percent': magnitude_deviation,
+           'average_angular_deviation_degrees': angular_deviation}
+print ('')
+print ('Digital_Phantom effective permeability : %.4f um^2' % phantom_permeability)
+print ('double build                           : %.4f um^2 (%+.3f%% to the phantom)' %
+       (double_permeability, summary['double_vs_phantom_percent']))
+print ('float build                            : %.4f um^2 (%+.5f%% to double)' %
+       (float_permeability, summary['float_vs_double_percent']))
+print ('float vs double velocity field         : %.5f %% magnitude, %.5f degrees angle (averages)' %
+       (magnitude_deviation, angular_deviation))
+with open(OUTfile, 'w') as f: json.dump(summary, f, indent=1, sort_keys=True)
+print ('Results written to '+OUTfile)
+if not '--keep' in argDict and not '--workdir' in argDict: shutil.rmtree(workdir, ignore_errors=True)
@@ -6,6 +6,16 @@
  * alterations:
  *     1) "\\" adaptations torun under windows
  *     2)m conversions to pysical units
+ *     3) binary geometry input (uint8 .raw / .mha, see Palabos_Geometry.py)
+ *     4) velocity output directly as MHA (same as vti2mha.py)
+ *     5) checkpoint/restart
+ *     6) flow in y- and z-direction, permeability tensor in one run
+ *     7) single precision build option
+ *     8) sparse lattice allocation
+ *     9) initial state from file (coarse-to-fine warm start)
+ *    10) warm-started pressure sweeps
+ *    11) timers, MLUPS and peak memory in a JSON summary
+ *    12) optional diagnostics (tag VTK, downsampled STL, gif frequency)
  *
  * Copyright (C) 2011-2017 FlowKit Sarl
  * Route d'Oron 2
@@ -37,84 +47,389 @@
 #include <vector>
 #include <cmath>
 #include <cstdlib>
+#include <fstream>
+#include <sstream>
+#include <string>
+#include <deque>
+#include <map>
+#include <cstdio>
+#include <algorithm>
+#ifndef _WIN32
+#include <sys/resource.h>
+#endif
 
 using namespace plb;
 
+// The scalar type of the lattice is selected at build time, compile with
+//   -DSINGLE_PRECISION for float (half the memory of the populations, see README.md
+//   for the accuracy check), the default is double.
+#ifdef SINGLE_PRECISION
+typedef float T;
+#else
 typedef double T;
+#endif
 #define DESCRIPTOR descriptors::D3Q19Descriptor
 
 // This function object returns a zero velocity, and a pressure which decreases
-//   linearly in x-direction. It is used to initialize the particle populations.
+//   linearly in flow direction (0=x, 1=y, 2=z). It is used to initialize the particle populations.
 class PressureGradient {
 public:
-    PressureGradient(T deltaP_, plint nx_) : deltaP(deltaP_), nx(nx_)
+    PressureGradient(T deltaP_, plint n_, plint direction_=0) : deltaP(deltaP_), n(n_), direction(direction_)
     { }
     void operator() (plint iX, plint iY, plint iZ, T& density, Array<T,3>& velocity) const
     {
         velocity.resetToZero();
-        density = (T)1 - deltaP*DESCRIPTOR<T>::invCs2 / (T)(nx-1) * (T)iX;
+        plint pos[3] = {iX, iY, iZ};
+        density = (T)1 - deltaP*DESCRIPTOR<T>::invCs2 / (T)(n-1) * (T)pos[direction];
 
     }
 private:
     T deltaP;
-    plint nx;
+    plint n;
+    plint direction;
 };
 
-void readGeometry(std::string fNameIn, std::string fNameOut, MultiScalarField3D<int>& geometry, T resolution)
+// Returns the plane at position pos perpendicular to the flow direction,
+//   without the outermost cells in the other directions if shrink is true.
+Box3D flowPlane(MultiBlockLattice3D<T,DESCRIPTOR>& lattice, plint direction, plint pos, bool shrink)
+{
+    plint s = shrink ? 1 : 0;
+    Box3D plane(s, lattice.getNx()-1-s, s, lattice.getNy()-1-s, s, lattice.getNz()-1-s);
+    if (direction == 0) { plane.x0 = pos; plane.x1 = pos; }
+    if (direction == 1) { plane.y0 = pos; plane.y1 = pos; }
+    if (direction == 2) { plane.z0 = pos; plane.z1 = pos; }
+    return plane;
+}
+
+plint flowLength(MultiBlockLattice3D<T,DESCRIPTOR>& lattice, plint direction)
+{
+    if (direction == 1) return lattice.getNy();
+    if (direction == 2) return lattice.getNz();
+    return lattice.getNx();
+}
+
+// This data processor reads a binary geometry (one uint8 tag per cell, z fastest and
+//   x slowest, the same order as the ASCII file) directly into the scalar field.
+//   Every process only reads the rows of its own blocks.
+class ReadBinaryGeometry3D : public BoxProcessingFunctional3D_S<int> {
+public:
+    ReadBinaryGeometry3D(std::string fName_, std::streamoff headerSize_, plint ny_, plint nz_)
+        : fName(fName_), headerSize(headerSize_), ny(ny_), nz(nz_)
+    { }
+    virtual void process(Box3D domain, ScalarField3D<int>& geometry)
+    {
+        Dot3D location = geometry.getLocation();
+        std::ifstream geometryFile(fName.c_str(), std::ios::in | std::ios::binary);
+        std::vector<char> row(domain.getNz());
+        for (plint iX=domain.x0; iX<=domain.x1; ++iX) {
+            for (plint iY=domain.y0; iY<=domain.y1; ++iY) {
+                std::streamoff pos = headerSize +
+                    ((std::streamoff)(iX+location.x)*ny + (iY+location.y))*nz + (domain.z0+location.z);
+                geometryFile.seekg(pos);
+                geometryFile.read(&row[0], (std::streamsize)row.size());
+                for (plint iZ=domain.z0; iZ<=domain.z1; ++iZ) {
+                    geometry.get(iX,iY,iZ) = (int)(unsigned char)row[iZ-domain.z0];
+                }
+            }
+        }
+    }
+    virtual ReadBinaryGeometry3D* clone() const
+    {
+        return new ReadBinaryGeometry3D(*this);
+    }
+    virtual void getTypeOfModification(std::vector<modif::ModifT>& modified) const
+    {
+        modified[0] = modif::staticVariables;
+    }
+    virtual BlockDomain::DomainT appliesTo() const
+    {
+        return BlockDomain::bulk;
+    }
+private:
+    std::string fName;
+    std::streamoff headerSize;
+    plint ny, nz;
+};
+
+// Returns the size of the header of a binary input file: 0 for raw files, the
+//   header length for uncompressed MHA files (DimSize = nz ny nx), whose element type
+//   and number of channels are checked.
+std::streamoff readBinaryHeader(std::string fNameIn, std::string expectedType, plint nComponents,
+        plint elementSize, plint nx, plint ny, plint nz)
+{
+    std::ifstream geometryFile(fNameIn.c_str(), std::ios::in | std::ios::binary);
+    if (!geometryFile.is_open()) {
+        pcout << "Error: could not open file " << fNameIn << std::endl;
+        exit(EXIT_FAILURE);
+    }
+    std::streamoff headerSize = 0;
+    if (fNameIn.size()>4 && fNameIn.substr(fNameIn.size()-4)==".mha") {
+        std::string line, elementType, compressed, dimSize, channels("1");
+        while (std::getline(geometryFile, line)) {
+            std::string::size_type equal = line.find('=');
+            if (equal == std::string::npos) continue;
+            std::istringstream name(line.substr(0, equal));
+            std::string paramName;
+            name >> paramName;
+            std::string value = line.substr(equal+1);
+            value.erase(0, value.find_first_not_of(" \t"));
+            value.erase(value.find_last_not_of(" \t\r")+1);
+            if (paramName == "ElementType") elementType = value;
+            if (paramName == "CompressedData") compressed = value;
+            if (paramName == "DimSize") dimSize = value;
+            if (paramName == "ElementNumberOfChannels") channels = value;
+            if (paramName == "ElementDataFile") break;
+        }
+        headerSize = geometryFile.tellg();
+        std::ostringstream expectedDims, expectedChannels;
+        expectedDims << nz << " " << ny << " " << nx;
+        expectedChannels << nComponents;
+        if (elementType != expectedType || compressed == "True" || channels != expectedChannels.str()) {
+            pcout << "Error: " << fNameIn << " must be an uncompressed " << expectedType << " MHA file with "
+                  << nComponents << " channel(s)" << std::endl;
+            exit(EXIT_FAILURE);
+        }
+        if (dimSize != expectedDims.str()) {
+            pcout << "Error: DimSize " << dimSize << " of " << fNameIn << " does not match "
+                  << expectedDims.str() << " (nz ny nx)" << std::endl;
+            exit(EXIT_FAILURE);
+        }
+    }
+    geometryFile.seekg(0, std::ios::end);
+    if ((std::streamoff)geometryFile.tellg() < headerSize + (std::streamoff)nx*ny*nz*nComponents*elementSize) {
+        pcout << "Error: file " << fNameIn << " is smaller than expected from nx*ny*nz" << std::endl;
+        exit(EXIT_FAILURE);
+    }
+    return headerSize;
+}
+
+bool isBinaryGeometry(std::string fNameIn)
+{
+    std::string ext = fNameIn.size()>4 ? fNameIn.substr(fNameIn.size()-4) : "";
+    return ext == ".raw" || ext == ".mha";
+}
+
+// This data processor reads a binary geometry downsampled by an integer factor: every
+//   cell of the coarse field is the solid fraction (tags 1 and 2) of factor^3 cells of the
+//   geometry file, so the STL of a large sample is computed on a much smaller field.
+class DownsampleBinaryGeometry3D : public BoxProcessingFunctional3D_S<T> {
+public:
+    DownsampleBinaryGeometry3D(std::string fName_, std::streamoff headerSize_, plint factor_,
+            plint nx_, plint ny_, plint nz_)
+        : fName(fName_), headerSize(headerSize_), factor(factor_), nx(nx_), ny(ny_), nz(nz_)
+    { }
+    virtual void process(Box3D domain, ScalarField3D<T>& solid)
+    {
+        Dot3D location = solid.getLocation();
+        std::ifstream geometryFile(fName.c_str(), std::ios::in | std::ios::binary);
+        const plint z0 = (domain.z0+location.z)*factor;
+        const plint z1 = std::min((domain.z1+location.z+1)*factor, nz);
+        std::vector<char> row(z1-z0);
+        for (plint iX=domain.x0; iX<=domain.x1; ++iX) {
+            for (plint iY=domain.y0; iY<=domain.y1; ++iY) {
+                std::vector<plint> count(domain.getNz(), 0), total(domain.getNz(), 0);
+                const plint x0 = (iX+location.x)*factor, x1 = std::min(x0+factor, nx);
+                const plint y0 = (iY+location.y)*factor, y1 = std::min(y0+factor, ny);
+                for (plint fineX=x0; fineX<x1; ++fineX) {
+                    for (plint fineY=y0; fineY<y1; ++fineY) {
+                        geometryFile.seekg(headerSize + ((std::streamoff)fineX*ny + fineY)*nz + z0);
+                        geometryFile.read(&row[0], (std::streamsize)row.size());
+                        for (plint fineZ=z0; fineZ<z1; ++fineZ) {
+                            plint iZ = (fineZ-z0)/factor;
+                            if (row[fineZ-z0] != 0) ++count[iZ];
+                            ++total[iZ];
+                        }
+                    }
+                }
+                for (plint iZ=domain.z0; iZ<=domain.z1; ++iZ) {
+                    solid.get(iX,iY,iZ) = total[iZ-domain.z0] > 0 ?
+                        (T)count[iZ-domain.z0]/(T)total[iZ-domain.z0] : (T)1;
+                }
+            }
+        }
+    }
+    virtual DownsampleBinaryGeometry3D* clone() const
+    {
+        return new DownsampleBinaryGeometry3D(*this);
+    }
+    virtual void getTypeOfModification(std::vector<modif::ModifT>& modified) const
+    {
+        modified[0] = modif::staticVariables;
+    }
+    virtual BlockDomain::DomainT appliesTo() const
+    {
+        return BlockDomain::bulk;
+    }
+private:
+    std::string fName;
+    std::streamoff headerSize;
+    plint factor, nx, ny, nz;
+};
+
+void readGeometry(std::string fNameIn, MultiScalarField3D<int>& geometry)
 {
     const plint nx = geometry.getNx();
     const plint ny = geometry.getNy();
     const plint nz = geometry.getNz();
 
-    Box3D sliceBox(0,0, 0,ny-1, 0,nz-1);
-    std::auto_ptr<MultiScalarField3D<int> > slice = generateMultiScalarField<int>(geometry, sliceBox);
-    plb_ifstream geometryFile(fNameIn.c_str());
-    for (plint iX=0; iX<nx-1; ++iX) {
-        if (!geometryFile.is_open()) {
-            pcout << "Error: could not open geometry file " << fNameIn << std::endl;
-            exit(EXIT_FAILURE);
+    global::timer("readGeometry").start();
+    if (isBinaryGeometry(fNameIn)) {
+        std::streamoff headerSize = readBinaryHeader(fNameIn, "MET_UCHAR", 1, 1, nx, ny, nz);
+        applyProcessingFunctional(new ReadBinaryGeometry3D(fNameIn, headerSize, ny, nz),
+                                  geometry.getBoundingBox(), geometry);
+    }
+    else {
+        Box3D sliceBox(0,0, 0,ny-1, 0,nz-1);
+        std::auto_ptr<MultiScalarField3D<int> > slice = generateMultiScalarField<int>(geometry, sliceBox);
+        plb_ifstream geometryFile(fNameIn.c_str());
+        for (plint iX=0; iX<nx-1; ++iX) {
+            if (!geometryFile.is_open()) {
+                pcout << "Error: could not open geometry file " << fNameIn << std::endl;
+                exit(EXIT_FAILURE);
+            }
+            geometryFile >> *slice;
+            copy(*slice, slice->getBoundingBox(), geometry, Box3D(iX,iX, 0,ny-1, 0,nz-1));
         }
-        geometryFile >> *slice;
-        copy(*slice, slice->getBoundingBox(), geometry, Box3D(iX,iX, 0,ny-1, 0,nz-1));
     }
+    global::timer("readGeometry").stop();
+}
 
-    {
-        VtkImageOutput3D<T> vtkOut("porousMedium", resolution*1e6);
-        vtkOut.writeData<float>(*copyConvert<int,T>(geometry, geometry.getBoundingBox()), "tag", 1.0);
+// Writes the tag field as porousMedium VTK.
+void writeGeometryVTK(MultiScalarField3D<int>& geometry, T resolution)
+{
+    global::timer("geometryVTK").start();
+    VtkImageOutput3D<T> vtkOut("porousMedium", resolution*1e6);
+    vtkOut.writeData<float>(*copyConvert<int,T>(geometry, geometry.getBoundingBox()), "tag", 1.0);
+    global::timer("geometryVTK").stop();
+}
+
+// Writes the pore surface as porousMedium.stl (lattice units). With factor > 1 the marching
+//   cubes run on the geometry file downsampled by factor in every direction (binary input
+//   only), the triangles are scaled back to the full resolution lattice.
+void writeGeometrySTL(std::string fNameIn, std::string fNameOut, MultiScalarField3D<int>& geometry, plint factor)
+{
+    global::timer("STL").start();
+    if (factor > 1 && !isBinaryGeometry(fNameIn)) {
+        pcout << "Warning: the downsampled STL needs a binary geometry, writing the full resolution" << std::endl;
+        factor = 1;
+    }
+    std::auto_ptr<MultiScalarField3D<T> > floatTags;
+    if (factor > 1) {
+        const plint nx = geometry.getNx();
+        const plint ny = geometry.getNy();
+        const plint nz = geometry.getNz();
+        std::streamoff headerSize = readBinaryHeader(fNameIn, "MET_UCHAR", 1, 1, nx, ny, nz);
+        floatTags.reset(new MultiScalarField3D<T>((nx+factor-1)/factor, (ny+factor-1)/factor, (nz+factor-1)/factor));
+        applyProcessingFunctional(new DownsampleBinaryGeometry3D(fNameIn, headerSize, factor, nx, ny, nz),
+                                  floatTags->getBoundingBox(), *floatTags);
+    }
+    else {
+        floatTags = copyConvert<int,T>(geometry, geometry.getBoundingBox());
     }
+    std::vector<T> isoLevels;
+    isoLevels.push_back(0.5);
+    typedef TriangleSet<T>::Triangle Triangle;
+    std::vector<Triangle> triangles;
+    Box3D domain = floatTags->getBoundingBox().enlarge(-1);
+    domain.x0++;
+    domain.x1--;
+    isoSurfaceMarchingCube(triangles, *floatTags, isoLevels, domain);
+    TriangleSet<T> set(triangles);
+    if (factor > 1) {
+        // a coarse cell c covers the fine cells c*factor ... c*factor+factor-1
+        set.scale((T)factor);
+        set.translate(Array<T,3>((T)(factor-1)/2, (T)(factor-1)/2, (T)(factor-1)/2));
+    }
+    std::string outDir = fNameOut + "\\";
+    set.writeBinarySTL(outDir + "porousMedium.stl");
+    global::timer("STL").stop();
+}
+
+void setPressureDifference(MultiBlockLattice3D<T,DESCRIPTOR>& lattice, T deltaP, plint direction)
+{
+    const plint n = flowLength(lattice, direction);
+    setBoundaryDensity(lattice, flowPlane(lattice, direction, 0, true), (T) 1.);
+    setBoundaryDensity(lattice, flowPlane(lattice, direction, n-1, true), (T) 1. - deltaP*DESCRIPTOR<T>::invCs2);
+}
 
+// This data processor rescales the converged state of the fluid cells to a new pressure
+//   difference: in the Darcy regime the density deviation and the velocity are proportional
+//   to deltaP, so the equilibrium part is recomputed with rhoBar and j multiplied by
+//   scale = deltaP_new/deltaP_old and the non-equilibrium part is multiplied by scale.
+class RescalePopulations3D : public BoxProcessingFunctional3D_LS<T,DESCRIPTOR,int> {
+public:
+    RescalePopulations3D(T scale_) : scale(scale_)
+    { }
+    virtual void process(Box3D domain, BlockLattice3D<T,DESCRIPTOR>& lattice, ScalarField3D<int>& geometry)
     {
-        std::auto_ptr<MultiScalarField3D<T> > floatTags = copyConvert<int,T>(geometry, geometry.getBoundingBox());
-        std::vector<T> isoLevels;
-        isoLevels.push_back(0.5);
-        typedef TriangleSet<T>::Triangle Triangle;
-        std::vector<Triangle> triangles;
-        Box3D domain = floatTags->getBoundingBox().enlarge(-1);
-        domain.x0++;
-        domain.x1--;
-        isoSurfaceMarchingCube(triangles, *floatTags, isoLevels, domain);
-        TriangleSet<T> set(triangles);
-        std::string outDir = fNameOut + "\\";
-        set.writeBinarySTL(outDir + "porousMedium.stl");
+        Dot3D offset = computeRelativeDisplacement(lattice, geometry);
+        for (plint iX=domain.x0; iX<=domain.x1; ++iX) {
+            for (plint iY=domain.y0; iY<=domain.y1; ++iY) {
+                for (plint iZ=domain.z0; iZ<=domain.z1; ++iZ) {
+                    if (geometry.get(iX+offset.x,iY+offset.y,iZ+offset.z) != 0) continue;
+                    Cell<T,DESCRIPTOR>& cell = lattice.get(iX,iY,iZ);
+                    T rhoBar;
+                    Array<T,3> j;
+                    momentTemplates<T,DESCRIPTOR>::compute_rhoBar_j(cell, rhoBar, j);
+                    T jSqr = normSqr(j);
+                    T newRhoBar = rhoBar*scale;
+                    Array<T,3> newJ = j*scale;
+                    T newJSqr = normSqr(newJ);
+                    for (plint iPop=0; iPop<DESCRIPTOR<T>::q; ++iPop) {
+                        T fNeq = cell[iPop] - cell.computeEquilibrium(iPop, rhoBar, j, jSqr);
+                        cell[iPop] = cell.computeEquilibrium(iPop, newRhoBar, newJ, newJSqr) + scale*fNeq;
+                    }
+                }
+            }
+        }
     }
+    virtual RescalePopulations3D* clone() const
+    {
+        return new RescalePopulations3D(*this);
+    }
+    virtual void getTypeOfModification(std::vector<modif::ModifT>& modified) const
+    {
+        modified[0] = modif::staticVariables;
+        modified[1] = modif::nothing;
+    }
+    virtual BlockDomain::DomainT appliesTo() const
+    {
+        return BlockDomain::bulk;
+    }
+private:
+    T scale;
+};
+
+void rescalePressure(MultiBlockLattice3D<T,DESCRIPTOR>& lattice, MultiScalarField3D<int>& geometry,
+        plint direction, T oldDeltaP, T newDeltaP)
+{
+    setPressureDifference(lattice, newDeltaP, direction);
+    applyProcessingFunctional(new RescalePopulations3D(newDeltaP/oldDeltaP),
+                              lattice.getBoundingBox(), lattice, geometry);
 }
 
 void porousMediaSetup(MultiBlockLattice3D<T,DESCRIPTOR>& lattice,
         OnLatticeBoundaryCondition3D<T,DESCRIPTOR>* boundaryCondition,
-        MultiScalarField3D<int>& geometry, T deltaP)
+        MultiScalarField3D<int>& geometry, T deltaP, plint direction=0)
 {
-    const plint nx = lattice.getNx();
-    const plint ny = lattice.getNy();
-    const plint nz = lattice.getNz();
+    const plint n = flowLength(lattice, direction);
 
     pcout << "Definition of inlet/outlet." << std::endl;
-    Box3D inlet (0,0, 1,ny-2, 1,nz-2);
-    boundaryCondition->addPressureBoundary0N(inlet, lattice);
-    setBoundaryDensity(lattice, inlet, (T) 1.);
-
-    Box3D outlet(nx-1,nx-1, 1,ny-2, 1,nz-2);
-    boundaryCondition->addPressureBoundary0P(outlet, lattice);
-    setBoundaryDensity(lattice, outlet, (T) 1. - deltaP*DESCRIPTOR<T>::invCs2);
+    Box3D inlet  = flowPlane(lattice, direction, 0, true);
+    Box3D outlet = flowPlane(lattice, direction, n-1, true);
+    if (direction == 0) {
+        boundaryCondition->addPressureBoundary0N(inlet, lattice);
+        boundaryCondition->addPressureBoundary0P(outlet, lattice);
+    }
+    else if (direction == 1) {
+        boundaryCondition->addPressureBoundary1N(inlet, lattice);
+        boundaryCondition->addPressureBoundary1P(outlet, lattice);
+    }
+    else {
+        boundaryCondition->addPressureBoundary2N(inlet, lattice);
+        boundaryCondition->addPressureBoundary2P(outlet, lattice);
+    }
+    setPressureDifference(lattice, deltaP, direction);
 
     pcout << "Definition of the geometry." << std::endl;
     // Where "geometry" evaluates to 1, use bounce-back.
@@ -123,53 +438,459 @@ void porousMediaSetup(MultiBlockLattice3D<T,DESCRIPTOR>& lattice,
     defineDynamics(lattice, geometry, new NoDynamics<T,DESCRIPTOR>(), 2);
 
     pcout << "Initilization of rho and u." << std::endl;
-    initializeAtEquilibrium( lattice, lattice.getBoundingBox(), PressureGradient(deltaP, nx) );
+    initializeAtEquilibrium( lattice, lattice.getBoundingBox(), PressureGradient(deltaP, n, direction) );
 
     lattice.initialize();
     delete boundaryCondition;
 }
 
-void writeGifs(MultiBlockLattice3D<T,DESCRIPTOR>& lattice, plint iter)
+void writeGifs(MultiBlockLattice3D<T,DESCRIPTOR>& lattice, plint iter, plint direction=0)
 {
-    const plint nx = lattice.getNx();
-    const plint ny = lattice.getNy();
-    const plint nz = lattice.getNz();
+    const plint n = flowLength(lattice, direction);
+    const std::string name = std::string("u") + "xyz"[direction];
 
     const plint imSize = 600;
     ImageWriter<T> imageWriter("leeloo");
 
-    // Write velocity-norm at x=0.
-    imageWriter.writeScaledGif(createFileName("ux_inlet", iter, 6),
-            *computeVelocityNorm(lattice, Box3D(0,0, 0,ny-1, 0,nz-1)),
+    // Write velocity-norm at the inlet.
+    imageWriter.writeScaledGif(createFileName(name+"_inlet", iter, 6),
+            *computeVelocityNorm(lattice, flowPlane(lattice, direction, 0, false)),
             imSize, imSize );
 
-    // Write velocity-norm at x=nx/2.
-    imageWriter.writeScaledGif(createFileName("ux_half", iter, 6),
-            *computeVelocityNorm(lattice, Box3D(nx/2,nx/2, 0,ny-1, 0,nz-1)),
+    // Write velocity-norm half way.
+    imageWriter.writeScaledGif(createFileName(name+"_half", iter, 6),
+            *computeVelocityNorm(lattice, flowPlane(lattice, direction, n/2, false)),
             imSize, imSize );
 }
 
-void writeVTK(MultiBlockLattice3D<T,DESCRIPTOR>& lattice, T resolution, T C_velocity, plint iter)
+void writeVTK(MultiBlockLattice3D<T,DESCRIPTOR>& lattice, T resolution, T C_velocity, plint iter, bool writeNorm,
+        std::string name="vtk")
 {
-    VtkImageOutput3D<T> vtkOut(createFileName("vtk", iter, 6), resolution*1e6);  // *1e6  is spatial unit conversion form meter to micrometer
-    vtkOut.writeData<float>(*computeVelocityNorm(lattice), "velocityNorm", C_velocity*100.); // *100. is velocity conversion from m/s to cm/s
+    VtkImageOutput3D<T> vtkOut(createFileName(name, iter, 6), resolution*1e6);  // *1e6  is spatial unit conversion form meter to micrometer
+    if (writeNorm) {
+        vtkOut.writeData<float>(*computeVelocityNorm(lattice), "velocityNorm", C_velocity*100.); // *100. is velocity conversion from m/s to cm/s
+    }
     vtkOut.writeData<3,float>(*computeVelocity(lattice),   "velocity",     C_velocity*100.); // *100. is velocity conversion from m/s to cm/s
 }
 
-T computePermeability(MultiBlockLattice3D<T,DESCRIPTOR>& lattice, T nu, T deltaP, Box3D domain )
+// Writes the header of an uncompressed float MHA file with the same conventions as
+//   vti2mha.py (DimSize = nx ny nz, x fastest, spacing in micrometer) and returns its size.
+std::streamoff writeMHAHeader(std::string fName, plint nx, plint ny, plint nz, plint nComponents, T resolution)
+{
+    std::ostringstream header;
+    header << "ObjectType = Image\n";
+    header << "NDims=3\n";
+    header << "BinaryData = True\n";
+    header << "BinaryDataByteOrderMSB = False\n";
+    header << "CompressedData = False\n";
+    header << "TransformMatrix = -1 0 0 0 -1 0 0 0 1\n"; // negative values for compatibility with nibabel/ITK
+    header << "Offset = 0 0 0\n";
+    header << "CenterOfRotation = 0 0 0\n";
+    header << "AnatomicalOrientation = LPI\n";
+    header << "ElementSpacing = " << resolution*1e6 << " " << resolution*1e6 << " " << resolution*1e6 << "\n"; // in micrometer
+    header << "DimSize = " << nx << " " << ny << " " << nz << "\n";
+    header << "ElementNumberOfChannels = " << nComponents << "\n";
+    header << "ElementType = MET_FLOAT\n";
+    header << "ElementDataFile = LOCAL\n";
+    std::string headerString = header.str();
+    if (global::mpi().isMainProcessor()) {
+        std::ofstream mhaFile(fName.c_str(), std::ios::out | std::ios::binary | std::ios::trunc);
+        mhaFile.write(headerString.c_str(), (std::streamsize)headerString.size());
+        // reserve the full file, every process then writes its own blocks
+        mhaFile.seekp((std::streamoff)headerString.size() + (std::streamoff)nx*ny*nz*nComponents*sizeof(float) - 1);
+        mhaFile.put(0);
+    }
+    global::mpi().barrier();
+    return (std::streamoff)headerString.size();
+}
+
+// Writes one row along x of little-endian floats (the MHA files are declared
+//   BinaryDataByteOrderMSB = False, which is the byte order of all supported platforms).
+void writeMHARow(std::fstream& mhaFile, std::streamoff pos, std::vector<float>& row)
+{
+    mhaFile.seekp(pos);
+    mhaFile.write((const char*)&row[0], (std::streamsize)(row.size()*sizeof(float)));
+}
+
+// These data processors write the velocity (or a scalar) of their blocks into an MHA
+//   file prepared by writeMHAHeader, multiplied by a unit conversion factor.
+class WriteVelocityMHA3D : public BoxProcessingFunctional3D_T<T,3> {
+public:
+    WriteVelocityMHA3D(std::string fName_, std::streamoff headerSize_, plint nx_, plint ny_, T scale_)
+        : fName(fName_), headerSize(headerSize_), nx(nx_), ny(ny_), scale(scale_)
+    { }
+    virtual void process(Box3D domain, TensorField3D<T,3>& velocity)
+    {
+        Dot3D location = velocity.getLocation();
+        std::fstream mhaFile(fName.c_str(), std::ios::in | std::ios::out | std::ios::binary);
+        std::vector<float> row(domain.getNx()*3);
+        for (plint iZ=domain.z0; iZ<=domain.z1; ++iZ) {
+            for (plint iY=domain.y0; iY<=domain.y1; ++iY) {
+                for (plint iX=domain.x0; iX<=domain.x1; ++iX) {
+                    for (plint iD=0; iD<3; ++iD) {
+                        row[(iX-domain.x0)*3+iD] = (float)(velocity.get(iX,iY,iZ)[iD]*scale);
+                    }
+                }
+                std::streamoff pos = headerSize + (std::streamoff)sizeof(float)*3*
+                    (((std::streamoff)(iZ+location.z)*ny + (iY+location.y))*nx + (domain.x0+location.x));
+                writeMHARow(mhaFile, pos, row);
+            }
+        }
+    }
+    virtual WriteVelocityMHA3D* clone() const
+    {
+        return new WriteVelocityMHA3D(*this);
+    }
+    virtual void getTypeOfModification(std::vector<modif::ModifT>& modified) const
+    {
+        modified[0] = modif::nothing;
+    }
+    virtual BlockDomain::DomainT appliesTo() const
+    {
+        return BlockDomain::bulk;
+    }
+private:
+    std::string fName;
+    std::streamoff headerSize;
+    plint nx, ny;
+    T scale;
+};
+
+class WriteScalarMHA3D : public BoxProcessingFunctional3D_S<T> {
+public:
+    WriteScalarMHA3D(std::string fName_, std::streamoff headerSize_, plint nx_, plint ny_, T scale_)
+        : fName(fName_), headerSize(headerSize_), nx(nx_), ny(ny_), scale(scale_)
+    { }
+    virtual void process(Box3D domain, ScalarField3D<T>& scalar)
+    {
+        Dot3D location = scalar.getLocation();
+        std::fstream mhaFile(fName.c_str(), std::ios::in | std::ios::out | std::ios::binary);
+        std::vector<float> row(domain.getNx());
+        for (plint iZ=domain.z0; iZ<=domain.z1; ++iZ) {
+            for (plint iY=domain.y0; iY<=domain.y1; ++iY) {
+                for (plint iX=domain.x0; iX<=domain.x1; ++iX) {
+                    row[iX-domain.x0] = (float)(scalar.get(iX,iY,iZ)*scale);
+                }
+                std::streamoff pos = headerSize + (std::streamoff)sizeof(float)*
+                    (((std::streamoff)(iZ+location.z)*ny + (iY+location.y))*nx + (domain.x0+location.x));
+                writeMHARow(mhaFile, pos, row);
+            }
+        }
+    }
+    virtual WriteScalarMHA3D* clone() const
+    {
+        return new WriteScalarMHA3D(*this);
+    }
+    virtual void getTypeOfModification(std::vector<modif::ModifT>& modified) const
+    {
+        modified[0] = modif::nothing;
+    }
+    virtual BlockDomain::DomainT appliesTo() const
+    {
+        return BlockDomain::bulk;
+    }
+private:
+    std::string fName;
+    std::streamoff headerSize;
+    plint nx, ny;
+    T scale;
+};
+
+// Writes the velocity in cm/s directly as MHA, the same file vti2mha.py creates from
+//   the VTK output (vtk<iter>_velocity.mha), optionally also the velocity norm and
+//   the density in lattice units (used by Palabos_Multilevel.py).
+void writeMHA(MultiBlockLattice3D<T,DESCRIPTOR>& lattice, T resolution, T C_velocity, plint iter, bool writeNorm,
+        std::string name="vtk", bool writeDensity=false)
+{
+    const plint nx = lattice.getNx();
+    const plint ny = lattice.getNy();
+    const plint nz = lattice.getNz();
+    const T scale = C_velocity*100.; // *100. is velocity conversion from m/s to cm/s
+    std::string baseName = global::directories().getOutputDir() + createFileName(name, iter, 6);
+
+    std::auto_ptr<MultiTensorField3D<T,3> > velocity = computeVelocity(lattice);
+    std::string fName = baseName + "_velocity.mha";
+    std::streamoff headerSize = writeMHAHeader(fName, nx, ny, nz, 3, resolution);
+    applyProcessingFunctional(new WriteVelocityMHA3D(fName, headerSize, nx, ny, scale),
+                              velocity->getBoundingBox(), *velocity);
+    if (writeNorm) {
+        std::auto_ptr<MultiScalarField3D<T> > norm = computeVelocityNorm(lattice);
+        fName = baseName + "_velocityNorm.mha";
+        headerSize = writeMHAHeader(fName, nx, ny, nz, 1, resolution);
+        applyProcessingFunctional(new WriteScalarMHA3D(fName, headerSize, nx, ny, scale),
+                                  norm->getBoundingBox(), *norm);
+    }
+    if (writeDensity) {
+        std::auto_ptr<MultiScalarField3D<T> > density = computeDensity(lattice);
+        fName = baseName + "_density.mha";
+        headerSize = writeMHAHeader(fName, nx, ny, nz, 1, resolution);
+        applyProcessingFunctional(new WriteScalarMHA3D(fName, headerSize, nx, ny, (T)1),
+                                  density->getBoundingBox(), *density);
+    }
+    global::mpi().barrier();
+}
+
+// This data processor initializes the fluid cells at equilibrium with the density and
+//   velocity (lattice units) of an initial state file, 4 floats (rho, ux, uy, uz) per cell
+//   in the order of the geometry (e.g. upsampled from a coarse run by Palabos_Multilevel.py).
+class ReadInitialState3D : public BoxProcessingFunctional3D_LS<T,DESCRIPTOR,int> {
+public:
+    ReadInitialState3D(std::string fName_, std::streamoff headerSize_, plint ny_, plint nz_)
+        : fName(fName_), headerSize(headerSize_), ny(ny_), nz(nz_)
+    { }
+    virtual void process(Box3D domain, BlockLattice3D<T,DESCRIPTOR>& lattice, ScalarField3D<int>& geometry)
+    {
+        Dot3D location = lattice.getLocation();
+        Dot3D offset = computeRelativeDisplacement(lattice, geometry);
+        std::ifstream stateFile(fName.c_str(), std::ios::in | std::ios::binary);
+        std::vector<float> row(domain.getNz()*4);
+        for (plint iX=domain.x0; iX<=domain.x1; ++iX) {
+            for (plint iY=domain.y0; iY<=domain.y1; ++iY) {
+                std::streamoff pos = headerSize + (std::streamoff)sizeof(float)*4*
+                    (((std::streamoff)(iX+location.x)*ny + (iY+location.y))*nz + (domain.z0+location.z));
+                stateFile.seekg(pos);
+                stateFile.read((char*)&row[0], (std::streamsize)(row.size()*sizeof(float)));
+                for (plint iZ=domain.z0; iZ<=domain.z1; ++iZ) {
+                    if (geometry.get(iX+offset.x,iY+offset.y,iZ+offset.z) != 0) continue;
+                    plint i = (iZ-domain.z0)*4;
+                    Array<T,3> velocity((T)row[i+1], (T)row[i+2], (T)row[i+3]);
+                    iniCellAtEquilibrium(lattice.get(iX,iY,iZ), (T)row[i], velocity);
+                }
+            }
+        }
+    }
+    virtual ReadInitialState3D* clone() const
+    {
+        return new ReadInitialState3D(*this);
+    }
+    virtual void getTypeOfModification(std::vector<modif::ModifT>& modified) const
+    {
+        modified[0] = modif::staticVariables;
+        modified[1] = modif::nothing;
+    }
+    virtual BlockDomain::DomainT appliesTo() const
+    {
+        return BlockDomain::bulk;
+    }
+private:
+    std::string fName;
+    std::streamoff headerSize;
+    plint ny, nz;
+};
+
+void readInitialState(std::string fName, MultiBlockLattice3D<T,DESCRIPTOR>& lattice, MultiScalarField3D<int>& geometry)
+{
+    pcout << "Initialization of rho and u from " << fName << std::endl;
+    std::streamoff headerSize = readBinaryHeader(fName, "MET_FLOAT", 4, sizeof(float),
+                                                 lattice.getNx(), lattice.getNy(), lattice.getNz());
+    applyProcessingFunctional(new ReadInitialState3D(fName, headerSize, lattice.getNy(), lattice.getNz()),
+                              lattice.getBoundingBox(), lattice, geometry);
+}
+
+// Saves the populations and the values of the convergence tracer. Both are first
+//   written to temporary files and then renamed, so that a crash while writing
+//   never destroys the previous checkpoint.
+void saveCheckpoint(MultiBlockLattice3D<T,DESCRIPTOR>& lattice, plint iT, std::deque<T> const& history,
+        std::string name="checkpoint")
+{
+    std::string base = global::directories().getOutputDir() + name;
+    pcout << "Saving checkpoint at iteration " << iT << std::endl;
+    saveBinaryBlock(lattice, base+"_lattice.dat.tmp");
+    if (global::mpi().isMainProcessor()) {
+        std::ofstream tracerFile((base+"_tracer.dat.tmp").c_str());
+        tracerFile.precision(17);
+        tracerFile << iT << " " << history.size() << "\n";
+        for (pluint i=0; i<history.size(); ++i) {
+            tracerFile << history[i] << "\n";
+        }
+        tracerFile.close();
+        std::rename((base+"_lattice.dat.tmp").c_str(), (base+"_lattice.dat").c_str());
+        std::rename((base+"_tracer.dat.tmp").c_str(),  (base+"_tracer.dat").c_str());
+    }
+    global::mpi().barrier();
+}
+
+// Restores the populations, the iteration to continue with and the history of the
+//   convergence tracer, which is replayed so that it converges exactly as without restart.
+//   Returns false if there is no checkpoint.
+bool loadCheckpoint(MultiBlockLattice3D<T,DESCRIPTOR>& lattice, plint& iT,
+        util::ValueTracer<T>& converge, std::deque<T>& history, std::string name="checkpoint")
+{
+    std::string base = global::directories().getOutputDir() + name;
+    plb_ifstream tracerFile((base+"_tracer.dat").c_str());
+    if (!tracerFile.is_open()) {
+        pcout << "No checkpoint " << base << "_tracer.dat found, starting from iteration 0" << std::endl;
+        return false;
+    }
+    plint nValues;
+    tracerFile >> iT >> nValues;
+    history.clear();
+    for (plint i=0; i<nValues; ++i) {
+        T value;
+        tracerFile >> value;
+        history.push_back(value);
+        converge.takeValue(value);
+    }
+    loadBinaryBlock(lattice, base+"_lattice.dat");
+    pcout << "Restarting from checkpoint at iteration " << iT << std::endl;
+    return true;
+}
+
+// This data processor counts the fluid cells (tag 0), the cells which are updated
+//   in every iteration, for the MLUPS of the run summary.
+class CountFluidCells3D : public ReductiveBoxProcessingFunctional3D_S<int> {
+public:
+    CountFluidCells3D() : sumId(this->getStatistics().subscribeIntSum())
+    { }
+    virtual void process(Box3D domain, ScalarField3D<int>& geometry)
+    {
+        BlockStatistics& statistics = this->getStatistics();
+        for (plint iX=domain.x0; iX<=domain.x1; ++iX) {
+            for (plint iY=domain.y0; iY<=domain.y1; ++iY) {
+                for (plint iZ=domain.z0; iZ<=domain.z1; ++iZ) {
+                    if (geometry.get(iX,iY,iZ) == 0) statistics.gatherIntSum(sumId, 1);
+                }
+            }
+        }
+    }
+    virtual CountFluidCells3D* clone() const
+    {
+        return new CountFluidCells3D(*this);
+    }
+    virtual void getTypeOfModification(std::vector<modif::ModifT>& modified) const
+    {
+        modified[0] = modif::nothing;
+    }
+    plint getCount() const
+    {
+        return this->getStatistics().getIntSum(sumId);
+    }
+private:
+    plint sumId;
+};
+
+plint countFluidCells(MultiScalarField3D<int>& geometry)
+{
+    CountFluidCells3D functional;
+    applyProcessingFunctional(functional, geometry.getBoundingBox(), geometry);
+    return functional.getCount();
+}
+
+// Returns the peak resident memory in MB, summed over all processes
+//   (not available under windows, -1).
+double peakMemory()
+{
+#ifdef _WIN32
+    return -1.;
+#else
+    struct rusage usage;
+    getrusage(RUSAGE_SELF, &usage);
+    double memory = (double)usage.ru_maxrss/1024.; // ru_maxrss is in kB under linux
+#ifdef __APPLE__
+    memory /= 1024.; // but in bytes under MacOS
+#endif
+#ifdef PLB_MPI_PARALLEL
+    double totalMemory = 0.;
+    global::mpi().reduce(memory, totalMemory, MPI_SUM);
+    memory = totalMemory;
+#endif
+    return memory;
+#endif
+}
+
+// One simulation (flow direction and pressure difference) of the run summary.
+struct RunSummary {
+    char direction;
+    T deltaP;
+    plint iterations;
+    T permeability; // in [m^2]
+    double seconds; // collideAndStream only
+};
+
+// The wall-clock time of the phases of the run, in the order of the summary.
+const char* phases[] = {"readGeometry", "geometryVTK", "STL", "setup", "collideAndStream",
+                        "gifs", "checkpoint", "outputMHA", "outputVTK"};
+const plint numPhases = 9;
+
+// Writes the timers, the MLUPS (fluid cells only) and the peak memory as JSON
+//   (summary.json in the output directory) and prints the same.
+void writeSummary(plint nx, plint ny, plint nz, plint fluidCells, std::vector<RunSummary> const& runs)
+{
+    double totalTime = global::timer("total").getTime();
+    double memory = peakMemory();
+    std::ostringstream json;
+    json << "{\n";
+    json << "  \"precision\": \"" << (sizeof(T)==sizeof(float) ? "float" : "double") << "\",\n";
+    json << "  \"processes\": " << global::mpi().getSize() << ",\n";
+    json << "  \"nx\": " << nx << ", \"ny\": " << ny << ", \"nz\": " << nz << ",\n";
+    json << "  \"fluid_cells\": " << fluidCells << ",\n";
+    json << "  \"runs\": [";
+    plint totalIterations = 0;
+    double iterationTime = 0.;
+    for (pluint i=0; i<runs.size(); ++i) {
+        double mlups = runs[i].seconds > 0. ? (double)fluidCells*runs[i].iterations/runs[i].seconds/1.e6 : 0.;
+        json << (i>0 ? "," : "") << "\n    {\"direction\": \"" << runs[i].direction << "\", "
+             << "\"deltaP\": " << runs[i].deltaP << ", "
+             << "\"iterations\": " << runs[i].iterations << ", "
+             << "\"permeability_um2\": " << runs[i].permeability*1e6*1e6 << ", "
+             << "\"seconds\": " << runs[i].seconds << ", "
+             << "\"mlups\": " << mlups << "}";
+        totalIterations += runs[i].iterations;
+        iterationTime += runs[i].seconds;
+    }
+    json << "\n  ],\n";
+    json << "  \"phases_seconds\": {";
+    for (plint i=0; i<numPhases; ++i) {
+        json << (i>0 ? "," : "") << "\n    \"" << phases[i] << "\": " << global::timer(phases[i]).getTime();
+    }
+    json << "\n  },\n";
+    json << "  \"total_seconds\": " << totalTime << ",\n";
+    json << "  \"mlups\": " << (iterationTime > 0. ? (double)fluidCells*totalIterations/iterationTime/1.e6 : 0.) << ",\n";
+    json << "  \"peak_memory_mb\": " << memory << "\n";
+    json << "}\n";
+    pcout << "Run summary:" << std::endl << json.str();
+    if (global::mpi().isMainProcessor()) {
+        std::ofstream summaryFile((global::directories().getOutputDir()+"summary.json").c_str());
+        summaryFile << json.str();
+    }
+}
+
+// Returns the block structure of a sparse lattice: only the blocks containing fluid or
+//   bounce-back cells are allocated, blocks with no-dynamics cells only are left out.
+MultiBlockManagement3D computeFluidManagement(MultiScalarField3D<int>& geometry, plint blockSize)
+{
+    MultiScalarField3D<int> flags(geometry);
+    setToConstant(flags, geometry, 0, flags.getBoundingBox(), 1);
+    setToConstant(flags, geometry, 2, flags.getBoundingBox(), 0);
+    const plint envelopeWidth = 1;
+    return computeSparseManagement(*reparallelize(flags, blockSize, blockSize, blockSize), envelopeWidth);
+}
+
+plint allocatedCells(MultiBlockManagement3D const& management)
+{
+    plint nCells = 0;
+    std::map<plint,Box3D> const& bulks = management.getSparseBlockStructure().getBulks();
+    for (std::map<plint,Box3D>::const_iterator it = bulks.begin(); it != bulks.end(); ++it) {
+        nCells += it->second.nCells();
+    }
+    return nCells;
+}
+
+T computePermeability(MultiBlockLattice3D<T,DESCRIPTOR>& lattice, T nu, T deltaP, Box3D domain, plint direction=0 )
 {
     pcout << "Computing the permeability." << std::endl;
 
-    // Compute only the x-direction of the velocity (direction of the flow).
-    plint xComponent = 0;
-    plint nx = lattice.getNx();
+    // Compute only the component of the velocity in the direction of the flow.
+    plint n = flowLength(lattice, direction);
 
-    T meanU = computeAverage(*computeVelocityComponent(lattice, domain, xComponent));
+    // The sum divided by all cells of the domain, so that the blocks which are not
+    //   allocated in a sparse lattice count as zero velocity.
+    T meanU = computeSum(*computeVelocityComponent(lattice, domain, direction)) / (T)domain.nCells();
 
     pcout << "Average velocity     = " << meanU                         << std::endl;
     pcout << "Lattice viscosity nu = " << nu                            << std::endl;
-    pcout << "Grad P               = " << deltaP/(T)(nx-1)              << std::endl;
-    pcout << "Permeability         = " << nu*meanU / (deltaP/(T)(nx-1)) << std::endl;
+    pcout << "Grad P               = " << deltaP/(T)(n-1)               << std::endl;
+    pcout << "Permeability         = " << nu*meanU / (deltaP/(T)(n-1))  << std::endl;
 
     return meanU;
 }
@@ -177,20 +898,75 @@ T computePermeability(MultiBlockLattice3D<T,DESCRIPTOR>& lattice, T nu, T deltaP
 int main(int argc, char **argv)
 {
     plbInit(&argc, &argv);
+    global::timer("total").start();
 
-    if (argc!=8) {
+    if (argc<8) {
         pcout << "Error missing some input parameter\n";
         pcout << "The structure is :\n";
-        pcout << "1. Input file name.\n";
+        pcout << "1. Input file name (ASCII .dat, or binary uint8 .raw / uncompressed .mha).\n";
         pcout << "2. Output directory name.\n";
         pcout << "3. number of cells in X direction.\n";
         pcout << "4. number of cells in Y direction.\n";
         pcout << "5. number of cells in Z direction.\n";
         pcout << "6. spatial resolution in meter (e.g 0.0001 for 100um)\n";
         pcout << "7. Delta P .\n";
+        pcout << "Optional parameters:\n";
+        pcout << "   --norm  also write the velocity norm\n";
+        pcout << "   --novti  do not write the VTK (VTI) file, only the MHA\n";
+        pcout << "   --checkpoint=<n>  save a checkpoint every n iterations\n";
+        pcout << "   --resume  continue from the last checkpoint in the output directory\n";
+        pcout << "   --directions=<xyz>  flow directions to simulate, e.g. xyz for the permeability tensor (default x)\n";
+        pcout << "   --sparse[=<n>]  allocate only the blocks (n^3 cells, default 20) containing fluid\n";
+        pcout << "   --density  also write the density (lattice units), needed by Palabos_Multilevel.py\n";
+        pcout << "   --init=<file>  initial rho and u from a file created by Palabos_Multilevel.py\n";
+        pcout << "   --sweep=<dP2,dP3,...>  further pressure differences, each starting from the previous solution\n";
+        pcout << "   --notagvtk  do not write the geometry tags as porousMedium VTK\n";
+        pcout << "   --stl=<n>  compute the pore surface porousMedium.stl downsampled by n (default 1)\n";
+        pcout << "   --nostl  do not write porousMedium.stl\n";
+        pcout << "   --gif=<n>  write the velocity gifs every n iterations (default 500, 0 = none)\n";
         pcout << "Example: " << argv[0] << " twoSpheres.dat tmp\\ 48 64 64 0.0001 0.00005\n";
         exit (EXIT_FAILURE);
     }
+    bool writeNorm = false;
+    bool writeVTI  = true;
+    bool resume    = false;
+    plint checkpointInterval = 0;
+    std::string directions = "x";
+    plint blockSize = 0;
+    bool writeDensity = false;
+    std::string fNameInit;
+    std::string sweepList;
+    bool writeTagVTK = true;
+    plint stlFactor  = 1;
+    plint gifInterval = 500;
+    for (int iArg=8; iArg<argc; ++iArg) {
+        std::string option = argv[iArg];
+        if (option == "--norm") writeNorm = true;
+        else if (option == "--vti") writeVTI = true;
+        else if (option == "--novti") writeVTI = false;
+        else if (option == "--resume") resume = true;
+        else if (option.substr(0,13) == "--checkpoint=") checkpointInterval = atoi(option.substr(13).c_str());
+        else if (option.substr(0,13) == "--directions=") directions = option.substr(13);
+        else if (option == "--sparse") blockSize = 20;
+        else if (option == "--density") writeDensity = true;
+        else if (option.substr(0,7) == "--init=") fNameInit = option.substr(7);
+        else if (option.substr(0,8) == "--sweep=") sweepList = option.substr(8);
+        else if (option.substr(0,9) == "--sparse=") blockSize = atoi(option.substr(9).c_str());
+        else if (option == "--tagvtk") writeTagVTK = true;
+        else if (option == "--notagvtk") writeTagVTK = false;
+        else if (option == "--stl") stlFactor = 1;
+        else if (option == "--nostl") stlFactor = 0;
+        else if (option.substr(0,6) == "--stl=") stlFactor = atoi(option.substr(6).c_str());
+        else if (option.substr(0,6) == "--gif=") gifInterval = atoi(option.substr(6).c_str());
+        else {
+            pcout << "Error unknown parameter " << option << std::endl;
+            exit (EXIT_FAILURE);
+        }
+    }
+    if (directions.empty() || directions.find_first_not_of("xyz") != std::string::npos) {
+        pcout << "Error --directions must be a combination of x, y and z" << std::endl;
+        exit (EXIT_FAILURE);
+    }
     std::string fNameIn  = argv[1];
     std::string fNameOut = argv[2];
 
@@ -198,7 +974,13 @@ int main(int argc, char **argv)
     const plint ny = atoi(argv[4]);
     const plint nz = atoi(argv[5]);
     const T resolution = atof(argv[6]);
-    const T deltaP = atof(argv[7]);
+    // the pressure differences of a sweep, the first one is the command line parameter
+    std::vector<T> deltaPs(1, (T)atof(argv[7]));
+    std::istringstream sweep(sweepList);
+    std::string sweepValue;
+    while (std::getline(sweep, sweepValue, ',')) {
+        if (!sweepValue.empty()) deltaPs.push_back((T)atof(sweepValue.c_str()));
+    }
 
 
     global::directories().setOutputDir(fNameOut+"\\");
@@ -206,79 +988,208 @@ int main(int argc, char **argv)
     const T omega = 1;
     const T nu    = ((T)1/omega- (T)0.5)/DESCRIPTOR<T>::invCs2;
 
+    pcout << "Reading the geometry file." << std::endl;
+    std::auto_ptr<MultiScalarField3D<int> > geometry(new MultiScalarField3D<int>(nx,ny,nz));
+    readGeometry(fNameIn, *geometry);
+    if (writeTagVTK) writeGeometryVTK(*geometry, resolution);
+    if (stlFactor > 0) writeGeometrySTL(fNameIn, fNameOut, *geometry, stlFactor);
+    const plint fluidCells = countFluidCells(*geometry);
+
     pcout << "Creation of the lattice." << std::endl;
-    MultiBlockLattice3D<T,DESCRIPTOR> lattice(nx,ny,nz, new BGKdynamics<T,DESCRIPTOR>(omega));
+    std::auto_ptr<MultiBlockLattice3D<T,DESCRIPTOR> > latticePtr;
+    if (blockSize > 0) {
+        MultiBlockManagement3D management = computeFluidManagement(*geometry, blockSize);
+        latticePtr.reset(new MultiBlockLattice3D<T,DESCRIPTOR>(management,
+                defaultMultiBlockPolicy3D().getBlockCommunicator(),
+                defaultMultiBlockPolicy3D().getCombinedStatistics(),
+                defaultMultiBlockPolicy3D().getMultiCellAccess<T,DESCRIPTOR>(),
+                new BGKdynamics<T,DESCRIPTOR>(omega)));
+        // the geometry gets the same sparse block structure as the lattice
+        std::auto_ptr<MultiScalarField3D<int> > sparseGeometry(new MultiScalarField3D<int>(management,
+                defaultMultiBlockPolicy3D().getBlockCommunicator(),
+                defaultMultiBlockPolicy3D().getCombinedStatistics(),
+                defaultMultiBlockPolicy3D().getMultiScalarAccess<int>(), 2));
+        copy(*geometry, geometry->getBoundingBox(), *sparseGeometry, sparseGeometry->getBoundingBox());
+        geometry = sparseGeometry;
+        pcout << "Sparse lattice with " << allocatedCells(management) << " of " << nx*ny*nz
+              << " cells allocated (block size " << blockSize << ")" << std::endl;
+    }
+    else {
+        latticePtr.reset(new MultiBlockLattice3D<T,DESCRIPTOR>(nx,ny,nz, new BGKdynamics<T,DESCRIPTOR>(omega)));
+    }
+    MultiBlockLattice3D<T,DESCRIPTOR>& lattice = *latticePtr;
     // Switch off periodicity.
     lattice.periodicity().toggleAll(false);
 
-    pcout << "Reading the geometry file." << std::endl;
-    MultiScalarField3D<int> geometry(nx,ny,nz);
-    readGeometry(fNameIn, fNameOut, geometry, resolution);
-
+    pcout << "precision = " << (sizeof(T)==sizeof(float) ? "float" : "double") << std::endl;
     pcout << "nu = " << nu << std::endl;
-    pcout << "deltaP = " << deltaP << std::endl;
+    for (pluint iP=0; iP<deltaPs.size(); ++iP) {
+        pcout << "deltaP = " << deltaPs[iP] << std::endl;
+    }
     pcout << "omega = " << omega << std::endl;
     pcout << "nx = " << lattice.getNx() << std::endl;
     pcout << "ny = " << lattice.getNy() << std::endl;
     pcout << "nz = " << lattice.getNz() << std::endl;
 
-    porousMediaSetup(lattice, createLocalBoundaryCondition3D<T,DESCRIPTOR>(), geometry, deltaP);
-
     // The value-tracer is used to stop the simulation once is has converged.
     // 1st parameter:velocity
     // 2nd parameter:size
     // 3rd parameters:threshold
     // 1st and second parameters ae used for the length of the time average (size/velocity)
-    util::ValueTracer<T> converge(1.0,1000.0,1.0e-4);
+    const plint tracerSize = 1000;
+
+    const T dynamic_viscosity = 0.001; // in [Pa.s] = [kg/m/s]
+    const T density = 1000; // in [kg/m^3] (water)
+    const T kinematic_viscosity = dynamic_viscosity/density; // in water 1e-6 [m^2/s]
+    const T dt = nu/kinematic_viscosity * pow(resolution,2);
+    const T C_velocity = resolution/dt; // velocity conversion constant is defined as dx/dt
+    // permeability for every pressure difference and flow direction
+    std::vector<std::vector<T> > permeability_tensor(deltaPs.size(), std::vector<T>(3, (T)0));
+    std::vector<RunSummary> runs;
 
-    pcout << "Simulation begins" << std::endl;
-    plint iT=0;
+    // The geometry is read once, the lattice is reused for every flow direction.
+    for (pluint iDir=0; iDir<directions.size(); ++iDir) {
+        const plint direction = std::string("xyz").find(directions[iDir]);
+        const plint n = flowLength(lattice, direction);
 
-    const plint maxT = 30000;
-    for (;iT<maxT; ++iT) {
-        if (iT % 20 == 0) {
-            pcout << "Iteration " << iT << std::endl;
-        }
-        if (iT % 500 == 0 && iT>0) {
-            writeGifs(lattice,iT);
+        if (iDir > 0) {
+            pcout << std::endl << "Resetting the lattice." << std::endl;
+            defineDynamics(lattice, lattice.getBoundingBox(), new BGKdynamics<T,DESCRIPTOR>(omega));
         }
+        pcout << "Flow in " << directions[iDir] << "-direction." << std::endl;
+        global::timer("setup").start();
+        porousMediaSetup(lattice, createLocalBoundaryCondition3D<T,DESCRIPTOR>(), *geometry, deltaPs[0], direction);
+        global::timer("setup").stop();
+
+        // Every further pressure difference starts from the converged state of the previous one.
+        for (pluint iP=0; iP<deltaPs.size(); ++iP) {
+            const T deltaP = deltaPs[iP];
+            const T pressure_physical = deltaP * density * pow(resolution,2) / pow(dt,2);
+            // output names without suffix for the default flow in x-direction and a single pressure,
+            //   a sweep is named by the index of its pressure (0 = command line deltaP), which is
+            //   separated from the iteration number of the output files
+            std::string suffix = directions == "x" ? "" : std::string("_") + directions[iDir];
+            std::string outputName = "vtk";
+            if (deltaPs.size() > 1) {
+                std::ostringstream pressureName;
+                pressureName << "_p" << iP;
+                suffix += pressureName.str();
+                outputName += suffix + "_";
+            }
+            else outputName += suffix;
+            if (iP > 0) {
+                pcout << std::endl << "Pressure sweep " << iP << ": deltaP = " << deltaP << std::endl;
+                global::timer("setup").start();
+                rescalePressure(lattice, *geometry, direction, deltaPs[iP-1], deltaP);
+                global::timer("setup").stop();
+            }
+
+            util::ValueTracer<T> converge(1.0,(T)tracerSize,1.0e-4);
+            // the last values of the tracer, saved with the checkpoints
+            std::deque<T> history;
+
+            plint iT=0;
+            bool restarted = false;
+            if (resume) {
+                restarted = loadCheckpoint(lattice, iT, converge, history, "checkpoint"+suffix);
+            }
+            // the warm start applies to the first flow direction
+            if (!restarted && !fNameInit.empty() && iDir == 0 && iP == 0) {
+                global::timer("setup").start();
+                readInitialState(fNameInit, lattice, *geometry);
+                global::timer("setup").stop();
+            }
+
+            pcout << "Simulation begins" << std::endl;
+            const double startTime = global::timer("collideAndStream").getTime();
+            plint iterations = 0;
 
-        lattice.collideAndStream();
-        converge.takeValue(getStoredAverageEnergy(lattice),true);
+            const plint maxT = 30000;
+            for (;iT<maxT; ++iT) {
+                if (iT % 20 == 0) {
+                    pcout << "Iteration " << iT << std::endl;
+                }
+                if (gifInterval > 0 && iT % gifInterval == 0 && iT>0) {
+                    global::timer("gifs").start();
+                    writeGifs(lattice,iT,direction);
+                    global::timer("gifs").stop();
+                }
 
-        if (converge.hasConverged()) {
-            break;
+                global::timer("collideAndStream").start();
+                lattice.collideAndStream();
+                global::timer("collideAndStream").stop();
+                ++iterations;
+                T energy = getStoredAverageEnergy(lattice);
+                converge.takeValue(energy,true);
+                history.push_back(energy);
+                if ((plint)history.size() > tracerSize) {
+                    history.pop_front();
+                }
+
+                if (converge.hasConverged()) {
+                    break;
+                }
+                if (checkpointInterval>0 && (iT+1) % checkpointInterval == 0) {
+                    global::timer("checkpoint").start();
+                    saveCheckpoint(lattice, iT+1, history, "checkpoint"+suffix);
+                    global::timer("checkpoint").stop();
+                }
+            }
+
+            pcout << "End of simulation at iteration " << iT << std::endl;
+
+            pcout << "Permeability:" << std::endl << std::endl;
+            const T meanU = computePermeability(lattice, nu, deltaP, lattice.getBoundingBox(), direction);
+            pcout << std::endl;
+
+            const T permeability_lattice = nu*meanU / (deltaP/(T)(n-1));
+            const T permeability_physical = permeability_lattice * pow(resolution,2); // in [m^2]
+            permeability_tensor[iP][direction] = permeability_physical;
+            RunSummary run = {directions[iDir], deltaP, iterations, permeability_physical,
+                              global::timer("collideAndStream").getTime()-startTime};
+            runs.push_back(run);
+            pcout << "dt = " << dt << " s" << std::endl;
+            pcout << "dx = " << resolution << " m" << std::endl;
+            pcout << "dx/dt = " << C_velocity << " m/s" << std::endl;
+            pcout << "Pressure = " << pressure_physical << " Pa" << std::endl;
+            pcout << "Pysical Permeability = " << permeability_physical*1e6*1e6 << "μm²" << std::endl;
+            pcout << "Pysical mean velocity = " << meanU*C_velocity*100. << "cm/s" << std::endl;
+            //old code
+            const T mean_velocity_pysical = permeability_physical/dynamic_viscosity * pressure_physical /(T)(n-1)/resolution;
+            pcout << "Pysical mean velocity = " << mean_velocity_pysical*100. << "cm/s" << std::endl;
+
+
+
+            pcout << "Writing MHA file ..." << std::endl << std::endl;
+            global::timer("outputMHA").start();
+            writeMHA(lattice, resolution, C_velocity, iT, writeNorm, outputName, writeDensity);
+            global::timer("outputMHA").stop();
+            if (writeVTI) {
+                pcout << "Writing VTK file ..." << std::endl << std::endl;
+                global::timer("outputVTK").start();
+                writeVTK(lattice, resolution, C_velocity, iT, writeNorm, outputName);
+                global::timer("outputVTK").stop();
+            }
         }
     }
 
-    pcout << "End of simulation at iteration " << iT << std::endl;
-
-    pcout << "Permeability:" << std::endl << std::endl;
-    const T meanU = computePermeability(lattice, nu, deltaP, lattice.getBoundingBox());
-    pcout << std::endl;
-
-    const T dynamic_viscosity = 0.001; // in [Pa.s] = [kg/m/s]
-    const T density = 1000; // in [kg/m^3] (water)
-    const T kinematic_viscosity = dynamic_viscosity/density; // in water 1e-6 [m^2/s]
-    const T dt = nu/kinematic_viscosity * pow(resolution,2);
-    const T C_velocity = resolution/dt; // velocity conversion constant is defined as dx/dt
-    const T pressure_physical = deltaP * density * pow(resolution,2) / pow(dt,2);
-    const T permeability_lattice = nu*meanU / (deltaP/(T)(nx-1));
-    const T permeability_physical = permeability_lattice * pow(resolution,2); // in [m^2]
-    pcout << "dt = " << dt << " s" << std::endl;
-    pcout << "dx = " << resolution << " m" << std::endl;
-    pcout << "dx/dt = " << C_velocity << " m/s" << std::endl;
-    pcout << "Pressure = " << pressure_physical << " Pa" << std::endl;
-    pcout << "Pysical Permeability = " << permeability_physical*1e6*1e6 << "μm²" << std::endl;
-    pcout << "Pysical mean velocity = " << meanU*C_velocity*100. << "cm/s" << std::endl;
-    //old code
-    const T mean_velocity_pysical = permeability_physical/dynamic_viscosity * pressure_physical /(T)(nx-1)/resolution;
-    pcout << "Pysical mean velocity = " << mean_velocity_pysical*100. << "cm/s" << std::endl;
-
-
-
-    pcout << "Writing VTK file ..." << std::endl << std::endl;
-    writeVTK(lattice, resolution, C_velocity, iT);
+    for (pluint iP=0; iP<deltaPs.size(); ++iP) {
+        if (deltaPs.size() > 1) {
+            pcout << "Sweep " << iP << ": deltaP = " << deltaPs[iP] << ", Pressure = "
+                  << deltaPs[iP] * density * pow(resolution,2) / pow(dt,2) << " Pa" << std::endl;
+        }
+        if (directions != "x") {
+            pcout << "Permeability tensor (diagonal, not computed directions are 0) in μm²:" << std::endl;
+            pcout << "kxx = " << permeability_tensor[iP][0]*1e6*1e6 << std::endl;
+            pcout << "kyy = " << permeability_tensor[iP][1]*1e6*1e6 << std::endl;
+            pcout << "kzz = " << permeability_tensor[iP][2]*1e6*1e6 << std::endl << std::endl;
+        }
+        else if (deltaPs.size() > 1) {
+            pcout << "Pysical Permeability = " << permeability_tensor[iP][0]*1e6*1e6 << "μm²" << std::endl << std::endl;
+        }
+    }
+    global::timer("total").stop();
+    writeSummary(nx, ny, nz, fluidCells, runs);
     pcout << "Finished!" << std::endl << std::endl;
 
     return 0;
@@ -0,0 +1,9 @@
+#
+# the tools are not installed, they import each other as top-level modules
+# (see vectorfield), so the tools directory is put on the path for the tests
+#
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,73 @@
+#
+# round trips of the native readers and writers of FieldIO:
+# the data, spacing and offset written must be read back unchanged
+# in the memory layout of a MHA file (dim1,dim2,dim3,channels)
+#
+
+import numpy as np
+import pytest
+import FieldIO
+from GeometryMask import read_mha_header
+
+SPACING = (0.5, 0.25, 2.0)
+OFFSET  = (-1.0, 1.25, 3.0) # exactly representable, also in the float32 NIFTI header
+
+
+def field(channels=3):
+    return (np.arange(4*5*6*channels, dtype=np.float32).reshape(4, 5, 6, channels)-50.)/8.
+
+
+@pytest.mark.parametrize('name', ['field.mha', 'field.vti', 'field.nii', 'field.nii.gz'])
+@pytest.mark.parametrize('compressed', [False, True])
+@pytest.mark.parametrize('channels', [1, 3])
+def test_round_trip(tmpdir, name, compressed, channels):
+    if FieldIO.file_format(name) == 'nifti': pytest.importorskip('nibabel')
+    filename = str(tmpdir.join(name))
+    FieldIO.write_field(filename, field(channels), SPACING, OFFSET, compressed)
+    data, spacing, offset = FieldIO.read_field(filename)
+    assert data.shape == (4, 5, 6, channels)
+    assert np.array_equal(data, field(channels))
+    assert spacing == SPACING
+    assert offset == OFFSET
+
+
+def test_fld_round_trip(tmpdir):
+    # FLD files are in micrometer/s and centered, the offset is not stored
+    filename = str(tmpdir.join('field.fld'))
+    FieldIO.write_field(filename, field(), SPACING, OFFSET)
+    data, spacing, offset = FieldIO.read_field(filename)
+    assert data.shape == (4, 5, 6, 3)
+    assert np.allclose(data, field(), rtol=1e-6, atol=1e-9)
+    assert np.allclose(spacing, SPACING)
+
+
+def test_mha_dimsize_order(tmpdir):
+    # DimSize lists the fastest axis first, that is the reverse of the array shape
+    filename = str(tmpdir.join('field.mha'))
+    FieldIO.write_mha(filename, field(), SPACING, OFFSET, compressed=False)
+    header = read_mha_header(filename)
+    assert header['DimSize'] == '6 5 4'
+    assert [float(s) for s in header['ElementSpacing'].split()] == list(SPACING[::-1])
+    with open(filename, 'rb') as f:
+        f.seek(header['HeaderSize'])
+        assert f.read() == field().tobytes()
+
+
+def test_mha_x_fastest(tmpdir):
+    # a MHA as written by permeability.cpp and vti2mha: DimSize = nx ny nz, x fastest
+    nx, ny, nz = 6, 5, 4
+    velocity = np.zeros((nz, ny, nx, 3), dtype='<f4')
+    velocity[:,:,:,0] = np.arange(nx)[np.newaxis,np.newaxis,:] # x component = x index
+    filename = str(tmpdir.join('vtk000100_velocity.mha'))
+    header  = 'ObjectType = Image\nNDims = 3\nBinaryData = True\nBinaryDataByteOrderMSB = False\n'
+    header += 'CompressedData = False\n'
+    header += 'DimSize = '+str(nx)+' '+str(ny)+' '+str(nz)+'\nElementSpacing = 1 1 1\n'
+    header += 'ElementNumberOfChannels = 3\nElementType = MET_FLOAT\nElementDataFile = LOCAL\n'
+    with open(filename, 'wb') as f: f.write(header.encode('ascii')+velocity.tobytes())
+    data = FieldIO.read_field(filename)[0]
+    assert data.shape == (nz, ny, nx, 3)
+    assert np.array_equal(data[1,2,:,0], np.arange(nx))
+
+
+def test_unknown_format(tmpdir):
+    with pytest.raises(ValueError): FieldIO.write_field(str(tmpdir.join('field.raw')), field(), SPACING, OFFSET)
@@ -0,0 +1,111 @@
+#
+# PackedMask, the D3Q19 tagging of PalabosGeometry against a brute-force
+# dilation and the streamed MHA/NIFTI round trips of the masks and labels,
+# SLAB_BYTES is reduced so that every volume is handled in several slabs
+#
+
+import numpy as np
+import pytest
+import GeometryMask
+from GeometryMask import PackedMask, PalabosGeometry, read_labels, read_mask, read_mha_header, write_mask, write_raw
+
+
+@pytest.fixture(autouse=True)
+def small_slabs(monkeypatch):
+    monkeypatch.setattr(GeometryMask, 'SLAB_BYTES', 64)
+
+
+def pores(shape=(9, 7, 11), porosity=0.3):
+    return np.random.RandomState(0).random_sample(shape) < porosity
+
+
+def brute_force_tags(fluid):
+    # tag of every cell from its D3Q19 neighbours, cells outside the domain are not fluid
+    tags = np.full(fluid.shape, PalabosGeometry.NO_DYNAMICS, dtype=np.uint8)
+    for x, y, z in np.ndindex(*fluid.shape):
+        if fluid[x,y,z]: tags[x,y,z] = PalabosGeometry.FLUID; continue
+        for i, j, k in PalabosGeometry.LINKS:
+            n = (x+i, y+j, z+k)
+            if all(0 <= n[a] < fluid.shape[a] for a in range(3)) and fluid[n]:
+                tags[x,y,z] = PalabosGeometry.BOUNCE_BACK; break
+    return tags
+
+
+def test_links():
+    assert len(PalabosGeometry.LINKS) == 18
+
+
+def test_packed_mask():
+    data = pores()
+    mask = PackedMask.from_array(data)
+    assert mask.nbytes == 9*7*2
+    assert mask.count_nonzero() == np.count_nonzero(data)
+    assert np.array_equal(mask.to_array(bool), data)
+    assert np.array_equal(mask.chunk(3, 10), data[:,:,3:10])
+    assert np.array_equal(mask.planes(1, 2, 5), data[:,2:5])
+
+
+@pytest.mark.parametrize('flow_axis', [0, 1, 2])
+def test_d3q19_tags(flow_axis):
+    data = pores()
+    geometry = PalabosGeometry(PackedMask.from_array(data), flow_axis)
+    expected = brute_force_tags(np.transpose(data, PalabosGeometry.AXES[flow_axis]))
+    assert geometry.shape == expected.shape
+    tags = np.concatenate([geometry.slab(start, start+2) for start in range(0, geometry.shape[0], 2)])
+    assert np.array_equal(tags, expected)
+    assert np.array_equal(geometry.count_tags()[0:3], np.bincount(expected.ravel(), minlength=3))
+
+
+def test_bounce_back_only():
+    data = pores()
+    tags = PalabosGeometry(PackedMask.from_array(data), 0, no_dynamics=False).slab(0, data.shape[0])
+    assert np.array_equal(tags, np.where(data, PalabosGeometry.FLUID, PalabosGeometry.BOUNCE_BACK))
+
+
+@pytest.mark.parametrize('compressed', [False, True])
+def test_geometry_round_trip(tmpdir, compressed):
+    # the geometry as written by Palabos_Geometry, in the order of permeability.cpp
+    filename = str(tmpdir.join('geometry.mha'))
+    write_mask(filename, PalabosGeometry(PackedMask.from_array(pores()), 2), (10., 20., 30.), compressed)
+    labels, spacing = read_labels(filename)
+    assert np.array_equal(labels, brute_force_tags(np.transpose(pores(), PalabosGeometry.AXES[2])))
+    assert spacing == (10., 20., 30.)
+
+
+def test_geometry_raw(tmpdir):
+    filename = str(tmpdir.join('geometry.raw'))
+    write_raw(filename, PalabosGeometry(PackedMask.from_array(pores()), 0))
+    assert np.array_equal(np.fromfile(filename, dtype=np.uint8).reshape(9, 7, 11), brute_force_tags(pores()))
+
+
+@pytest.mark.parametrize('name', ['labels.mha', 'labels.nii', 'labels.nii.gz'])
+@pytest.mark.parametrize('compressed', [False, True])
+def test_labels_round_trip(tmpdir, name, compressed):
+    if GeometryMask._is_nifti(name): pytest.importorskip('nibabel')
+    filename = str(tmpdir.join(name))
+    labels = np.random.RandomState(1).randint(0, 3, size=(9, 7, 11)).astype(np.uint8)
+    write_mask(filename, labels, (10., 20., 30.), compressed)
+    data, spacing = read_labels(filename)
+    assert np.array_equal(data, labels)
+    assert spacing == (10., 20., 30.)
+
+
+@pytest.mark.parametrize('name', ['mask.mha', 'mask.nii.gz'])
+def test_mask_round_trip(tmpdir, name):
+    if GeometryMask._is_nifti(name): pytest.importorskip('nibabel')
+    filename = str(tmpdir.join(name))
+    write_mask(filename, PackedMask.from_array(pores()), 5.)
+    mask, spacing = read_mask(filename)
+    assert np.array_equal(mask.to_array(bool), pores())
+    assert spacing == (5., 5., 5.)
+
+
+def test_mha_header(tmpdir):
+    # DimSize fastest axis first, CompressedDataSize patched after the streamed data
+    filename = str(tmpdir.join('geometry.mha'))
+    write_mask(filename, PackedMask.from_array(pores()), 1.)
+    header = read_mha_header(filename)
+    assert header['DimSize'] == '11 7 9'
+    with open(filename, 'rb') as f:
+        f.seek(header['HeaderSize'])
+        assert len(f.read()) == int(header['CompressedDataSize'])
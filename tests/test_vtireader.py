@@ -0,0 +1,92 @@
+#
+# VTIReader against VTI files written the way VTK and Palabos write them:
+# ascii, inline base64 and appended raw/base64 data, zlib compressed or not,
+# UInt32 or UInt64 header_type, the base64 header encoded separately
+#
+
+import base64
+import zlib
+import numpy as np
+import pytest
+from VTIReader import VTIFile
+
+BLOCK = 256 # small zlib blocks, so the arrays are split into several
+
+
+def field(nz=5, ny=4, nx=3):
+    # (z,y,x,components) as VTIReader returns it, 5*4*3*3*4 bytes is not a multiple of 3
+    return np.arange(nz*ny*nx*3, dtype=np.float32).reshape(nz, ny, nx, 3)/7.
+
+
+def encode(data, compressed, header_type):
+    # the header (sizes) and the data as written by vtkXMLWriter
+    raw = np.ascontiguousarray(data, dtype='<f4').tobytes()
+    if compressed:
+        blocks = [zlib.compress(raw[i:i+BLOCK]) for i in range(0, len(raw), BLOCK)]
+        header = [len(blocks), BLOCK, len(raw)-(len(blocks)-1)*BLOCK]+[len(b) for b in blocks]
+        raw = b''.join(blocks)
+    else: header = [len(raw)]
+    return np.array(header, dtype='<'+header_type).tobytes(), raw
+
+
+def write_vti(filename, data, fmt, compressed=False, header_type='u4', encoding='base64', separate=True):
+    nz, ny, nx = data.shape[:3]
+    header, raw = encode(data, compressed, header_type)
+    if fmt == 'binary' or encoding == 'base64':
+        if separate: payload = base64.b64encode(header)+base64.b64encode(raw)
+        else: payload = base64.b64encode(header+raw)
+    else: payload = header+raw
+    extent = '0 '+str(nx-1)+' 0 '+str(ny-1)+' 0 '+str(nz-1)
+    text  = '<?xml version="1.0"?>\n'
+    text += '<VTKFile type="ImageData" version="1.0" byte_order="LittleEndian"'
+    text += ' header_type="'+('UInt64' if header_type == 'u8' else 'UInt32')+'"'
+    text += ' compressor="vtkZLibDataCompressor">\n' if compressed else '>\n'
+    text += '  <ImageData WholeExtent="'+extent+'" Origin="1 2 3" Spacing="0.5 0.5 0.5">\n'
+    text += '    <Piece Extent="'+extent+'">\n      <PointData Vectors="velocity">\n'
+    text += '        <DataArray type="Float32" Name="velocity" NumberOfComponents="3" format="'+fmt+'"'
+    if fmt == 'ascii': text += '>\n'+' '.join(repr(float(v)) for v in data.ravel())+'\n        </DataArray>\n'
+    elif fmt == 'binary': text += '>\n          '+payload.decode('ascii')+'\n        </DataArray>\n'
+    else: text += ' offset="0"/>\n'
+    text += '      </PointData>\n    </Piece>\n  </ImageData>\n'
+    with open(filename, 'wb') as f:
+        f.write(text.encode('ascii'))
+        if fmt == 'appended':
+            f.write(('  <AppendedData encoding="'+encoding+'">\n   _').encode('ascii'))
+            f.write(payload)
+            f.write(b'\n  </AppendedData>\n')
+        f.write(b'</VTKFile>\n')
+
+
+def test_ascii(tmpdir):
+    filename = str(tmpdir.join('ascii.vti'))
+    write_vti(filename, field(), 'ascii')
+    vti = VTIFile(filename)
+    assert vti.arrays == ['velocity']
+    assert vti.shape == (5, 4, 3)
+    assert vti.origin == (1., 2., 3.)
+    assert np.array_equal(vti.read('velocity'), field())
+
+
+@pytest.mark.parametrize('compressed', [False, True])
+@pytest.mark.parametrize('header_type', ['u4', 'u8'])
+@pytest.mark.parametrize('fmt, encoding', [('binary', 'base64'), ('appended', 'base64'), ('appended', 'raw')])
+def test_encodings(tmpdir, fmt, encoding, header_type, compressed):
+    filename = str(tmpdir.join('encoded.vti'))
+    write_vti(filename, field(), fmt, compressed, header_type, encoding)
+    assert np.array_equal(VTIFile(filename).read('velocity'), field())
+
+
+@pytest.mark.parametrize('fmt', ['binary', 'appended'])
+def test_base64_one_stream(tmpdir, fmt):
+    # the header and the data of uncompressed arrays encoded as one base64 stream
+    filename = str(tmpdir.join('stream.vti'))
+    write_vti(filename, field(), fmt, separate=False)
+    assert np.array_equal(VTIFile(filename).read('velocity'), field())
+
+
+def test_other_compressor(tmpdir):
+    filename = str(tmpdir.join('lz4.vti'))
+    write_vti(filename, field(), 'ascii')
+    with open(filename, 'rb') as f: text = f.read()
+    with open(filename, 'wb') as f: f.write(text.replace(b'byte_order', b'compressor="vtkLZ4DataCompressor" byte_order'))
+    with pytest.raises(NotImplementedError): VTIFile(filename)
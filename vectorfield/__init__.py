@@ -0,0 +1,297 @@
+#
+# importable vector field library, the command line tools are thin wrappers
+# around it and pipelines can pass fields in memory instead of writing
+# intermediate files
+#
+# VectorField holds the data and the geometry of one field:
+#    data      : numpy array (dim1,dim2,dim3,ncomponents), the memory layout
+#                of a MHA file (reverse of DimSize, slowest axis first)
+#    spacing   : voxel size of the 3 array axes (micrometer in this project,
+#                m for ComSol exports)
+#    offset    : origin of the 3 array axes, the same convention as FieldIO.py
+#    direction : TransformMatrix in MHA order (-1 0 0 0 -1 0 0 0 1 everywhere
+#                in this project), kept from MHA files and written to MHA
+#                files, the other formats always assume the default
+#    units     : velocity unit of the data, one of UNITS, or None for data
+#                that is no velocity (the % and degree differences of compare),
+#                which can not be converted with to_units
+# a VectorField also provides the interface of the reference fields in
+# ReferenceFields.py (shape, slab, voxels, mean_magnitude), so it can be
+# compared directly with another field or with the analytic phantom
+#
+# read/write handle all formats of FieldIO.py (MHA, FLD, NIFTI, VTI) plus the
+# ComSol "*.txt" regular grid export (read only), see read_comsol
+# the units of the files are: FLD micrometer/s (converted on read and write),
+# ComSol as given in the header (converted to m/s), all others do not store
+# the unit, they are written and read in the units argument of read/write,
+# by default cm/s as produced by permeability.cpp and fld2mha
+#
+# the package is not installed, it lives next to the tools and imports
+# their modules (FieldIO, GeometryMask, VTIReader, Profiling) as top-level
+# modules, so the tools directory must be on sys.path: run python from
+# there (python -m vectorfield ...) or set PYTHONPATH=<tools directory>
+#
+# ----- LICENSE -----
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#    For more detail see the GNU General Public License.
+#    <http://www.gnu.org/licenses/>.
+#
+#    THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#    IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#    FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#    AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#    LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#    OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+#    THE SOFTWARE.
+#
+# ----- REQUIREMENTS -----
+#
+#    This program was developed under Python Version 2.7
+#    with the following additional libraries:
+#    - numpy
+#    - nibabel (only for NIFTI files)
+#
+
+from __future__ import print_function
+import math
+import numpy as np
+from FieldIO import file_format, read_field, write_field
+from GeometryMask import read_mha_header
+from Profiling import span
+
+DIRECTION = (-1., 0., 0., 0., -1., 0., 0., 0., 1.) # negative values for compatibility with nibabel/ITK
+UNITS = {'m/s':1., 'dm/s':10., 'cm/s':100., 'mm/s':1000., 'um/s':1.0e6} # per m/s
+FILE_UNITS = 'cm/s' # unit of MHA, NIFTI and VTI files if not told otherwise
+SLAB_BYTES = 16*1024*1024 # approx. size of the vectors handled at once by compare
+
+
+class VectorField(object):
+    __slots__ = ('data', 'spacing', 'offset', 'direction', 'units')
+
+    def __init__(self, data, spacing=(1.,1.,1.), offset=None, direction=DIRECTION, units=FILE_UNITS):
+        if data.ndim == 3: data = data[:,:,:,np.newaxis]
+        if data.ndim != 4: raise ValueError('only 3D fields implemented')
+        if units is not None and not units in UNITS: raise ValueError('unknown unit "'+str(units)+'"')
+        self.data      = data
+        self.spacing   = tuple(float(s) for s in spacing)
+        self.offset    = centered_offset(data.shape, self.spacing) if offset is None else tuple(float(o) for o in offset)
+        self.direction = tuple(float(d) for d in direction)
+        self.units     = units
+
+    def __repr__(self):
+        return ('VectorField(shape='+str(self.shape)+', spacing='+str(self.spacing)+
+                ', offset='+str(self.offset)+', units='+str(self.units)+')')
+
+    @property
+    def shape(self):
+        return self.data.shape
+
+    @property
+    def ncomponents(self):
+        return self.data.shape[3]
+
+    @property
+    def nbytes(self):
+        return self.data.nbytes
+
+    def copy(self, data=None):
+        # the same geometry with new data (or a copy of the data)
+        if data is None: data = self.data.copy()
+        return VectorField(data, self.spacing, self.offset, self.direction, self.units)
+
+    def to_units(self, units):
+        if not units in UNITS: raise ValueError('unknown unit "'+str(units)+'"')
+        if self.units is None: raise ValueError('the data is no velocity and has no unit to convert')
+        if units == self.units: return self
+        with span('scale', self.nbytes): field = self.copy(self.data*np.float32(UNITS[units]/UNITS[self.units]))
+        field.units = units
+        return field
+
+    def magnitude(self):
+        return np.sqrt(np.sum(np.square(self.data), axis=3))
+
+    def crop(self, start, stop):
+        # start/stop indices of the 3 array axes (None = whole axis), the offset
+        # is moved to the first voxel kept (through the direction)
+        dims = self.shape[0:3]
+        start = [0 if b is None else b for b in start]
+        stop  = [n if e is None else e for e, n in zip(stop, dims)]
+        for b, e, n in zip(start, stop, dims):
+            if not 0 <= b < e <= n: raise ValueError('crop '+str(b)+':'+str(e)+' outside of 0:'+str(n))
+        shift = [start[a]*self.spacing[a] for a in (2,1,0)] # in MHA order
+        matrix = np.array(self.direction).reshape(3,3)
+        offset = np.array(self.offset[::-1])+matrix.dot(shift)
+        data = self.data[start[0]:stop[0], start[1]:stop[1], start[2]:stop[2]]
+        with span('crop', data.nbytes): data = np.ascontiguousarray(data)
+        return VectorField(data, self.spacing, tuple(offset[::-1]), self.direction, self.units)
+
+    def reorder(self, axes):
+        # permutes the array axes (new axis i is the old axis axes[i]) with
+        # spacing and offset, the vector components follow the axes (the
+        # components are in MHA order, the reverse of the array axes)
+        axes = [int(a) for a in axes]
+        if sorted(axes) != [0,1,2]: raise ValueError('reorder needs a permutation of 0,1,2')
+        data = self.data.transpose(axes+[3])
+        with span('reorder', self.nbytes):
+            if self.ncomponents == 3: data = data[:,:,:,[2-axes[2-c] for c in range(3)]]
+            data = np.ascontiguousarray(data)
+        return VectorField(data, [self.spacing[a] for a in axes],
+                           [self.offset[a] for a in axes], self.direction, self.units)
+
+    # interface of the reference fields (see ReferenceFields.py)
+    def slab(self, start, stop):
+        return self.data[start:stop]
+
+    def voxels(self, i, j, k):
+        return self.data[i,j,k]
+
+    def mean_magnitude(self, slab_size=None):
+        if slab_size is None: slab_size = _slab_size(self.shape)
+        total = 0.
+        for start in range(0, self.shape[0], slab_size):
+            total += np.sum(np.sqrt(np.sum(np.square(self.slab(start, start+slab_size)), axis=3)), dtype=np.float64)
+        return total/(self.shape[0]*self.shape[1]*self.shape[2])
+
+
+def centered_offset(shape, spacing):
+    # origin used by fld2mha, txt2mha and Digital_Phantom (the volume centered
+    # around 0, the sign of the first axis as consequence of the TransformMatrix)
+    return (-(shape[0]//2)*spacing[0], (shape[1]//2)*spacing[1], (shape[2]//2)*spacing[2])
+
+
+def _slab_size(shape):
+    return max(1, int(SLAB_BYTES/(shape[1]*shape[2]*shape[3]*4)))
+
+
+def _round_auto(value):
+    # the grid of ComSol exports is given with limited precision
+    value = float(value)
+    if value == 0: return value
+    digits = int(math.ceil(-math.log10(abs(value))))
+    return round(value, digits+6)
+
+
+def read_comsol(filename):
+    # ComSol "*.txt" regular grid export, 6 columns: X, Y, Z, V(x), V(y), V(z)
+    # returns the field in m/s (spacing in m) and the parsed header,
+    # the header has also "Center", the center of the grid coordinates in m
+    header = {}
+    rows = []
+    with span('read') as s:
+        with open(filename, "rb") as f:
+            for line in f:
+                line = line.decode('latin-1').rstrip('\r\n')
+                if not line.startswith('%'): rows.append(line); break
+                items = [item.strip() for item in line[1:].split(':')]
+                if len(items) > 1:
+                    header[items[0]] = " ".join(items[1:-1]) if len(items) > 2 else items[1]
+                else: # no ":" in string
+                    items = line[1:].split()
+                    if len(items) == 9: # extract the velocity units
+                        header["Velocity unit X"] = items[4].strip('(').strip(')')
+                        header["Velocity unit Y"] = items[6].strip('(').strip(')')
+                        header["Velocity unit Z"] = items[8].strip('(').strip(')')
+            # the data lines without the header (its units are not ascii)
+            rows.extend(line.decode('latin-1') for line in f)
+        s.nbytes = sum(len(row) for row in rows)
+    lengths = {'m':1, 'dm':10, 'cm':100, 'mm':1000, b'\xc2\xb5m'.decode('latin-1'):1000000} # utf-8 micrometer
+    if header.get("Dimension") != "3": raise ValueError('Parameter "Dimension"<>3 not implemented')
+    if header.get("Expressions") != "3": raise ValueError('Parameter "Expressions"<>3 not implemented')
+    try: nodes = int(header["Nodes"])
+    except KeyError: raise ValueError('Parameter "Nodes" not found in header')
+    except ValueError: raise ValueError('Problem parsing "Nodes" parameter')
+    try: l_unit = lengths[header["Length unit"]]
+    except KeyError: raise ValueError('Parameter "Length unit" not found or unknown')
+    try: v_units = [header["Velocity unit "+c] for c in "XYZ"]
+    except KeyError: raise ValueError('Parameter "Velocity unit" not found in header')
+    if v_units[0] != v_units[1] or v_units[0] != v_units[2]:
+        raise ValueError('Different Velocity unit for X,Y,Z components not implemented')
+    if not v_units[0].endswith('/s') or not v_units[0][:-2] in lengths: raise ValueError('Unknown "Velocity unit" parameter')
+    v_unit = lengths[v_units[0][:-2]]
+    header["Length unit"] = l_unit; header["Velocity unit"] = v_unit
+    with span('parse', s.nbytes): data = np.genfromtxt(rows, dtype=np.float32, comments='%')
+    if data.ndim != 2 or data.shape[1] != 6: raise ValueError('Text files is expected to contain 6 columns')
+    if data.shape[0] != nodes: print ('Warning: number of data rows different from value specified in header')
+    dims = [np.unique(data[:,i]).shape[0] for i in range(3)]
+    if data.shape[0] != dims[0]*dims[1]*dims[2]:
+        raise ValueError('Problem figuring out ordering of lines in input textfile,\n'+
+                         '       maybe this is not a regularly spaced grid but a mesh ???')
+    spacing = [_round_auto((np.max(data[:,i])-np.min(data[:,i]))/l_unit/(dims[i]-1)) for i in range(3)]
+    header["Center"] = tuple((np.max(data[:,i])+np.min(data[:,i]))/2/l_unit for i in range(3))
+    # x fastest in the file, vector components reversed as in fld2mha
+    with span('scale', data.nbytes//2):
+        vectors = np.nan_to_num(data[:,3:6].reshape(dims[2],dims[1],dims[0],3))/np.float32(v_unit)
+    with span('reorder', vectors.nbytes): vectors = np.ascontiguousarray(vectors.transpose(2,1,0,3)[:,:,:,::-1])
+    return VectorField(vectors, spacing, units='m/s'), header
+
+
+def read(filename, units=FILE_UNITS):
+    # units: the unit of files without unit conversion (MHA, NIFTI, VTI)
+    fmt = file_format(filename)
+    if fmt is None and filename.lower().endswith('.txt'): return read_comsol(filename)[0]
+    if fmt is None: raise ValueError('unknown file format "'+filename+'"')
+    data, spacing, offset = read_field(filename)
+    direction = DIRECTION
+    if fmt == 'mha':
+        matrix = read_mha_header(filename).get('TransformMatrix')
+        if matrix: direction = [float(d) for d in matrix.split()]
+    return VectorField(data, spacing, offset, direction, 'cm/s' if fmt == 'fld' else units)
+
+
+def write(field, filename, compressed=True, level=6, units=FILE_UNITS):
+    # FLD files are written in micrometer/s, all others converted to units,
+    # fields without unit (the differences of compare) as they are
+    if file_format(filename) == 'fld': field = field.to_units('cm/s') # FieldIO converts cm/s to micrometer/s
+    elif field.units is not None: field = field.to_units(units)
+    direction = None if tuple(field.direction) == DIRECTION else field.direction
+    write_field(filename, field.data, field.spacing, field.offset, compressed, level, direction)
+
+
+def compare(field, reference, slab_size=None):
+    # voxelwise comparison of field with reference (VectorField or a reference
+    # field of ReferenceFields.py), done slab by slab (first axis), so that
+    # the reference is never needed as a whole:
+    # 1) difference of normalized magnitude values in % (magnitudes normalized
+    #    with the mean velocity over the whole volume, (A-B)/((A+B)/2)*100)
+    # 2) difference of directionality in degrees (0..180, arccos of the dot
+    #    product of the unit vectors)
+    # returns both as single component VectorFields with the geometry of field
+    # and without unit (units None), and their averages over the voxels where any of the two is non zero
+    dim = field.shape
+    if tuple(reference.shape) != tuple(dim): raise ValueError('fields have different dimensions')
+    if slab_size is None: slab_size = _slab_size(dim)
+    with span('compare', field.nbytes):
+        data1_avg = field.mean_magnitude(slab_size); data2_avg = reference.mean_magnitude()
+        data_mag_diff = np.zeros(shape=(dim[0],dim[1],dim[2]), dtype=np.float32)
+        angle         = np.zeros(shape=(dim[0],dim[1],dim[2]), dtype=np.float32)
+        sum_mag_diff = 0.; sum_angle = 0.; n_nonzero = 0
+        for start in range(0, dim[0], slab_size):
+            stop = min(start+slab_size, dim[0])
+            slab1 = field.slab(start, stop); slab2 = reference.slab(start, stop)
+            slab1_mag = np.sqrt(np.sum(np.square(slab1),axis=3))
+            slab2_mag = np.sqrt(np.sum(np.square(slab2),axis=3))
+            nonzero = (slab1_mag+slab2_mag) != 0
+            slab_mag_diff = data_mag_diff[start:stop] # view into the result
+            slab_mag_diff[nonzero] = (slab1_mag[nonzero]/data1_avg - slab2_mag[nonzero]/data2_avg) \
+                                    /((slab1_mag[nonzero]/data1_avg + slab2_mag[nonzero]/data2_avg)/2.)*100  # result in %
+            slab_mag_diff[:,:,dim[2]-1]=0 # there's trash in here, dunno why
+            #difference of directionality: dot product of the unity vectors
+            both = (slab1_mag*slab2_mag) != 0
+            cos_angle = np.sum(slab1[both]*slab2[both],axis=1)/(slab1_mag[both]*slab2_mag[both])
+            slab_angle = angle[start:stop] # view into the result
+            slab_angle[both] = np.arccos(np.clip(cos_angle, -1, 1))*180./np.pi # result in angle 0..180
+            slab_angle[:,:,dim[2]-1]=0 # there's trash in here, dunno why
+            sum_mag_diff += np.sum(np.abs(slab_mag_diff[nonzero]), dtype=np.float64)
+            sum_angle    += np.sum(slab_angle[nonzero], dtype=np.float64)
+            n_nonzero    += np.count_nonzero(nonzero)
+    if n_nonzero > 0:
+        average_magnitude_deviation = sum_mag_diff/n_nonzero
+        average_angular_deviation   = sum_angle/n_nonzero
+    else: average_magnitude_deviation = average_angular_deviation = float('nan')
+    magnitude_diff = VectorField(data_mag_diff, field.spacing, field.offset, field.direction, units=None)
+    angle_diff     = VectorField(angle, field.spacing, field.offset, field.direction, units=None)
+    return magnitude_diff, angle_diff, average_magnitude_deviation, average_angular_deviation
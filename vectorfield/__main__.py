@@ -0,0 +1,211 @@
+#
+# chained vector field pipeline in one process:
+#    python -m vectorfield --read=<file> [stages] --write=<file> ...
+#
+# the stages are executed in the order given on the commandline on one
+# field held in memory, files are only written where --write (or --diffs)
+# is given, so e.g. the chain txt2mha -> MHAcompare -> mha2fld becomes
+#    python -m vectorfield --read=sim.txt --units=cm/s --compare=ref.mha
+#                          --diffs=sim-ref --write=sim.fld
+# without the intermediate MHA files (parsed, decompressed and compressed
+# once per tool before)
+#
+# run from the tools directory or with PYTHONPATH=<tools directory>, the
+# package imports FieldIO, GeometryMask and Profiling as top-level modules
+#
+# stages:
+#    --read=<file>[:<unit>] : MHA, FLD, NIFTI, VTI or ComSol "*.txt" (replaces the field),
+#                             <unit> is the unit of MHA, NIFTI and VTI files (default cm/s),
+#                             FLD and ComSol files carry their own unit
+#    --units=<unit>         : converts the velocity unit (m/s, dm/s, cm/s, mm/s, um/s)
+#    --reorder=<a>,<b>,<c>  : permutes the array axes (2,1,0 = FLD <-> MHA memory order)
+#    --crop=<b:e>,<b:e>,<b:e> : keeps the indices b..e-1 of the array axes (":" = all)
+#    --compare=<file>[:<unit>] : compares with a reference file (see MHAcompare),
+#    --compare=phantom:<L>,<D>,<R>,<P>  or with the analytic Digital_Phantom solution
+#    --diffs=<name>         : writes the differences of the last compare as
+#                             <name>_MAGNT_DIFF.mha and <name>_ANGLE_DIFF.mha
+#    --write=<file>[:<unit>] : writes the field, the format is given by the extension,
+#                             MHA, NIFTI and VTI in <unit> (default cm/s)
+# a file written by --write or --diffs can be read again by a later stage
+#
+# ----- LICENSE -----
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#    For more detail see the GNU General Public License.
+#    <http://www.gnu.org/licenses/>.
+#
+#    THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#    IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#    FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#    AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#    LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#    OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+#    THE SOFTWARE.
+#
+# ----- REQUIREMENTS -----
+#
+#    This program was developed under Python Version 2.7
+#    with the following additional libraries:
+#    - numpy
+#    - nibabel (only for NIFTI files)
+#
+
+from __future__ import print_function
+import sys
+import os
+import time
+from getopt import getopt
+import vectorfield
+import Profiling
+from ReferenceFields import HagenPoiseuilleField
+
+STAGES = ['read', 'units', 'reorder', 'crop', 'compare', 'diffs', 'write']
+
+
+def usage():
+    print ('')
+    print ('Usage: python -m '+Program_name+' --read=<file> [stages] --write=<file> ...')
+    print ('')
+    print ('   Stages (executed in the given order on the field in memory):')
+    print ('       --read=<file>[:<unit>]  : MHA, FLD, NIFTI, VTI or ComSol txt file')
+    print ('                                 unit of MHA, NIFTI and VTI (default cm/s)')
+    print ('       --units=<unit>          : convert to m/s, dm/s, cm/s, mm/s or um/s')
+    print ('       --reorder=<a>,<b>,<c>   : permute the array axes (e.g. 2,1,0)')
+    print ('       --crop=<b:e>,<b:e>,<b:e>: keep the indices b..e-1 of the array axes')
+    print ('       --compare=<file>[:<unit>] : compare with a reference file (see MHAcompare)')
+    print ('       --compare=phantom:<L>,<D>,<R>,<P> : with the analytic Digital_Phantom')
+    print ('                                 L=length[mm], D=diameter[mm], R=resolution[um], P=pressure[Pa]')
+    print ('       --diffs=<name>          : write the differences of the last compare')
+    print ('                                 as <name>_MAGNT_DIFF.mha and <name>_ANGLE_DIFF.mha')
+    print ('       --write=<file>[:<unit>] : write the field (format by extension)')
+    print ('                                 MHA, NIFTI and VTI in <unit> (default cm/s)')
+    print ('   Available options are:')
+    print ('       --compression=<off|on|1-9> : zlib level of the written files (default on = 6)')
+    print ('       --profile=<f>           : phase timings as JSON trace (<f>.prof: cProfile dump)')
+    print ('       --version               : version information')
+    print ('       -h --help               : this page')
+    print ('')
+
+def parse_crop(value):
+    start = []; stop = []
+    for item in value.split(','):
+        if not ':' in item: raise ValueError
+        b, e = item.split(':', 1)
+        start.append(int(b) if b.strip() != '' else None)
+        stop.append(int(e) if e.strip() != '' else None)
+    if len(start) != 3: raise ValueError
+    return start, stop
+
+def split_unit(value):
+    # <file>[:<unit>] -> file, unit (default FILE_UNITS)
+    if ':' in value and value.rsplit(':', 1)[1] in vectorfield.UNITS: return tuple(value.rsplit(':', 1))
+    return value, vectorfield.FILE_UNITS
+
+def reference_field(value):
+    if value.startswith('phantom:'):
+        length, diameter, resolution, pressure = [float(x) for x in value[len('phantom:'):].split(',')]
+        return HagenPoiseuilleField(length*1.0e-3, diameter*1.0e-3, resolution*1.0e-6, pressure) # convert to m
+    filename, units = split_unit(value)
+    return vectorfield.read(filename, units)
+
+def diff_names(value):
+    return value+'_MAGNT_DIFF.mha', value+'_ANGLE_DIFF.mha'
+
+def describe(field):
+    return 'x'.join(str(n) for n in field.shape[0:3])+'x'+str(field.ncomponents)+' '+field.units
+
+#general initialization stuff
+Program_name = 'vectorfield'
+Program_version = "v0.1" # program version
+
+# parse commandline parameters (the order of the stages is kept)
+try: opts, args =  getopt( sys.argv[1:],'h',['help','version','compression=','profile=']+[stage+'=' for stage in STAGES])
+except:
+    error=str(sys.argv[1:]).replace("[","").replace("]","")
+    if "-" in str(error) and not "--" in str(error):
+          print ('ERROR: Commandline '+str(error)+',   maybe you mean "--"')
+    else: print ('ERROR: Commandline '+str(error))
+    usage(); exit(2)
+if len(args)>0:
+    print ('ERROR: Commandline option "'+args[0]+'" not recognized')
+    usage(); exit(2)
+argDict = dict(opts)
+if '-h' in argDict: usage(); exit(0)
+if '--help' in argDict: usage(); exit(0)
+if '--version' in argDict: print (Program_name+' '+Program_version); exit(0)
+Profiling.start(argDict.get('--profile')) # see Profiling.py
+compression = argDict.get('--compression', 'on').lower()
+compressed = compression != 'off'
+if compression in ['on','off']: level = 6
+else:
+    try: level = int(compression)
+    except ValueError: level = 0
+    if level < 1 or level > 9: print ('ERROR: Commandline --compression must be off, on or 1 ... 9'); exit(2)
+stages = [(opt[2:], value) for opt, value in opts if opt[2:] in STAGES]
+if len(stages) == 0: usage(); exit(2)
+if stages[0][0] != 'read': print ('ERROR: The first stage must be --read'); exit(2)
+
+# check the arguments of all stages before anything is read,
+# files written by earlier stages do not need to exist yet
+planned = set()
+for stage, value in stages:
+    if stage in ['read', 'compare'] and not value.startswith('phantom:'):
+        filename = split_unit(value)[0]
+        if not os.path.isfile(filename) and not os.path.abspath(filename) in planned:
+            print ('ERROR: File not found: '+filename); exit(2)
+    if stage == 'units' and not value in vectorfield.UNITS:
+        print ('ERROR: Commandline --units must be one of '+', '.join(sorted(vectorfield.UNITS))); exit(2)
+    if stage == 'reorder':
+        try: axes = [int(a) for a in value.split(',')]
+        except ValueError: axes = []
+        if sorted(axes) != [0,1,2]: print ('ERROR: Commandline --reorder must be a permutation of 0,1,2'); exit(2)
+    if stage == 'crop':
+        try: parse_crop(value)
+        except ValueError: print ('ERROR: Commandline --crop must be <b:e>,<b:e>,<b:e>'); exit(2)
+    if stage in ['write', 'diffs']:
+        outputs = [split_unit(value)[0]] if stage == 'write' else list(diff_names(value))
+        if os.path.dirname(outputs[0]) != '' and not os.path.isdir(os.path.dirname(outputs[0])):
+            print ('ERROR: Output directory not found: '+os.path.dirname(outputs[0])); exit(2)
+        planned.update(os.path.abspath(output) for output in outputs)
+
+# run the pipeline
+field = None
+diffs = None
+start_all = time.time()
+for stage, value in stages:
+    start = time.time()
+    try:
+        if stage == 'read':
+            field = vectorfield.read(*split_unit(value))
+            message = value+' ('+describe(field)+')'
+        elif stage == 'units':
+            field = field.to_units(value)
+            message = value
+        elif stage == 'reorder':
+            field = field.reorder(value.split(','))
+            message = value+' ('+describe(field)+')'
+        elif stage == 'crop':
+            field = field.crop(*parse_crop(value))
+            message = value+' ('+describe(field)+')'
+        elif stage == 'compare':
+            reference = reference_field(value)
+            if reference.shape != field.shape: raise ValueError('reference dimensions different from the field')
+            diffs = vectorfield.compare(field, reference)
+            message = value+'\n    Average Magnitude Deviation: '+str(diffs[2])+' %'
+            message += '\n    Average  Angular  Deviation: '+str(diffs[3])+' degrees'
+        elif stage == 'diffs':
+            if diffs is None: raise ValueError('--diffs without --compare before')
+            for diff, filename in zip(diffs[0:2], diff_names(value)):
+                vectorfield.write(diff, filename, compressed, level)
+            message = ' '.join(diff_names(value))
+        elif stage == 'write':
+            filename, units = split_unit(value)
+            vectorfield.write(field, filename, compressed, level, units)
+            message = value
+    except Exception as e:
+        print ('ERROR: '+stage+' '+value+': '+str(e)); sys.exit(2)
+    print ('%-8s %7.3fs  %s' % (stage, time.time()-start, message))
+print ('Done in %.3fs' % (time.time()-start_all))
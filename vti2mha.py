@@ -1,5 +1,22 @@
 #
-# uses VTK to convert VTI format to MHA
+# converts VTI format to MHA
+#
+# the VTI file is read with the native reader of VTIReader.py (numpy only),
+# VTK is only imported as a fallback for files the native reader does not
+# support (e.g. LZ4/LZMA compression) or when --vtk is given
+#
+# the selected arrays (default all) are converted concurrently by a pool of
+# threads, each one reordering, compressing and writing its own MHA file
+#
+# series mode: with a directory or a glob pattern as --input (e.g. the
+# vtk<iteration>.vti frames of a transient run) the frames are streamed
+# through a pipeline: a reader thread parses the headers, the converter
+# threads decode and convert the arrays and the main thread writes either
+# one MHA per frame and array or, with --4d, one 4D MHA per array with
+# time as the slowest axis (frames sorted by iteration number), frames
+# with different names before the iteration number (e.g. the sweep points
+# vtk_p0_<iteration>, vtk_p1_<iteration> of permeability.cpp) are separate
+# series, each written to its own 4D MHA
 #
 # ----- VERSION HISTORY -----
 #
@@ -28,7 +45,7 @@
 #    This program was developed under Python Version 2.7
 #    with the following additional libraries: 
 #    - numpy
-#    - vtk 
+#    - vtk (optional, only as fallback)
 #
 
 
@@ -37,46 +54,32 @@ import sys
 import os
 from getopt import getopt
 import zlib
+import re
+import glob
+import threading
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
+try: from Queue import Queue # Python 2
+except ImportError: from queue import Queue # Python3
 import numpy as np
-from vtk import vtkXMLImageDataReader
-from vtk.util import numpy_support
-
-
-TK_installed=True
-try: 
-    from tkFileDialog import askopenfilename # Python 2
-    from tkFileDialog import asksaveasfile   # Python 2
-    from tkMessageBox import showwarning     # Python 2
-    from tkMessageBox import showerror       # Python 2
-    from tkMessageBox import showinfo        # Python 2
-except: 
-    try: from tkinter.filedialog import askopenfilename; # Python3
-    except: TK_installed=False
-    try: from tkinter.filedialog import asksaveasfile;   # Python3
-    except: TK_installed=False
-    try: from tkinter.messagebox import showwarning;     # Python3
-    except: TK_installed=False    
-    try: from tkinter.messagebox import showerror;       # Python3
-    except: TK_installed=False       
-    try: from tkinter.messagebox import showinfo;        # Python3
-    except: TK_installed=False   
-try: import Tkinter as tk; # Python2
-except: 
-    try: import tkinter as tk; # Python3
-    except: TK_installed=False 
-if not TK_installed:
-    print ('ERROR: tkinter not installed')
-    print ('       on Linux try "yum install tkinter"')
-    print ('       on MacOS install ActiveTcl from:')
-    print ('       http://www.activestate.com/activetcl/downloads')
-    sys.stdout.write('\a\a\a'); sys.stdout.flush() # beep 3x
-    sys.exit(2)
+from xml.etree.ElementTree import ParseError
+from VTIReader import VTIFile
+
+
+import Profiling
+from Dialogs import askopenfilename, asksaveasfile, showwarning, showerror, showinfo, update # Tk only loaded when a dialog is needed
 
 def usage():
     print ('')
     print ('Usage: '+Program_name+' [options] --input=<inputfile>')
+    print ('       '+Program_name+' [options] --input=<directory or "pattern*.vti"> [--4d]')
     print ('')
     print ('   Available options are:')
+    print ('       --arrays=<names>  : comma separated point data arrays to convert (default all)')
+    print ('       --threads=<n> : number of arrays converted in parallel (default number of CPUs)')
+    print ('       --vtk         : read with VTK instead of the native reader')
+    print ('       --4d          : series mode, one 4D MHA per array instead of one MHA per frame')
+    print ('       --profile=<f> : phase timings as JSON trace (<f>.prof: cProfile dump)')
     print ('       --version     : version information')
     print ('       -h --help     : this page')    
     print ('')       
@@ -91,22 +94,8 @@ python_version=str(sys.version_info[0])+'.'+str(sys.version_info[1])+'.'+str(sys
 # sys.platform = [linux2, win32, cygwin, darwin, os2, os2emx, riscos, atheos, freebsd7, freebsd8]
 if sys.platform=="win32": os.system("title "+Program_name)
     
-#TK initialization       
-TKwindows = tk.Tk(); TKwindows.withdraw() #hiding tkinter window
-TKwindows.update()
-# the following tries to disable showing hidden files/folders under linux
-try: TKwindows.tk.call('tk_getOpenFile', '-foobarz')
-except: pass
-try: TKwindows.tk.call('namespace', 'import', '::tk::dialog::file::')
-except: pass
-try: TKwindows.tk.call('set', '::tk::dialog::file::showHiddenBtn', '1')
-except: pass
-try: TKwindows.tk.call('set', '::tk::dialog::file::showHiddenVar', '0')
-except: pass
-TKwindows.update()
-
 # parse commandline parameters (if present)
-try: opts, args =  getopt( sys.argv[1:],'h',['help','version','input='])
+try: opts, args =  getopt( sys.argv[1:],'h',['help','version','profile=','input=','vtk','arrays=','threads=','4d'])
 except:
     error=str(sys.argv[1:]).replace("[","").replace("]","")
     if "-" in str(error) and not "--" in str(error): 
@@ -120,8 +109,12 @@ argDict = dict(opts)
 if '-h' in argDict: usage(); exit(0)   
 if '--help' in argDict: usage(); exit(0)  
 if '--version' in argDict: print (Program_name+' '+Program_version); exit(0)
+Profiling.start(argDict.get('--profile')) # see Profiling.py
 if '--input' in argDict: INfile=argDict['--input'];
 else: INfile=""
+try: threads = int(argDict.get('--threads', cpu_count()))
+except ValueError: threads = 0
+if threads < 1: print ('ERROR: Commandline --threads must be a positive integer'); exit(2)
 
 
 
@@ -132,85 +125,247 @@ if INfile == "":
     INfile = os.path.abspath(INfile)
     INfile=str(INfile)     
     
-#read file
-reader = vtkXMLImageDataReader()
-#reader = vtk.vtkMetaImageReader()
-#reader = vtk.vtkImageReader()
-reader.SetFileName(INfile)
-reader.Update()
-vtk_data=reader.GetOutput()
+class VTKImage(object):
+    # the same interface as VTIFile, reading the whole file with VTK
+    def __init__(self, filename):
+        from vtk import vtkXMLImageDataReader
+        from vtk.util import numpy_support
+        self.numpy_support = numpy_support
+        reader = vtkXMLImageDataReader()
+        reader.SetFileName(filename)
+        reader.Update()
+        self.vtk_data = reader.GetOutput()
+        if self.vtk_data.GetDataDimension() != 3: raise ValueError('only 3D files implemented')
+        dims = self.vtk_data.GetDimensions()
+        self.shape   = (dims[2], dims[1], dims[0])
+        self.spacing = self.vtk_data.GetSpacing()
+        self.origin  = self.vtk_data.GetOrigin()
+        pointdata = self.vtk_data.GetPointData()
+        self.arrays  = [pointdata.GetArrayName(i) for i in range(pointdata.GetNumberOfArrays())]
+        self.cell_arrays = [self.vtk_data.GetCellData().GetArrayName(i)
+                            for i in range(self.vtk_data.GetCellData().GetNumberOfArrays())]
+
+    def read(self, name):
+        array = self.vtk_data.GetPointData().GetAbstractArray(name)
+        data = self.numpy_support.vtk_to_numpy(array)
+        return data.reshape(self.shape+(array.GetNumberOfComponents(),))
+
+def open_vti(filename):
+    # parses the header, the arrays are decoded later, one by one
+    if not '--vtk' in argDict:
+        try: return VTIFile(filename)
+        except (NotImplementedError, ValueError, ParseError) as e:
+            print ('Native VTI reader failed ('+str(e)+'), trying VTK')
+    return VTKImage(filename)
+
+def iteration(filename):
+    # the iteration number at the end of the name (createFileName("vtk", iter, 6))
+    number = re.findall('[0-9]+', os.path.splitext(os.path.basename(filename))[0])
+    if len(number) == 0: return -1
+    return int(number[-1])
+
+#find frames
+if os.path.isdir(INfile): frames = glob.glob(os.path.join(INfile, '*.vti'))
+elif any(c in INfile for c in '*?['): frames = glob.glob(INfile)
+else: frames = [INfile]
+def series(filename):
+    # the name before the iteration number, the same for all frames of one series
+    prefix = re.sub('[0-9]+$', '', os.path.splitext(os.path.basename(filename))[0]).rstrip('_')
+    return prefix if prefix != '' else 'series'
+
+frames = sorted((os.path.abspath(frame) for frame in frames), key=lambda frame: (series(frame), iteration(frame), frame))
+if len(frames) == 0: showerror("Open file", "No VTI files found ... operation aborted"); sys.exit(2)
+fourD = '--4d' in argDict
+series_frames = {}
+for frame in frames: series_frames.setdefault(series(frame), []).append(frame)
+position = dict((frame, i) for frames_in_series in series_frames.values() for i, frame in enumerate(frames_in_series))
+if len(frames) > 1 or fourD:
+    print ('Series of '+str(len(frames))+' frames'+(' in '+str(len(series_frames))+' series' if len(series_frames) > 1 else ''))
+
+#read first file (header only, the geometry of all other frames must be the same)
+try: vti = open_vti(frames[0])
+except IOError: showerror("Open file", "Unable to read input file ... operation aborted"); sys.exit(2)
+except ImportError: showerror("ERROR", "VTK is not installed ... operation aborted"); sys.exit(2)
+except ValueError: showerror("ERROR", "Only 3D files implemented ... operation aborted"); sys.exit(2)
 
 #get header parameters
-dirname  = os.path.dirname(INfile)
-basename = os.path.splitext(os.path.basename(INfile))[0]
-ndim = vtk_data.GetDataDimension() # this must be 3
-if  ndim != 3: showerror("ERROR", "Only 3D files implemented ... operation aborted"); sys.exit(2)
-Resolution1 = vtk_data.GetSpacing()[2]
-Resolution2 = vtk_data.GetSpacing()[1]
-Resolution3 = vtk_data.GetSpacing()[0]
-dim1 = vtk_data.GetDimensions()[2]
-dim2 = vtk_data.GetDimensions()[1]
-dim3 = vtk_data.GetDimensions()[0]
-offset1 = vtk_data.GetOrigin()[2]
-offset2 = vtk_data.GetOrigin()[1]
-offset3 = vtk_data.GetOrigin()[0]
-n_cell_arrays = vtk_data.GetCellData().GetNumberOfArrays() # this must be 0
-if  n_cell_arrays != 0: showerror("ERROR", "Unkown file structure ... operation aborted"); sys.exit(2)
-narrays = vtk_data.GetPointData().GetNumberOfArrays()
-
-#write mha file (s) one for each component
-for i in range(0,narrays):
-    arrayname = vtk_data.GetPointData().GetArrayName(i)
-    ncomponents = vtk_data.GetPointData().GetAbstractArray(i).GetNumberOfComponents()
-    #data = numpy_support.vtk_to_numpy(vtk_data.GetPointData().GetArray(i))
-    data = numpy_support.vtk_to_numpy(vtk_data.GetPointData().GetAbstractArray(i))
-    data = data.reshape((dim1,dim2,dim3,ncomponents),order="F")
-    data = data [:,:,:,::-1]
-   
-    #write MHA (no special libraries required)
-    TransformMatrix = "-1 0 0 0 -1 0 0 0 1" # negative values for compatibility with nibabel/ITK
-    offset1 *= -1 # offset negative as consequence of the above TransformMatrix
-    data = np.transpose(data, axes = (2,1,0,3))
-    data [:,:,:,:] = data [:,:,:,::-1]
-    data = np.ndarray.flatten(data)
-    data = data.newbyteorder('S').astype('>f')
-    data = bytearray (data)
-    data = np.asarray(data).astype(np.uint8)
-    data = data.tostring()
-    compressed = False
-    data = zlib.compress(data);compressed = True # comment this line 4 uncompressed MHA file
-    data_size=len (data)
-    OK=True
+dirname  = os.path.dirname(frames[0])
+ndim = 3
+Resolution1 = vti.spacing[2]
+Resolution2 = vti.spacing[1]
+Resolution3 = vti.spacing[0]
+dim1 = vti.shape[0]
+dim2 = vti.shape[1]
+dim3 = vti.shape[2]
+offset1 = vti.origin[2]
+offset2 = vti.origin[1]
+offset3 = vti.origin[0]
+if len(vti.cell_arrays) != 0: showerror("ERROR", "Unkown file structure ... operation aborted"); sys.exit(2)
+TransformMatrix = "-1 0 0 0 -1 0 0 0 1" # negative values for compatibility with nibabel/ITK
+offset1 *= -1 # offset negative as consequence of the above TransformMatrix
+
+#select arrays
+arraynames = vti.arrays
+if '--arrays' in argDict:
+    arraynames = [name for name in argDict['--arrays'].split(',') if name != '']
+    for name in arraynames:
+        if not name in vti.arrays:
+            showerror("ERROR", 'Array "'+name+'" not found, available are: '+', '.join(vti.arrays)+' ... operation aborted')
+            sys.exit(2)
+if len(arraynames) == 0: showerror("ERROR", "No arrays to convert ... operation aborted"); sys.exit(2)
+compressed = True # False for uncompressed MHA files
+
+def time_step(frames):
+    # time axis of the 4D MHA: the iteration step if the frames are equidistant
+    steps = set(iteration(frames[i+1])-iteration(frames[i]) for i in range(len(frames)-1))
+    time_spacing = steps.pop() if len(steps) == 1 and iteration(frames[0]) >= 0 else 1
+    return time_spacing if time_spacing > 0 else 1
+
+def mha_header(ncomponents, data_size, nframes=0, time_spacing=1):
+    # nframes>0 gives a 4D header (time slowest), the CompressedDataSize
+    # is then written with fixed width, to be overwritten at the end
+    header  = 'ObjectType = Image\n'
+    header += 'NDims='+str(4 if nframes else ndim)+'\n'
+    header += 'BinaryData = True\n'
+    header += 'BinaryDataByteOrderMSB = False\n'
+    if compressed:
+        header += 'CompressedData = True\n'
+        header += 'CompressedDataSize = '+('%020d' % data_size if nframes else str(data_size))+'\n'
+    else:
+        header += 'CompressedData = False\n'
+    if nframes:
+        header += 'TransformMatrix = -1 0 0 0 0 -1 0 0 0 0 1 0 0 0 0 1\n'
+        header += 'Offset = '+str(offset3)+' '+str(offset2)+' '+str(offset1)+' 0\n'
+        header += 'CenterOfRotation = 0 0 0 0\n'
+        header += 'ElementSpacing ='+str(Resolution3)+' '+str(Resolution2)+' '+str(Resolution1)+' '+str(time_spacing)+'\n'
+        header += 'DimSize = '+str(int(dim3))+' '+str(int(dim2))+' '+str(int(dim1))+' '+str(int(nframes))+'\n'
+    else:
+        header += 'TransformMatrix = '+TransformMatrix+'\n'
+        header += 'Offset = '+str(offset3)+' '+str(offset2)+' '+str(offset1)+'\n'
+        header += 'CenterOfRotation = 0 0 0\n'
+        header += 'AnatomicalOrientation = LPI\n'
+        header += 'ElementSpacing ='+str(Resolution3)+' '+str(Resolution2)+' '+str(Resolution1)+'\n'
+        header += 'DimSize = '+str(int(dim3))+' '+str(int(dim2))+' '+str(int(dim1))+'\n'
+    header += 'ElementNumberOfChannels = '+str(int(ncomponents))+'\n'
+    header += 'ElementType = MET_FLOAT\n'
+    header += 'ElementDataFile = LOCAL\n'
+    return header
+
+#pipeline: reader thread -> converter threads -> writer (main thread),
+#the bounded queues limit the number of frames held in memory
+nthreads = min(threads, len(frames)*len(arraynames))
+tasks   = Queue(maxsize=nthreads)
+results = Queue(maxsize=nthreads)
+errors  = []
+
+def read_frames():
+    # parses the frame headers and checks the geometry
     try:
-        filename = basename+'_'+arrayname+'.mha'
-        with open(os.path.join(dirname,filename), "wb") as f:
-            f.write('ObjectType = Image\n')
-            f.write('NDims='+str(int(ndim))+'\n')
-            f.write('BinaryData = True\n')
-            f.write('BinaryDataByteOrderMSB = False\n')
-            if compressed: 
-                f.write('CompressedData = True\n')
-                f.write('CompressedDataSize = '+str(data_size)+'\n')        
-            else: 
-                f.write('CompressedData = False\n')
-            f.write('TransformMatrix = '+TransformMatrix+'\n')
-            f.write('Offset = '+str(offset3)+' '+str(offset2)+' '+str(offset1)+'\n')    
-            f.write('CenterOfRotation = 0 0 0\n')  
-            f.write('AnatomicalOrientation = LPI\n')
-            f.write('ElementSpacing ='+str(Resolution3)+' '+str(Resolution2)+' '+str(Resolution1)+'\n')  
-            f.write('DimSize = '+str(int(dim3))+' '+str(int(dim2))+' '+str(int(dim1))+'\n')
-            f.write('ElementNumberOfChannels = '+str(int(ncomponents))+'\n')
-            f.write('ElementType = MET_FLOAT\n')     
-            f.write('ElementDataFile = LOCAL\n')  
-            f.write (data)    
-    except: showerror("Write file", "Unable to write output file ",filename);OK=False
-      
-if OK: showinfo("Done", "File convert successful")
-   
+        for index, frame in enumerate(frames):
+            frame_vti = vti if index == 0 else open_vti(frame)
+            if (frame_vti.shape != vti.shape or tuple(frame_vti.spacing) != tuple(vti.spacing) or
+                tuple(frame_vti.origin) != tuple(vti.origin)):
+                raise ValueError('geometry of '+frame+' differs from the first frame')
+            for name in arraynames:
+                if not name in frame_vti.arrays: raise ValueError('array "'+name+'" not found in '+frame)
+                tasks.put((index, frame, frame_vti, name))
+    except Exception as e: errors.append(str(e))
+    for i in range(nthreads): tasks.put(None)
 
+def convert_frames():
+    # decodes, reorders and compresses the arrays (numpy and zlib release the GIL),
+    # the 4D MHA is compressed as one stream by the writer
+    while True:
+        task = tasks.get()
+        if task is None: results.put(None); break
+        index, frame, frame_vti, name = task
+        try:
+            data = frame_vti.read(name) # shape dim1,dim2,dim3,ncomponents, the file order
+            ncomponents = data.shape[3]
+            with Profiling.span('reorder', data.nbytes): data = np.ascontiguousarray(data, dtype='<f4').tobytes()
+            if compressed and not fourD:
+                with Profiling.span('compress', len(data)): data = zlib.compress(data)
+            results.put((index, frame, name, ncomponents, data))
+        except Exception as e:
+            errors.append(frame+': '+str(e)); results.put((index, frame, name, 0, None))
 
+def write_frame(frame, name, ncomponents, data):
+    filename = os.path.splitext(os.path.basename(frame))[0]+'_'+name+'.mha'
+    try:
+        with Profiling.span('write', len(data)), open(os.path.join(os.path.dirname(frame),filename), "wb") as f:
+            f.write(mha_header(ncomponents, len(data)).encode('ascii'))
+            f.write(data)
+    except IOError: return filename, False
+    return filename, True
 
+class SeriesWriter(object):
+    # writes the frames of one series and array in order into a 4D MHA
+    def __init__(self, prefix, name):
+        self.frames = series_frames[prefix]
+        self.filename = prefix+'_'+name+'.mha'
+        self.file = None; self.pending = {}; self.next = 0; self.size = 0
+        self.compressor = zlib.compressobj() if compressed else None
 
+    def add(self, index, ncomponents, data):
+        self.pending[index] = data
+        if self.file is None:
+            self.file = open(os.path.join(dirname,self.filename), "wb")
+            header = mha_header(ncomponents, 0, len(self.frames), time_step(self.frames))
+            self.size_position = header.find('CompressedDataSize = ')+len('CompressedDataSize = ')
+            self.file.write(header.encode('ascii'))
+        while self.next in self.pending:
+            data = self.pending.pop(self.next); self.next += 1
+            if self.compressor:
+                with Profiling.span('compress', len(data)): data = self.compressor.compress(data)
+            with Profiling.span('write', len(data)): self.file.write(data); self.size += len(data)
 
+    def close(self):
+        if self.compressor:
+            data = self.compressor.flush()
+            self.file.write(data); self.size += len(data)
+            # overwrite the placeholder CompressedDataSize of the header
+            self.file.seek(self.size_position)
+            self.file.write(('%020d' % self.size).encode('ascii'))
+        self.file.close()
 
+    def discard(self):
+        # a frame is missing, the header would claim more frames than written
+        self.file.close()
+        os.remove(os.path.join(dirname,self.filename))
 
+reader = threading.Thread(target=read_frames)
+reader.daemon = True; reader.start()
+pool = ThreadPool(nthreads)
+for i in range(nthreads): pool.apply_async(convert_frames)
+writers = dict(((prefix, name), SeriesWriter(prefix, name)) for prefix in series_frames for name in arraynames) if fourD else {}
+OK=True
+failed = set()
+finished = 0
+while finished < nthreads:
+    result = results.get()
+    if result is None: finished += 1; continue
+    index, frame, name, ncomponents, data = result
+    key = (series(frame), name)
+    if data is None or key in failed: OK=False; continue
+    try:
+        if fourD: writers[key].add(position[frame], ncomponents, data)
+        else:
+            filename, written = write_frame(frame, name, ncomponents, data)
+            if written: print ('Successfully written output file "'+filename+'"')
+            else: showerror("Write file", "Unable to write output file "+filename); OK=False
+    except IOError:
+        showerror("Write file", "Unable to write output file "+writers[key].filename); OK=False; failed.add(key)
+pool.close(); pool.join()
+for key in sorted(writers):
+    writer = writers[key]
+    if writer.file is None: continue
+    if key in failed or writer.next != len(writer.frames):
+        try: writer.discard()
+        except (IOError, OSError): pass
+        OK=False; continue
+    try: writer.close()
+    except IOError: showerror("Write file", "Unable to write output file "+writer.filename); OK=False; continue
+    print ('Successfully written output file "'+writer.filename+'" ('+str(len(writer.frames))+' frames)')
+for error in errors: showerror("ERROR", error+' ... operation aborted'); OK=False
+
+if OK: showinfo("Done", "File convert successful")